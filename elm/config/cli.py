@@ -39,7 +39,7 @@ def add_ensemble_kwargs(parser):
                         help='Number of ensemble generations, defaulting to ngen from ensemble_kwargs in config')
 
 def add_run_options(parser):
-    '''Add the --train-only and --predict-only arguments to parser'''
+    '''Add the --train-only, --predict-only and --resume arguments to parser'''
     parser.add_argument_group('Run', 'Run options')
     group = parser.add_mutually_exclusive_group()
     group.add_argument('--train-only', action='store_true',
@@ -47,4 +47,6 @@ def add_run_options(parser):
 
     group.add_argument('--predict-only', action='store_true',
                        help='Run only the prediction, not training, actions specified by config')
+    parser.add_argument('--resume', action='store_true',
+                        help='Resume training actions from their checkpoints in ELM_TRAIN_PATH (the last completed generation), skipping those already trained and saved')
 
@@ -2,22 +2,32 @@
 dask_settings.py is a module of helpers for dask executors
 '''
 import contextlib
+from functools import partial
+import importlib
 import dask.array as da
 import os
 
-from concurrent.futures import as_completed
+from concurrent.futures import as_completed, Future, ThreadPoolExecutor
 from multiprocessing.pool import ThreadPool
-from multiprocessing import Pool
+from multiprocessing.pool import Pool as ProcessPool
+from dask.multiprocessing import get as dask_multiprocessing_get
 from dask.threaded import get as dask_threaded_get
-from dask.async import get_sync
+try:
+    from dask.local import get_sync
+except ImportError:
+    # dask < 0.14 ("async" is a reserved word in Python >= 3.7)
+    get_sync = importlib.import_module('dask.async').get_sync
 
 from dask import delayed as dask_delayed
 from toolz import curry
+import dill
 try:
     from distributed import Executor
+    from distributed import as_completed as distributed_as_completed
+    from distributed import LocalCluster
     from dask.diagnostics import ProgressBar
 except ImportError:
-    Executor = None
+    Executor = distributed_as_completed = LocalCluster = None
 
 from elm.config.env import parse_env_vars
 
@@ -36,35 +46,144 @@ def _find_get_func_for_client(client):
         return get
     elif isinstance(client, ThreadPool):
         return dask_threaded_get
+    elif isinstance(client, ProcessPool):
+        # dill rather than pickle for the lambdas and closures over
+        # Pipeline instances in ensemble / evolve_train graphs
+        return partial(dask_multiprocessing_get, pool=client,
+                       func_dumps=dill.dumps, func_loads=dill.loads)
+    else:
+        raise ValueError('client argument not a thread pool, process pool, dask scheduler or None')
+
+
+def _scatter_func_for_client(client, broadcast=True):
+    '''Return None or, for a distributed client, a function that
+    scatters a list of objects to the workers once (broadcast to all
+    workers by default) and returns a list of futures (None items
+    are not scattered)'''
+    if not (Executor and isinstance(client, Executor)):
+        return None
+    def scatter(items):
+        idx = [i for i, item in enumerate(items) if item is not None]
+        futures = client.scatter([items[i] for i in idx], broadcast=broadcast)
+        out = list(items)
+        for i, future in zip(idx, futures):
+            out[i] = future
+        return out
+    return scatter
+
+
+class _SerialExecutor(object):
+    '''Executor for client None: submit runs func and returns a done Future'''
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def _dill_call(payload):
+    func, args, kwargs = dill.loads(payload)
+    return dill.dumps(func(*args, **kwargs))
+
+
+class _ProcessPoolExecutor(object):
+    '''Executor for a process pool client: each submit waits, in a thread
+    of executor, on a dill-serialized call in a process of pool'''
+    def __init__(self, executor, pool):
+        self._executor = executor
+        self._pool = pool
+
+    def _call(self, payload):
+        return dill.loads(self._pool.apply(_dill_call, (payload,)))
+
+    def submit(self, func, *args, **kwargs):
+        payload = dill.dumps((func, args, kwargs))
+        return self._executor.submit(self._call, payload)
+
+
+@contextlib.contextmanager
+def _executor_for_client(client):
+    '''Yield an executor with a submit(func, \*args) method returning
+    futures for client (None, ThreadPool or distributed Executor)'''
+    if client is None:
+        yield _SerialExecutor()
+    elif Executor and isinstance(client, Executor):
+        yield client
+    elif isinstance(client, ThreadPool):
+        with ThreadPoolExecutor(client._processes) as executor:
+            yield executor
+    elif isinstance(client, ProcessPool):
+        with ThreadPoolExecutor(client._processes) as executor:
+            yield _ProcessPoolExecutor(executor, client)
     else:
-        raise ValueError('client argument not a thread pool dask scheduler or None')
+        raise ValueError('client argument not a thread pool, process pool, dask scheduler or None')
+
+
+def _first_completed(futures):
+    '''Return the first of futures (from _executor_for_client) to finish'''
+    futures = list(futures)
+    if distributed_as_completed is not None and not isinstance(futures[0], Future):
+        return next(iter(distributed_as_completed(futures)))
+    return next(as_completed(futures))
 
 
 @contextlib.contextmanager
 def client_context(dask_client=None, dask_scheduler=None):
-    '''client_context creates a dask distributed or threadpool client or None
+    '''client_context creates a dask distributed, threadpool or
+    process pool client or None
 
     Parameters:
-        dask_client:     str from choices ("DISTRIBUTED", 'THREAD_POOL', 'SERIAL')
-                         or None to take DASK_CLIENT from environment
+        dask_client:     str from choices ("DISTRIBUTED", 'LOCAL_CLUSTER',
+                         'THREAD_POOL', 'PROCESS_POOL', 'SERIAL') or None to
+                         take DASK_CLIENT from environment.  PROCESS_POOL uses
+                         DASK_PROCESSES processes, for steps that hold the GIL.
+                         LOCAL_CLUSTER starts a distributed LocalCluster of
+                         DASK_PROCESSES workers with DASK_THREADS threads each
+                         (no scheduler URL needed), closed on exit
         dask_scheduler:  Distributed scheduler url or None to take
                          DASK_SCHEDULER from environment
     '''
     env = parse_env_vars()
     dask_client = dask_client or env.get('DASK_CLIENT', 'SERIAL')
     dask_scheduler = dask_scheduler or env.get('DASK_SCHEDULER')
+    cluster = None
     if dask_client == 'DISTRIBUTED':
         if Executor is None:
             raise ValueError('distributed is not installed - "conda install distributed"')
         client = Executor(dask_scheduler)
+    elif dask_client == 'LOCAL_CLUSTER':
+        if LocalCluster is None:
+            raise ValueError('distributed is not installed - "conda install distributed"')
+        n_workers = env.get('DASK_PROCESSES')
+        if os.environ.get('DASK_THREADS'):
+            threads = env['DASK_THREADS']
+        else:
+            # DASK_THREADS defaults to the number of CPUs - split them
+            threads = max(1, (os.cpu_count() or 1) // n_workers)
+        cluster = LocalCluster(n_workers=n_workers, threads_per_worker=threads)
+        client = Executor(cluster)
     elif dask_client == 'THREAD_POOL':
         client = ThreadPool(env.get('DASK_THREADS'))
+    elif dask_client == 'PROCESS_POOL':
+        client = ProcessPool(env.get('DASK_PROCESSES'))
     elif dask_client == 'SERIAL':
         client = None
     else:
         raise ValueError('Did not expect DASK_CLIENT to be {}'.format(dask_client))
     get_func = _find_get_func_for_client(client)
-    with da.set_options(pool=dask_client):
-       yield client
+    try:
+        with da.set_options(pool=dask_client):
+           yield client
+    finally:
+        if isinstance(client, ProcessPool) and not isinstance(client, ThreadPool):
+            client.terminate()
+            client.join()
+        if cluster is not None:
+            # Executor.shutdown in older distributed
+            close = getattr(client, 'close', None) or client.shutdown
+            close()
+            cluster.close()
 
 __all__ = ['client_context']
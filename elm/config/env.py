@@ -16,7 +16,7 @@ def process_int_env_var(env_var_name, default='0', required=False):
     '''Process an env var which must be an integer'''
     val = os.environ.get(env_var_name, default)
     try:
-        val = bool(int(val))
+        val = int(val)
     except Exception as e:
         if required:
             raise ElmConfigError('Expected env var {} to be parsed '
@@ -452,6 +452,35 @@ class ConfigParser(object):
                   'init_ensemble_size', 'partial_fit_batches'):
             for k in self.ensembles:
                 self._validate_positive_int(self.ensembles[k].get(f), f)
+        for k, v in self.ensembles.items():
+            self._validate_checkpoint(v.get('checkpoint'),
+                                      'ensembles:{} - checkpoint'.format(k))
+
+    def _validate_checkpoint(self, checkpoint, context):
+        '''Validate "checkpoint" of an ensemble: a bool, an int
+        (checkpoint every this many generations), a file name or a dict
+        of keyword arguments to elm.pipeline.checkpoint.Checkpoint'''
+        if checkpoint is None or isinstance(checkpoint, bool):
+            return
+        if isinstance(checkpoint, int):
+            checkpoint = {'every': checkpoint}
+        elif isinstance(checkpoint, str):
+            checkpoint = {'filename': checkpoint}
+        if not isinstance(checkpoint, dict):
+            raise ElmConfigError('In {} expected a bool, int, file name or '
+                                 'dict but found {}'.format(context, checkpoint))
+        extra = set(checkpoint) - {'filename', 'every', 'resume'}
+        if extra:
+            raise ElmConfigError('In {} unexpected keys {} (expected '
+                                 'filename, every or resume)'.format(context, sorted(extra)))
+        every = checkpoint.get('every', 1)
+        if isinstance(every, bool) or not isinstance(every, int) or every < 1:
+            raise ElmConfigError('In {} expected "every" to be an int >= 1, '
+                                 'not {}'.format(context, every))
+        filename = checkpoint.get('filename')
+        if filename is not None and (not isinstance(filename, str) or not filename):
+            raise ElmConfigError('In {} expected "filename" to be a file '
+                                 'name, not {}'.format(context, filename))
 
     def _validate_model_selection(self):
         '''Validate "model_selection" section of config'''
@@ -465,10 +494,32 @@ class ConfigParser(object):
                                            True,
                                            'model_selection:{} - {}'.format(k, 'func'))
 
+    def _validate_prediction_kwargs(self, kwargs, context):
+        '''Validate prediction_format, blocksize, complevel and chunks
+        given to elm.pipeline.serialize.serialize_prediction'''
+        from elm.pipeline.serialize import PREDICTION_FORMATS
+        fmt = kwargs.get('prediction_format')
+        if fmt is not None and fmt not in PREDICTION_FORMATS:
+            raise ElmConfigError('In {} expected prediction_format to be one of '
+                                 '{}, not {}'.format(context, tuple(PREDICTION_FORMATS), fmt))
+        blocksize = kwargs.get('blocksize')
+        if blocksize is not None and (not isinstance(blocksize, int)
+                                      or blocksize < 16 or blocksize % 16):
+            raise ElmConfigError('In {} expected blocksize to be a positive '
+                                 'multiple of 16, not {}'.format(context, blocksize))
+        complevel = kwargs.get('complevel')
+        if complevel is not None and (not isinstance(complevel, int)
+                                      or not 0 <= complevel <= 9):
+            raise ElmConfigError('In {} expected complevel to be an int '
+                                 'from 0 to 9, not {}'.format(context, complevel))
+        self._validate_positive_int(kwargs.get('chunks'), context + ' - chunks')
+
     def _validate_predict(self):
-        '''Validate the "predict" section of config'''
+        '''Validate the "predict" section of config: keyword arguments
+        to serialize_prediction for all "run" actions with "predict"'''
         self.predict = self.config.get('predict', {}) or {}
-        return True # TODO validate predict config
+        self._validate_type(self.predict, 'predict', dict)
+        self._validate_prediction_kwargs(self.predict, 'predict')
 
     def _validate_pipelines(self):
         '''Validate the "pipelines" section of config'''
@@ -565,6 +616,7 @@ class ConfigParser(object):
             data_source = action.get('data_source') or ''
             if not data_source in self.data_sources:
                 raise ElmConfigError('Expected a data_source key in pipeline action {}'.format(action))
+            self._validate_prediction_kwargs(action, 'run - {}'.format(action))
 
     def validate(self):
         '''Validate all sections of config, calling a function
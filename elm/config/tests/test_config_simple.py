@@ -81,3 +81,45 @@ def test_bad_pipeline():
     # TODO more tests on valid operations
     # e.g. train, predict, resample, etc
 
+
+
+def test_bad_prediction_kwargs():
+    bad_config = copy.deepcopy(DEFAULTS)
+    for item in NOT_DICT:
+        bad_config['predict'] = item
+        bad_config = tst_bad_config(bad_config)
+    for key, item in (('prediction_format', 'csv'),
+                      ('blocksize', 100),
+                      ('blocksize', 'abc'),
+                      ('complevel', 10),
+                      ('chunks', 'abc')):
+        bad_config['predict'] = {key: item}
+        bad_config = tst_bad_config(bad_config)
+        bad_config['run'][0][key] = item
+        bad_config = tst_bad_config(bad_config)
+    ok_config = copy.deepcopy(DEFAULTS)
+    ok_config['predict'] = {'prediction_format': 'geotiff', 'blocksize': 256}
+    ok_config['run'][0]['complevel'] = 6
+    tmp, config_file = dump_config(ok_config)
+    try:
+        config = ConfigParser(config_file)
+        assert config.predict['prediction_format'] == 'geotiff'
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_ensemble_checkpoint_config():
+    k = tuple(DEFAULTS['ensembles'].keys())[0]
+    bad_config = copy.deepcopy(DEFAULTS)
+    for item in (0, -1, '', [2,], 2.2, {'every': 0}, {'every': 'abc'},
+                 {'filename': 2}, {'not_a_key': 1}):
+        bad_config['ensembles'][k]['checkpoint'] = item
+        bad_config = tst_bad_config(bad_config)
+    for item in (True, False, 5, 'x.checkpoint', {'every': 2, 'resume': True}):
+        ok_config = copy.deepcopy(DEFAULTS)
+        ok_config['ensembles'][k]['checkpoint'] = item
+        tmp, config_file = dump_config(ok_config)
+        try:
+            ConfigParser(config_file)
+        finally:
+            shutil.rmtree(tmp)
@@ -15,6 +15,7 @@ import logging
 import warnings
 
 import attr
+from deap import algorithms
 from deap import base
 from deap import creator
 from deap import tools
@@ -573,7 +574,7 @@ def eval_stop_wrapper(evo_params, original_fitness):
     return eval_stop
 
 
-def ea_general(evo_params, cxpb, mutpb, ngen, k):
+def ea_general(evo_params, cxpb, mutpb, ngen, k, state=None):
     '''This is a general EA based on an NSGA2 example from deap: /
         https://github.com/DEAP/deap/blob/master/examples/ga/nsga2.py
 
@@ -585,58 +586,86 @@ def ea_general(evo_params, cxpb, mutpb, ngen, k):
         :ngen:    number of generations (int) /
                      (Note: the loop here starts at generation 1 not zero)
         :mu:      population size
+        :state:   None or a dict updated before each yield after the
+                  first with the generation, population, offspring,
+                  param_history and original fitness, so that it can be
+                  checkpointed.  Given a dict saved that way, the first
+                  yield is of that generation's (pop, invalid_ind,
+                  param_history) and the EA continues from there
     '''
+    global LAST_TAG_IDX
     toolbox = evo_params.toolbox
-    param_history = []
-    # This is just to assign the crowding distance to the individuals
-    # no actual selection is done
-    pop = invalid_ind = evo_init_func(evo_params)
-
     deap_params = evo_params.deap_params
+    state = {} if state is None else state
+    offspring = None
+    if state.get('gen'):
+        # resume (elm.pipeline.checkpoint) waiting on the fitnesses
+        # of offspring of generation state['gen']
+        start = state['gen']
+        pop = state['pop']
+        offspring = state['offspring']
+        param_history = state['param_history']
+        original_fitness = state['original_fitness']
+        # do not reuse the names of checkpointed individuals
+        LAST_TAG_IDX = max(LAST_TAG_IDX, state['last_tag_idx'])
+    else:
+        start = 1
+        param_history = []
+        # This is just to assign the crowding distance to the individuals
+        # no actual selection is done
+        pop = invalid_ind = evo_init_func(evo_params)
 
-    assign_names(pop)
-    fitnesses = (yield (pop, invalid_ind, param_history))
-    assign_check_fitness(invalid_ind, fitnesses,
-                     param_history, deap_params['choices'],
-                     evo_params.score_weights)
-    # Forces assignment of crowding distance for
-    # NSGA2 - no selection is done here
-    pop = toolbox.select(pop, len(pop))
-    # Find the best in original population for
-    # comparison on stop conditions
-    temp_pop = copy.deepcopy(pop)
-    original_fitness = toolbox.select(temp_pop, 1)[0].fitness.values
-    del temp_pop
+        assign_names(pop)
+        fitnesses = (yield (pop, invalid_ind, param_history))
+        assign_check_fitness(invalid_ind, fitnesses,
+                         param_history, deap_params['choices'],
+                         evo_params.score_weights)
+        # Forces assignment of crowding distance for
+        # NSGA2 - no selection is done here
+        pop = toolbox.select(pop, len(pop))
+        # Find the best in original population for
+        # comparison on stop conditions
+        temp_pop = copy.deepcopy(pop)
+        original_fitness = toolbox.select(temp_pop, 1)[0].fitness.values
+        del temp_pop
     eval_stop = eval_stop_wrapper(evo_params, original_fitness)
-    for gen in range(1, ngen):
-        offspring1 = tools.selTournamentDCD(pop, len(pop))
-
-        offspring2 = [toolbox.clone(ind) for ind in offspring1]
-        offspring3 = []
-        for off1, off2 in zip(offspring1, offspring2):
-            off2.name = off1.name
-            offspring3.append(off2)
-        offspring = offspring3
-        try:
-            for ind1, ind2 in zip(offspring[::2], offspring[1::2]):
-                if random.random() <= cxpb:
-                    toolbox.mate(ind1, ind2)
-                if random.random() < mutpb:
-                    toolbox.mutate(ind1)
-                if random.random() < mutpb:
-                    toolbox.mutate(ind2)
-                del ind1.fitness.values, ind2.fitness.values
-        except ParamsSamplingError:
-            logger.info('Evolutionary algorithm exited early (cannot find parameter set that has not been tried yet)')
-            break
-        # Evaluate the individuals with an invalid fitness
-
-        # Expect the fitnesses to be sent here
-        # with ea_gen.send(fitnesses)
-        if not isinstance(invalid_ind, list) or not invalid_ind or not invalid_ind[0] or not all(isinstance(p, int) for p in invalid_ind[0]):
-            raise ValueError('Expected .send to be called with a list of tuples/lists of ints')
-        invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
-        assign_names(invalid_ind)
+    for gen in range(start, ngen):
+        if offspring is not None:
+            # resumed - offspring were bred before the checkpoint
+            invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
+        else:
+            offspring1 = tools.selTournamentDCD(pop, len(pop))
+
+            offspring2 = [toolbox.clone(ind) for ind in offspring1]
+            offspring3 = []
+            for off1, off2 in zip(offspring1, offspring2):
+                off2.name = off1.name
+                offspring3.append(off2)
+            offspring = offspring3
+            try:
+                for ind1, ind2 in zip(offspring[::2], offspring[1::2]):
+                    if random.random() <= cxpb:
+                        toolbox.mate(ind1, ind2)
+                    if random.random() < mutpb:
+                        toolbox.mutate(ind1)
+                    if random.random() < mutpb:
+                        toolbox.mutate(ind2)
+                    del ind1.fitness.values, ind2.fitness.values
+            except ParamsSamplingError:
+                logger.info('Evolutionary algorithm exited early (cannot find parameter set that has not been tried yet)')
+                break
+            # Evaluate the individuals with an invalid fitness
+
+            # Expect the fitnesses to be sent here
+            # with ea_gen.send(fitnesses)
+            if not isinstance(invalid_ind, list) or not invalid_ind or not invalid_ind[0] or not all(isinstance(p, int) for p in invalid_ind[0]):
+                raise ValueError('Expected .send to be called with a list of tuples/lists of ints')
+            invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
+            assign_names(invalid_ind)
+        state.update(gen=gen, pop=pop, offspring=offspring,
+                     param_history=param_history,
+                     original_fitness=original_fitness,
+                     last_tag_idx=LAST_TAG_IDX)
         fitnesses = (yield (pop, invalid_ind, param_history))
         # Assign the fitnesses to the invalid_ind
         # evaluated
@@ -653,9 +682,89 @@ def ea_general(evo_params, cxpb, mutpb, ngen, k):
             break
         # Select the next generation population
         pop = toolbox.select(pop + offspring, len(pop))
+        offspring = None
         #logger.info(logbook.stream)
     # Yield finally the record and logbook
     # The caller knows when not to .send again
     # based on the None in 2nd position below
     logger.info('Evolutionary algorithm finished')
     yield (pop, None, param_history)
+
+
+def _breed(toolbox, pop, n, cxpb, mutpb):
+    '''Return n offspring of parents chosen from pop with toolbox.select,
+    varied with deap.algorithms.varAnd (crossover and mutation).
+    Offspring that varAnd leaves unchanged are not returned'''
+    if cxpb <= 0 and mutpb <= 0:
+        raise ParamsSamplingError('Cannot breed new param sets with cxpb and mutpb of 0')
+    offspring = []
+    while len(offspring) < n:
+        parents = toolbox.select(pop, max(2, n - len(offspring)))
+        children = algorithms.varAnd(parents, toolbox, cxpb, mutpb)
+        offspring.extend(ind for ind in children if not ind.fitness.valid)
+    return offspring[:n]
+
+
+def ea_steady_state(evo_params, cxpb, mutpb, ngen, k):
+    '''Asynchronous steady-state variant of ea_general.  Rather than
+    waiting on a generation of fits, the caller sends a list of
+    (individual, fitness) tuples for any individuals evaluated so far
+    and the generator breeds as many new individuals from the
+    population of evaluated individuals, so that the number of fits
+    in progress stays constant.
+
+    Yields (pop, new_ind, param_history) like ea_general, where new_ind
+    may be empty while fits are in progress and is None after
+    ngen * mu individuals have been evaluated or on early stop.
+
+    Parameters:
+        Same as ea_general
+    '''
+    toolbox = evo_params.toolbox
+    deap_params = evo_params.deap_params
+    param_history = []
+    new_ind = evo_init_func(evo_params)
+    assign_names(new_ind)
+    mu = len(new_ind)
+    budget = ngen * mu
+    n_yielded = mu
+    n_evaluated = 0
+    pop = []
+    eval_stop = None
+    sampling_done = False
+    while True:
+        evaluated = (yield (pop, new_ind, param_history))
+        if not evaluated or not all(isinstance(item, Sequence) and len(item) == 2
+                                    for item in evaluated):
+            raise ValueError('Expected .send to be called with a list of (individual, fitness) tuples')
+        inds, fitnesses = map(list, zip(*evaluated))
+        assign_check_fitness(inds, fitnesses,
+                             param_history, deap_params['choices'],
+                             evo_params.score_weights)
+        n_evaluated += len(inds)
+        pop = toolbox.select(pop + inds, min(mu, len(pop) + len(inds)))
+        if eval_stop is None:
+            if n_evaluated >= mu:
+                temp_pop = copy.deepcopy(pop)
+                original_fitness = toolbox.select(temp_pop, 1)[0].fitness.values
+                eval_stop = eval_stop_wrapper(evo_params, original_fitness)
+        elif any(eval_stop(fitness) for fitness in fitnesses):
+            logger.info('Stopping: early_stop: {}'.format(evo_params.early_stop))
+            break
+        if n_evaluated >= n_yielded and (sampling_done or n_yielded >= budget):
+            break
+        new_ind = []
+        n_new = min(len(inds), budget - n_yielded)
+        if n_new > 0 and not sampling_done:
+            try:
+                new_ind = _breed(toolbox, pop, n_new, cxpb, mutpb)
+            except ParamsSamplingError:
+                logger.info('Evolutionary algorithm stops breeding (cannot find parameter set that has not been tried yet)')
+                sampling_done = True
+        if not new_ind and n_evaluated >= n_yielded:
+            break
+        assign_names(new_ind)
+        n_yielded += len(new_ind)
+    logger.info('Evolutionary algorithm finished ({} individuals '
+                'evaluated)'.format(n_evaluated))
+    yield (pop, None, param_history)
@@ -0,0 +1,100 @@
+'''
+----------------------------
+
+``elm.model_selection.fitness_cache``
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Cache of fitnesses (scores) from evolve_train keyed by the parameter
+values of an individual, the sample(s) it was fit to and the scoring
+function.  Individuals that repeat a parameter set already evaluated on
+the same sample, e.g. after crossover, take the cached fitness instead
+of being fit again.
+
+Give ``fitness_cache`` to ``Pipeline.fit_ea`` / ``evolve_train`` as:
+
+    * True (default): in memory for one evolve_train call
+    * A file name: a JSON file that is loaded if it exists and saved
+      after each generation, so a restarted EA run does not repeat
+      fits.  Use a different file for each Pipeline configuration
+    * False or None: no cache
+'''
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['FitnessCache']
+
+
+class FitnessCache(object):
+    '''Fitnesses keyed by params, sample and scoring
+
+    Parameters:
+        :filename: None for an in-memory cache or a JSON file name
+    '''
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.hits = 0
+        self._fitnesses = {}
+        if filename and os.path.exists(filename):
+            with open(filename) as f:
+                self._fitnesses = json.load(f)
+            logger.info('Loaded {} fitnesses from {}'.format(len(self), filename))
+
+    def __len__(self):
+        return len(self._fitnesses)
+
+    def __contains__(self, key):
+        return key in self._fitnesses
+
+    @staticmethod
+    def key(param_order, values, sample_tokens, scoring=None):
+        '''Hash of param names and values, sample tokens
+        (see elm.sample_util.samplers.sample_token) and scoring name'''
+        scoring = getattr(scoring, '__name__', scoring)
+        token = repr((sorted(zip(param_order, map(repr, values))),
+                      list(sample_tokens),
+                      repr(scoring)))
+        return hashlib.sha1(token.encode()).hexdigest()
+
+    def get(self, key):
+        '''Return the list of fitness values for key or None'''
+        fit = self._fitnesses.get(key)
+        if fit is not None:
+            self.hits += 1
+        return fit
+
+    def set(self, key, fitness):
+        '''Store a fitness (Sequence of numbers) for key'''
+        self._fitnesses[key] = [float(f) for f in fitness]
+
+    def save(self):
+        '''Write the cache to filename (if given)'''
+        if not self.filename:
+            return
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._fitnesses, f)
+        os.replace(tmp, self.filename)
+
+    def __repr__(self):
+        return '<elm.model_selection.fitness_cache.FitnessCache> {} fitnesses, {} hits ({})'.format(len(self), self.hits, self.filename)
+
+
+def as_fitness_cache(fitness_cache):
+    '''Return a FitnessCache or None from the fitness_cache argument
+    of evolve_train (see module docstring)'''
+    if fitness_cache is None or fitness_cache is False:
+        return None
+    if fitness_cache is True:
+        return FitnessCache()
+    if isinstance(fitness_cache, str):
+        return FitnessCache(filename=fitness_cache)
+    if isinstance(fitness_cache, FitnessCache):
+        return fitness_cache
+    raise ValueError('Expected fitness_cache to be None, True, a file name or a FitnessCache, not {}'.format(fitness_cache))
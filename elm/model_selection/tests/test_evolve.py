@@ -1,7 +1,9 @@
 import copy
 from io import StringIO
 from itertools import product
+import random
 
+import dill
 import pytest
 from sklearn.cluster import MiniBatchKMeans
 import yaml
@@ -14,7 +16,9 @@ from elm.model_selection.evolve import (get_param_grid,
                                         ea_setup,
                                         evo_init_func,
                                         ea_general,
-                                        assign_check_fitness)
+                                        ea_steady_state,
+                                        assign_check_fitness,
+                                        _breed)
 from elm.model_selection.tests.evolve_example_config import CONFIG_STR
 
 
@@ -126,6 +130,91 @@ def test_ea_general(fitnesses, score_weights):
     assert original_pop != pop
 
 
+def test_ea_steady_state():
+    '''ea_steady_state breeds one new individual for each fitness
+    sent, with fitnesses sent out of order, and stops after ngen * mu
+    individuals'''
+    config = yaml.load(CONFIG_STR)
+    config['model_scoring']['testing_model_scoring']['score_weights'] = [-1]
+    config['param_grids']['example_param_grid']['control'].pop('early_stop', None)
+    config, evo_params = tst_evo_setup_evo_init_func(config=ConfigParser(config=config))
+    control = evo_params.deap_params['control']
+    ea_gen = ea_steady_state(evo_params,
+                             control['cxpb'],
+                             control['mutpb'],
+                             control['ngen'],
+                             control['k'])
+    pop, new_ind, param_history = next(ea_gen)
+    assert not pop and len(new_ind) == control['mu']
+    pending = list(new_ind)
+    n_evaluated = 0
+    while new_ind is not None:
+        ind = pending.pop()
+        n_evaluated += 1
+        pop, new_ind, param_history = ea_gen.send([(ind, (sum(ind),))])
+        if new_ind:
+            assert len(new_ind) == 1
+            assert not new_ind[0].fitness.valid
+            pending.extend(new_ind)
+        assert len(pop) <= control['mu']
+    assert not pending
+    assert n_evaluated == len(param_history) == control['mu'] * control['ngen']
+    assert len(pop) == control['mu']
+    best = min(sum(ind) for ind in pop)
+    assert best == min(row[-1] for row in param_history)
+
+
+def test_breed_uses_toolbox_select():
+    '''_breed picks parents with toolbox.select and returns only
+    offspring changed by crossover or mutation'''
+    config = yaml.load(CONFIG_STR)
+    config['model_scoring']['testing_model_scoring']['score_weights'] = [-1]
+    config, evo_params = tst_evo_setup_evo_init_func(config=ConfigParser(config=config))
+    toolbox = evo_params.toolbox
+    pop = evo_init_func(evo_params)
+    for ind in pop:
+        ind.fitness.values = (sum(ind),)
+    select = toolbox.select
+    selected = []
+    def recording_select(individuals, k):
+        selected.append(k)
+        return select(individuals, k)
+    toolbox.select = recording_select
+    offspring = _breed(toolbox, pop, 3, 0.9, 0.9)
+    assert selected
+    assert len(offspring) == 3
+    assert not any(ind.fitness.valid for ind in offspring)
+
+
+def test_ea_general_resume():
+    '''ea_general given a copy of its state (as checkpointed after a
+    generation) continues as the original would'''
+    config = yaml.load(CONFIG_STR)
+    config['model_scoring']['testing_model_scoring']['score_weights'] = [-1]
+    control = config['param_grids']['example_param_grid']['control']
+    control.pop('early_stop', None)
+    control['ngen'] = 4
+    config, evo_params = tst_evo_setup_evo_init_func(config=ConfigParser(config=config))
+    control = evo_params.deap_params['control']
+    args = [evo_params] + [control[k] for k in ('cxpb', 'mutpb', 'ngen', 'k')]
+    fitness = lambda inds: [(sum(ind),) for ind in inds]
+    state = {}
+    ea_gen = ea_general(*args, state=state)
+    pop, invalid_ind, _ = next(ea_gen)
+    pop, invalid_ind, _ = ea_gen.send(fitness(pop))
+    assert state['gen'] == 1
+    saved = dill.loads(dill.dumps(state))
+    random_state = random.getstate()
+    pop, _, param_history = ea_gen.send(fitness(invalid_ind))
+    random.setstate(random_state)
+    resumed = ea_general(*args, state=saved)
+    _, invalid_ind2, _ = next(resumed)
+    assert [list(ind) for ind in invalid_ind2] == [list(ind) for ind in invalid_ind]
+    pop2, _, param_history2 = resumed.send(fitness(invalid_ind2))
+    assert [list(ind) for ind in pop2] == [list(ind) for ind in pop]
+    assert param_history2 == param_history
+
+
 def set_key_tst_bad_config_once(key, bad):
     config2 = yaml.load(CONFIG_STR)
     d = config2
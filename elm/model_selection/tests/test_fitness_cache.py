@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+from elm.model_selection.fitness_cache import FitnessCache, as_fitness_cache
+
+
+def test_fitness_cache_key():
+    key = FitnessCache.key(('a', 'b'), (1, 'x'), ['sample_0'], 'f')
+    assert key == FitnessCache.key(('b', 'a'), ('x', 1), ['sample_0'], 'f')
+    assert key != FitnessCache.key(('a', 'b'), (2, 'x'), ['sample_0'], 'f')
+    assert key != FitnessCache.key(('a', 'b'), (1, 'x'), ['sample_1'], 'f')
+    assert key != FitnessCache.key(('a', 'b'), (1, 'x'), ['sample_0'], 'g')
+
+
+def test_fitness_cache_save_load(tmpdir):
+    fname = os.path.join(str(tmpdir), 'fitness', 'cache.json')
+    cache = as_fitness_cache(fname)
+    key = cache.key(('a',), (1,), ['sample_0'])
+    assert cache.get(key) is None
+    cache.set(key, (0.5, 2))
+    cache.save()
+    assert os.path.exists(fname)
+    cache = FitnessCache(filename=fname)
+    assert len(cache) == 1
+    assert cache.get(key) == [0.5, 2.0]
+    assert cache.hits == 1
+
+
+def test_as_fitness_cache():
+    assert as_fitness_cache(None) is None
+    assert as_fitness_cache(False) is None
+    cache = as_fitness_cache(True)
+    assert isinstance(cache, FitnessCache) and cache.filename is None
+    assert as_fitness_cache(cache) is cache
+    with pytest.raises(ValueError):
+        as_fitness_cache(1)
@@ -0,0 +1,119 @@
+'''
+----------------------
+
+``elm.pipeline.checkpoint``
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Checkpoints of long ``ensemble`` (``Pipeline.fit_ensemble``) and
+``evolve_train`` (``Pipeline.fit_ea``) runs.  After every ``every``
+generations the fitted models, the EA population and
+``param_history`` (evolve_train), the order in which samples are
+used by generation and the ``random`` / ``numpy.random`` states are
+dill dumped to one file.  A run given the same checkpoint with
+``resume=True`` continues after the last checkpointed generation.
+The file is removed when the run finishes.
+
+Give ``checkpoint`` to ``fit_ensemble`` / ``fit_ea`` as:
+
+    * None or False (default): no checkpoints
+    * A file name: checkpoint each generation, do not resume
+    * A dict of keyword arguments to :class:`Checkpoint`, e.g.
+      ``{'filename': 'kmeans.checkpoint', 'every': 5, 'resume': True}``
+    * A :class:`Checkpoint` instance
+
+``elm-main`` checkpoints each ``train`` action of the ``run``
+section to ``<ELM_TRAIN_PATH>/<train tag>.checkpoint`` and resumes
+from it with ``--resume``.
+'''
+import logging
+import os
+import random
+
+import dill
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['Checkpoint']
+
+CHECKPOINT_EXT = '.checkpoint'
+
+
+class Checkpoint(object):
+    '''Periodic checkpoint of an ensemble or evolve_train run
+
+    Parameters:
+        :filename: file name of the checkpoint
+        :every:    checkpoint after every this many generations
+        :resume:   if True, load returns the state saved by a
+                   previous run (if filename exists)
+    '''
+    def __init__(self, filename, every=1, resume=False):
+        if not filename:
+            raise ValueError('Expected a checkpoint filename')
+        if not isinstance(every, int) or every < 1:
+            raise ValueError('Expected checkpoint "every" to be an int >= 1, not {}'.format(every))
+        self.filename = filename
+        self.every = every
+        self.resume = resume
+
+    def load(self):
+        '''Return the dict of state given to save by a previous
+        run, restoring the random states, or None'''
+        if not self.resume or not os.path.exists(self.filename):
+            return None
+        with open(self.filename, 'rb') as f:
+            state = dill.load(f)
+        random.setstate(state.pop('random_state'))
+        np.random.set_state(state.pop('np_random_state'))
+        logger.info('Resume from generation {} checkpoint {}'.format(state['gen'], self.filename))
+        return state
+
+    def save(self, gen, ngen=None, **state):
+        '''Save state after generation gen (index from 0) if gen is
+        a multiple of every (less one) and not the last generation'''
+        if (gen + 1) % self.every or (ngen is not None and gen + 1 >= ngen):
+            return False
+        state = dict(state, gen=gen,
+                     random_state=random.getstate(),
+                     np_random_state=np.random.get_state())
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            dill.dump(state, f)
+        os.replace(tmp, self.filename)
+        logger.info('Checkpoint generation {} to {}'.format(gen, self.filename))
+        return True
+
+    def clear(self):
+        '''Remove the checkpoint file (after a run finishes)'''
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def __repr__(self):
+        return '<elm.pipeline.checkpoint.Checkpoint> {} (every {}, resume {})'.format(self.filename, self.every, self.resume)
+
+
+def as_checkpoint(checkpoint):
+    '''Return a Checkpoint or None from the checkpoint argument
+    of ensemble or evolve_train (see module docstring)'''
+    if checkpoint is None or checkpoint is False:
+        return None
+    if isinstance(checkpoint, str):
+        return Checkpoint(checkpoint)
+    if isinstance(checkpoint, dict):
+        return Checkpoint(**checkpoint)
+    if isinstance(checkpoint, Checkpoint):
+        return checkpoint
+    raise ValueError('Expected checkpoint to be None, a file name, a dict or a Checkpoint, not {}'.format(checkpoint))
+
+
+def sample_order(n_samples, shuffle):
+    '''Return a permutation (list) of range(n_samples) made with
+    shuffle (random.shuffle or numpy.random.shuffle).  Checkpoints store
+    it so a resumed run uses samples in the same order by generation'''
+    order = list(range(n_samples))
+    shuffle(order)
+    return order
@@ -0,0 +1,305 @@
+'''
+----------------------
+
+``elm.pipeline.compact``
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+Compact save format for a Pipeline and its ensemble members, used by
+``Pipeline.save`` / ``Pipeline.load`` for names ending in ".elm" and by
+:func:`elm.pipeline.serialize.serialize_pipe`.
+
+A saved Pipeline is a directory of:
+
+    * ``manifest.json``: steps, classes and params of the Pipeline and
+      each member of its ensemble, and the offset, shape and dtype of
+      each array in ``arrays.bin``
+    * ``arrays.bin``: the numpy arrays of fitted steps (such as
+      ``cluster_centers_`` or PCA ``components_``) back to back, read
+      with ``numpy.memmap`` (copy-on-write).  Arrays are keyed by a
+      hash of their content and each distinct array is stored once,
+      so members sharing fitted steps (e.g. the same StandardScaler
+      fit on the same sample) reference one copy
+    * ``pipeline.pkl``, ``members/<index>.pkl``: dill pickles of the
+      Pipeline and each member with the arrays left out
+    * ``re_init/<index>.pkl``: the ``_re_init_args_kwargs`` (unfitted
+      steps) of the members, each distinct one stored once
+
+Members of the ensemble are loaded on first access (see
+:class:`LazyEnsemble`), so a ``--predict-only`` run does not unpickle
+all members, nor read all their arrays, before predicting.
+'''
+from collections import Sequence
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import dill
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['save_compact', 'load_compact', 'is_compact', 'LazyEnsemble']
+
+COMPACT_EXT = '.elm'
+COMPACT_VERSION = 1
+MANIFEST = 'manifest.json'
+ARRAYS = 'arrays.bin'
+
+# smaller arrays stay in the pickles
+MIN_BLOB_ARRAY_BYTES = 128
+# offset alignment of arrays in arrays.bin
+ARRAY_ALIGN = 64
+
+
+def is_compact(path):
+    '''True if path is a directory written by save_compact'''
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def _class_name(obj):
+    cls = obj.__class__
+    return '{}.{}'.format(cls.__module__, cls.__name__)
+
+
+def _step_manifest(pipe):
+    '''JSON-able names, classes and params of the steps of pipe'''
+    steps = []
+    for name, step in getattr(pipe, 'steps', ()):
+        spec = {'name': name, 'class': _class_name(step)}
+        estimator = getattr(step, '_estimator', None)
+        if estimator is not None:
+            spec['estimator'] = _class_name(estimator)
+        params = step.get_params() if hasattr(step, 'get_params') else {}
+        spec['params'] = json.loads(json.dumps(params, default=repr))
+        steps.append(spec)
+    return steps
+
+
+def _array_key(arr, order):
+    '''Hash of the dtype, shape and content of arr'''
+    h = hashlib.sha1()
+    h.update(repr((arr.dtype.str, arr.shape, order)).encode())
+    h.update(arr.tobytes(order=order))
+    return h.hexdigest()
+
+
+class _ArrayBlob(object):
+    '''Writes arrays back to back to an open file, recording
+    their offset, shape and dtype by content hash.  Arrays with
+    the same content are written once'''
+    def __init__(self, f):
+        self._f = f
+        self._ids = {}
+        self._refs = []
+        self.arrays = {}
+        self.referenced = self.referenced_bytes = 0
+
+    def add(self, arr):
+        self.referenced += 1
+        self.referenced_bytes += arr.nbytes
+        key = self._ids.get(id(arr))
+        if key is not None:
+            return key
+        order = 'F' if arr.flags.f_contiguous and not arr.flags.c_contiguous else 'C'
+        key = _array_key(arr, order)
+        if key not in self.arrays:
+            self._write(key, arr, order)
+        self._ids[id(arr)] = key
+        self._refs.append(arr) # keep id(arr) from being reused
+        return key
+
+    @property
+    def stored_bytes(self):
+        return sum(spec['nbytes'] for spec in self.arrays.values())
+
+    def stats(self):
+        return {'referenced': self.referenced,
+                'referenced_bytes': self.referenced_bytes,
+                'stored': len(self.arrays),
+                'stored_bytes': self.stored_bytes}
+
+    def _write(self, key, arr, order):
+        offset = self._f.tell()
+        pad = -offset % ARRAY_ALIGN
+        self._f.write(b'\0' * pad)
+        offset += pad
+        self._f.write(arr.tobytes(order=order))
+        self.arrays[key] = {'offset': offset,
+                            'shape': list(arr.shape),
+                            'dtype': arr.dtype.str,
+                            'order': order,
+                            'nbytes': arr.nbytes}
+
+
+class _BlobPickler(dill.Pickler):
+    '''dill Pickler that puts large numpy arrays in an _ArrayBlob'''
+    def __init__(self, f, blob):
+        super(_BlobPickler, self).__init__(f, protocol=dill.HIGHEST_PROTOCOL)
+        self._blob = blob
+
+    def persistent_id(self, obj):
+        if (type(obj) in (np.ndarray, np.memmap) and not obj.dtype.hasobject
+                and obj.nbytes >= MIN_BLOB_ARRAY_BYTES):
+            return self._blob.add(obj)
+        return None
+
+
+class _BlobUnpickler(dill.Unpickler):
+    '''dill Unpickler taking arrays from a _CompactStore'''
+    def __init__(self, f, store):
+        super(_BlobUnpickler, self).__init__(f)
+        self._store = store
+
+    def persistent_load(self, pid):
+        return self._store.array(pid)
+
+
+def _dump(obj, fname, blob):
+    with open(fname, 'wb') as f:
+        _BlobPickler(f, blob).dump(obj)
+
+
+def save_compact(pipe, path):
+    '''Save a Pipeline (and its ensemble, if fitted) to directory path
+
+    Parameters:
+        :pipe: elm.pipeline.Pipeline instance
+        :path: directory name (replaced if it exists)
+
+    Returns:
+        :path: directory written
+    '''
+    tmp = path.rstrip(os.sep) + '.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(os.path.join(tmp, 'members'))
+    os.makedirs(os.path.join(tmp, 're_init'))
+    state = dict(pipe.__dict__)
+    ensemble = state.pop('ensemble', None)
+    manifest = {'version': COMPACT_VERSION,
+                'class': _class_name(pipe),
+                'steps': _step_manifest(pipe),
+                'ensemble': None,
+                're_init': []}
+    re_init_hashes = {}
+    with open(os.path.join(tmp, ARRAYS), 'wb') as f:
+        blob = _ArrayBlob(f)
+        _dump((pipe.__class__, state), os.path.join(tmp, 'pipeline.pkl'), blob)
+        if ensemble is not None:
+            manifest['ensemble'] = []
+            for idx, (tag, member) in enumerate(ensemble):
+                member_state = dict(member.__dict__)
+                re_init = member_state.pop('_re_init_args_kwargs', None)
+                re_init_bytes = dill.dumps(re_init)
+                digest = hashlib.sha1(re_init_bytes).hexdigest()
+                if digest not in re_init_hashes:
+                    re_init_hashes[digest] = len(manifest['re_init'])
+                    fname = os.path.join('re_init', '{}.pkl'.format(len(manifest['re_init'])))
+                    with open(os.path.join(tmp, fname), 'wb') as f2:
+                        f2.write(re_init_bytes)
+                    manifest['re_init'].append(fname)
+                fname = os.path.join('members', '{}.pkl'.format(idx))
+                _dump((member.__class__, member_state), os.path.join(tmp, fname), blob)
+                manifest['ensemble'].append({'tag': tag,
+                                             'pickle': fname,
+                                             're_init': re_init_hashes[digest],
+                                             'steps': _step_manifest(member)})
+        manifest['arrays'] = blob.arrays
+        manifest['array_stats'] = blob.stats()
+    with open(os.path.join(tmp, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+    stats = manifest['array_stats']
+    logger.info('Saved {} with {} ensemble members to {}: {} distinct '
+                'arrays ({} bytes) of {} referenced ({} bytes)'.format(
+                manifest['class'], len(manifest['ensemble'] or ()), path,
+                stats['stored'], stats['stored_bytes'],
+                stats['referenced'], stats['referenced_bytes']))
+    return path
+
+
+class _CompactStore(object):
+    '''Reads the manifest, arrays and pickles of a compact save directory'''
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self.mmap = mmap
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+
+    def array(self, key):
+        '''Return an array by key.  Each call maps (or reads) the
+        array separately, so in-place changes to the array of one
+        member, e.g. by partial_fit, do not change other members
+        sharing it.  Unchanged pages of memory maps are shared'''
+        spec = self.manifest['arrays'][key]
+        fname = os.path.join(self.path, ARRAYS)
+        dtype = np.dtype(spec['dtype'])
+        shape = tuple(spec['shape'])
+        if self.mmap:
+            return np.memmap(fname, dtype=dtype, mode='c', offset=spec['offset'],
+                             shape=shape, order=spec['order'])
+        with open(fname, 'rb') as f:
+            f.seek(spec['offset'])
+            data = f.read(spec['nbytes'])
+        return np.frombuffer(data, dtype=dtype).reshape(shape, order=spec['order']).copy(order='K')
+
+    def load(self, fname):
+        with open(os.path.join(self.path, fname), 'rb') as f:
+            cls, state = _BlobUnpickler(f, self).load()
+        obj = cls.__new__(cls)
+        obj.__dict__.update(state)
+        return obj
+
+    def load_member(self, idx):
+        spec = self.manifest['ensemble'][idx]
+        member = self.load(spec['pickle'])
+        with open(os.path.join(self.path, self.manifest['re_init'][spec['re_init']]), 'rb') as f:
+            member._re_init_args_kwargs = dill.load(f)
+        return (spec['tag'], member)
+
+
+class LazyEnsemble(Sequence):
+    '''Sequence of (tag, Pipeline) ensemble members of a Pipeline
+    loaded by load_compact.  Each member is loaded on first access'''
+    def __init__(self, store):
+        self._store = store
+        self._members = {}
+
+    def __len__(self):
+        return len(self._store.manifest['ensemble'])
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        idx = range(len(self))[idx]
+        if idx not in self._members:
+            self._members[idx] = self._store.load_member(idx)
+        return self._members[idx]
+
+    def __repr__(self):
+        return '<elm.pipeline.compact.LazyEnsemble> {} members ({} loaded) from {}'.format(len(self), len(self._members), self._store.path)
+
+
+def load_compact(path, mmap=True):
+    '''Load a Pipeline saved with save_compact
+
+    Parameters:
+        :path: directory written by save_compact
+        :mmap: if True (default) memory-map (copy-on-write) the
+               arrays of fitted steps, otherwise read them
+
+    Returns:
+        :Pipeline: with a LazyEnsemble "ensemble" attribute if it
+                   was saved with an ensemble
+    '''
+    if not is_compact(path):
+        raise IOError('Cannot load from {} (not a compact saved Pipeline)'.format(path))
+    store = _CompactStore(path, mmap=mmap)
+    pipe = store.load('pipeline.pkl')
+    if store.manifest['ensemble'] is not None:
+        pipe.ensemble = LazyEnsemble(store)
+    return pipe
@@ -5,20 +5,26 @@ import logging
 import numbers
 import random
 
-import dask
+import numpy as np
 
 from elm.config import import_callable
-from elm.config.dask_settings import _find_get_func_for_client
+from elm.config.dask_settings import (_find_get_func_for_client,
+                                      _scatter_func_for_client)
+from elm.model_selection.sorting import pareto_front
+from elm.pipeline.checkpoint import as_checkpoint, sample_order
+from elm.readers.reshape import row_chunk
 from elm.pipeline.util import (_run_model_selection,
                                _next_name)
 from elm.sample_util.samplers import make_samples_dask
+from elm.sample_util.sample_cache import as_sample_cache
 
 logger = logging.getLogger(__name__)
 
 __all__ = ['ensemble']
 
 
-def _fit_once(method, model, fit_score_kwargs, args):
+def _fit_once(method, model, fit_score_kwargs, args, skip_steps=0,
+              transform_cache=None, sample_key=None):
     '''Dask helper internal func to call a model's method
 
     Parameters:
@@ -34,6 +40,10 @@ def _fit_once(method, model, fit_score_kwargs, args):
 
                 where X is an ElmStore with Dataset "flat"
                 y and sample_weight if given are numpy arrays
+        skip_steps: number of leading steps of model already run on args
+                (see _prefix_dask_graph)
+        transform_cache: None or a TransformCache of fitted steps
+        sample_key: key of the sample in the dask graph (with transform_cache)
     Returns:
         the output of Pipeline instance's "method" call, see also
         elm.pipeline.Pipeline
@@ -55,7 +65,67 @@ def _fit_once(method, model, fit_score_kwargs, args):
         kw['y'] = y
     if sample_weight is not None:
         kw['sample_weight'] = sample_weight
-    return fitting_func(X, method_kwargs=kw)
+    kwargs = {}
+    if skip_steps:
+        kwargs['skip_steps'] = skip_steps
+    if transform_cache is not None:
+        kwargs.update(transform_cache=transform_cache, sample_key=sample_key)
+    return fitting_func(X, method_kwargs=kw, **kwargs)
+
+
+def _fit_transform_prefix(model, n_steps, args):
+    '''Dask helper to run the shared stateless prefix of steps on a sample'''
+    return model.fit_transform_prefix(*args, n_steps=n_steps)
+
+
+def _live_graph(dsk, sample_keys):
+    '''The sample tasks of dsk needed by one generation.  Each generation
+    adds its fit tasks to a new graph from this, so the graph given to
+    the scheduler does not grow with the number of generations'''
+    return {key: dsk[key] for key in sample_keys}
+
+
+def _sample_row_chunk(args, idx, n_chunks):
+    '''Dask helper to take chunk idx of n_chunks of the rows of a sample
+    (X, y, sample_weight) - see elm.readers.reshape.row_chunk'''
+    args = args if isinstance(args, (tuple, list)) else (args,)
+    X, rows = row_chunk(args[0], idx, n_chunks)
+    return (X,) + tuple(None if arr is None else np.asarray(arr)[rows]
+                        for arr in args[1:])
+
+
+def _prefix_dask_graph(dsk, models, sample_keys, gen, method):
+    '''Add a task to dsk for each sample and each stateless prefix of
+    steps (see Pipeline.stateless_prefix) shared by 2 or more models,
+    so that the prefix runs once per sample rather than once per model
+
+    Returns:
+        dict of (model index, sample key) to (key in dsk, skip_steps)
+    '''
+    inputs = {(idx, arg): (arg, 0)
+              for idx, arg in product(range(len(models)), sample_keys)}
+    if method not in ('fit', 'partial_fit'):
+        return inputs
+    prefixes = [model.stateless_prefix() if hasattr(model, 'stateless_prefix') else (0, None)
+                for _, model in models]
+    counts = {}
+    for n_steps, sig in prefixes:
+        if n_steps:
+            counts[sig] = counts.get(sig, 0) + 1
+    prefix_keys = {}
+    for idx, arg in product(range(len(models)), sample_keys):
+        n_steps, sig = prefixes[idx]
+        if not n_steps or counts[sig] < 2:
+            continue
+        if (sig, arg) not in prefix_keys:
+            name = _next_name('prefix-gen-{}'.format(gen))
+            dsk[name] = (_fit_transform_prefix, models[idx][1], n_steps, arg)
+            prefix_keys[(sig, arg)] = name
+        inputs[(idx, arg)] = (prefix_keys[(sig, arg)], n_steps)
+    if prefix_keys:
+        logger.debug('Shared {} stateless step prefix(es) across {} '
+                     'models'.format(len(prefix_keys), len(models)))
+    return inputs
 
 
 def _one_generation_dask_graph(dsk,
@@ -64,7 +134,10 @@ def _one_generation_dask_graph(dsk,
                                sample_keys,
                                partial_fit_batches,
                                gen,
-                               method):
+                               method,
+                               transform_cache=None,
+                               mini_batches=None,
+                               first_batch=0):
 
     '''Run a group of models' fit method on a group of samples
     Parameters:
@@ -77,6 +150,14 @@ def _one_generation_dask_graph(dsk,
         partial_fit_batches: how many partial_fit's
         gen: which generation is it - passed to model_selection func
         method: One of: "fit", "fit_transform", "transform", "partial_fit"
+        transform_cache: None or a TransformCache of fitted steps
+                         (see Pipeline._run_steps).  Each task carries
+                         only the id of the cache and uses the cache
+                         with that id in the process running it
+        mini_batches: None to give each batch the whole sample or a
+                      number of row chunks to split each sample into,
+                      giving each batch one chunk (see _sample_row_chunk)
+        first_batch: index of the row chunk for the first batch
 
     Returns:
         tuple of (dsk, model_keys, new_models_name)
@@ -87,27 +168,145 @@ def _one_generation_dask_graph(dsk,
     '''
     model_keys = [_[0] for _ in models]
     collect_keys = []
+    collect_models = []
     token = '{}-gen-{}'.format(method, gen)
-    for (key, model), arg in product(models, sample_keys):
+    inputs = _prefix_dask_graph(dsk, models, sample_keys, gen, method)
+    chunk_keys = {}
+    def batch_arg(arg, batch):
+        if not mini_batches or mini_batches < 2:
+            return arg
+        chunk = (first_batch + batch) % mini_batches
+        if (arg, chunk) not in chunk_keys:
+            name = _next_name('row-chunk-gen-{}'.format(gen))
+            dsk[name] = (_sample_row_chunk, arg, chunk, mini_batches)
+            chunk_keys[(arg, chunk)] = name
+        return chunk_keys[(arg, chunk)]
+    for (idx, (key, model)), sample_key in product(enumerate(models), sample_keys):
         name = _next_name(token)
-        dsk[name] = (partial(_fit_once, method, model, fit_score_kwargs), arg)
+        arg, skip_steps = inputs[(idx, sample_key)]
+        arg = batch_arg(arg, 0)
+        dsk[name] = (partial(_fit_once, method, model, fit_score_kwargs,
+                             skip_steps=skip_steps,
+                             transform_cache=transform_cache,
+                             sample_key=sample_key), arg)
         collect_keys.append(name)
+        collect_models.append(idx)
     if partial_fit_batches > 1:
-        for idx in range(1, partial_fit_batches):
-            token_pf = token + '_batch_{}'.format(idx)
+        for batch in range(1, partial_fit_batches):
+            token_pf = token + '_batch_{}'.format(batch)
             collect_keys2 = []
-            for key in collect_keys:
+            collect_models2 = []
+            for key, idx in zip(collect_keys, collect_models):
                 for sample_key in sample_keys:
                     name = _next_name(token_pf)
-                    dsk[name] = ((lambda model, arg: _fit_once(method, model, fit_score_kwargs, arg)), key, sample_key)
+                    arg, skip_steps = inputs[(idx, sample_key)]
+                    arg = batch_arg(arg, batch)
+                    dsk[name] = ((lambda model, arg, skip_steps=skip_steps: _fit_once(method, model, fit_score_kwargs, arg, skip_steps=skip_steps)), key, arg)
                     collect_keys2.append(name)
+                    collect_models2.append(idx)
             collect_keys = collect_keys2
+            collect_models = collect_models2
     def tuple_of_args(*args):
         return tuple(args)
     new_models_name = _next_name('ensemble_generation_{}'.format(gen))
     dsk[new_models_name] = (tuple_of_args, ) + tuple(collect_keys)
     return dsk, collect_keys, new_models_name
 
+
+def _halving_rungs(n_models, partial_fit_batches, eta=3, min_batches=1):
+    '''Successive halving schedule: list of (n_models, batches) where
+    n_models are trained to a cumulative number of partial_fit batches
+    before the best n_models of the next rung are kept'''
+    if eta < 2:
+        raise ValueError('Expected successive_halving eta >= 2, not {}'.format(eta))
+    n_halvings = 0
+    while (n_models // eta ** (n_halvings + 1) >= 1 and
+           partial_fit_batches // eta ** (n_halvings + 1) >= min_batches):
+        n_halvings += 1
+    return [(max(1, n_models // eta ** rung),
+             partial_fit_batches // eta ** (n_halvings - rung))
+            for rung in range(n_halvings + 1)]
+
+
+def _as_successive_halving(successive_halving):
+    '''Return a dict of successive halving options or None from the
+    successive_halving argument of ensemble / evolve_train'''
+    if not successive_halving:
+        return None
+    options = dict(eta=3, min_batches=1)
+    if successive_halving is not True:
+        if not isinstance(successive_halving, dict):
+            raise ValueError('Expected successive_halving to be None, True or a dict, not {}'.format(successive_halving))
+        options.update(successive_halving)
+    return options
+
+
+def _successive_halving(dsk,
+                        models,
+                        fit_score_kwargs,
+                        sample_keys,
+                        partial_fit_batches,
+                        gen,
+                        get_func,
+                        score_weights,
+                        eta=3,
+                        min_batches=1,
+                        mini_batches=False):
+    '''Fit models with partial_fit in rungs of batches (see
+    _halving_rungs), scoring after each rung and continuing only
+    the best 1 / eta of models (sorted by pareto_front)
+
+    Parameters:
+        eta: reduction factor - models kept per rung are 1 / eta of
+             models of the previous rung and batches are eta times more
+        min_batches: partial_fit batches in first rung (at least)
+        mini_batches: if True, split each sample into partial_fit_batches
+             row chunks, giving each batch the next chunk
+        Other parameters are as in _one_generation_dask_graph
+
+    Returns:
+        tuple of (dsk, models, survivors) where dsk is unchanged, models are
+        (tag, fitted Pipeline) in the order given (models dropped in a
+        rung are fit and scored with fewer batches) and survivors are
+        the indices of models fit with all partial_fit_batches
+    '''
+    if score_weights is None:
+        raise ValueError('successive_halving requires score_weights')
+    models = list(models)
+    survivors = list(range(len(models)))
+    rungs = _halving_rungs(len(models), partial_fit_batches,
+                           eta=eta, min_batches=min_batches)
+    batches_done = 0
+    for rung, (n_keep, batches) in enumerate(rungs):
+        if rung:
+            scores = np.atleast_2d(np.array([models[idx][1]._score
+                                             for idx in survivors], dtype=np.float64))
+            if scores.shape[0] != len(survivors):
+                scores = scores.T
+            best = pareto_front(score_weights, scores, take=n_keep)
+            survivors = [survivors[idx] for idx in best]
+        rung_models = [models[idx] for idx in survivors]
+        logger.info('Successive halving rung {} of {}: {} models x {} '
+                    'partial_fit batches'.format(rung + 1, len(rungs),
+                                                 len(rung_models),
+                                                 batches - batches_done))
+        rung_dsk, _, new_models_name = _one_generation_dask_graph(_live_graph(dsk, sample_keys),
+                                                rung_models,
+                                                fit_score_kwargs,
+                                                sample_keys,
+                                                batches - batches_done,
+                                                gen,
+                                                'partial_fit',
+                                                mini_batches=partial_fit_batches if mini_batches else None,
+                                                first_batch=batches_done)
+        fitted = tuple(get_func(rung_dsk, new_models_name))
+        stride = len(fitted) // len(rung_models)
+        for idx, model in zip(survivors, fitted[::stride]):
+            models[idx] = (models[idx][0], model)
+        batches_done = batches
+    return dsk, tuple(models), survivors
+
+
 def ensemble(pipe,
              ngen,
              X=None,
@@ -127,6 +326,10 @@ def ensemble(pipe,
              partial_fit_batches=1,
              classes=None,
              method_kwargs=None,
+             sample_cache=None,
+             successive_halving=None,
+             mini_batches=False,
+             checkpoint=None,
              **data_source):
 
     '''Fit or partial_fit an ensemble of models to a series of samples
@@ -169,6 +372,35 @@ def ensemble(pipe,
         classes: Unique sequence of class integers passed to supervised
             classifiers that need the known y classes.
         method_kwargs: any other arguments to pass to method
+        sample_cache: None (default) to call sampler on each generation,
+            or True, a dict of keyword arguments to, or an instance of
+            elm.sample_util.sample_cache.SampleCache to reuse sampler
+            outputs in later generations.  A cache created from True or
+            a dict is cleared when ensemble returns.  With PROCESS_POOL,
+            LOCAL_CLUSTER or DISTRIBUTED clients each worker process
+            has its own cache (tasks carry only the cache's id), so a
+            sample is reused when a later generation runs on the same
+            worker or, with a spill_dir shared by workers, after it is
+            spilled
+        successive_halving: None (default) or, with partial_fit_batches
+            > 1, True or a dict with keys "eta" (default 3),
+            "min_batches" (default 1) and "score_weights" (default
+            model_selection_kwargs["score_weights"]): in each generation
+            score members after a fraction of the partial_fit batches
+            and continue only the best 1 / eta of them (by pareto_front)
+            in each rung.  Members dropped stay in the ensemble, fit
+            with the batches of their last rung, after the members
+            fit with all partial_fit_batches
+        mini_batches: if True (with partial_fit_batches > 1), split
+            each sample into partial_fit_batches chunks of rows (see
+            elm.readers.reshape.row_chunk) so that each partial_fit call
+            sees one chunk rather than the whole sample
+        checkpoint: None (default), a file name, a dict of keyword
+            arguments to, or an instance of
+            elm.pipeline.checkpoint.Checkpoint to save the models,
+            the sample order and random states after each generation
+            (or every "every" generations) and, with resume=True,
+            continue a run from its last checkpoint
         **data_source: keywords passed to "sampler" if given
     Returns:
 
@@ -176,6 +408,8 @@ def ensemble(pipe,
             "predict_many" can be called
     '''
     get_func = _find_get_func_for_client(client)
+    halving = _as_successive_halving(successive_halving)
+    checkpoint = as_checkpoint(checkpoint)
     fit_score_kwargs = method_kwargs or {}
     if not 'classes' in fit_score_kwargs and classes is not None:
         fit_score_kwargs['classes'] = classes
@@ -184,6 +418,8 @@ def ensemble(pipe,
     partial_fit_batches = partial_fit_batches or 1
     if partial_fit_batches > 1:
         method = 'partial_fit'
+    if halving:
+        halving.setdefault('score_weights', model_selection_kwargs.get('score_weights'))
     if not ensemble_init_func:
         models = tuple(copy.deepcopy(pipe) for _ in range(ensemble_size))
     else:
@@ -193,14 +429,25 @@ def ensemble(pipe,
     if model_selection:
         model_selection = import_callable(model_selection)
     final_names = []
-    dsk = make_samples_dask(X, y, sample_weight, pipe, args_list, sampler, data_source)
+    cache = as_sample_cache(sample_cache)
+    dsk = make_samples_dask(X, y, sample_weight, pipe, args_list, sampler, data_source,
+                            sample_cache=cache,
+                            scatter=_scatter_func_for_client(client))
     models = tuple(zip(('tag_{}'.format(idx) for idx in range(len(models))), models))
     sample_keys = list(dsk)
+    order = None
+    if models_share_sample:
+        order = sample_order(len(sample_keys), random.shuffle)
+    start = 0
+    resumed = checkpoint.load() if checkpoint is not None else None
+    if resumed:
+        models, order = resumed['models'], resumed['sample_order']
+        start = resumed['gen'] + 1
     if models_share_sample:
-        random.shuffle(sample_keys)
+        sample_keys = [sample_keys[idx] for idx in order]
         gen_to_sample_key = {gen: s for gen, s in enumerate(sample_keys[:ngen])}
     sample_keys = tuple(sample_keys)
-    for gen in range(ngen):
+    for gen in range(start, ngen):
         if models_share_sample:
             sample_keys_passed = (gen_to_sample_key[gen % len(sample_keys)],)
         else:
@@ -212,18 +459,31 @@ def ensemble(pipe,
                gen + 1,
                ngen)
         logger.info('Ensemble Generation {5} of {6}: ({0} members x {1} samples x {2} calls) = {4} {3} calls this gen'.format(*msg))
-        dsk, model_keys, new_models_name = _one_generation_dask_graph(dsk,
-                                                      models,
-                                                      fit_score_kwargs,
-                                                      sample_keys_passed,
-                                                      partial_fit_batches,
-                                                      gen,
-                                                      method)
-        if get_func is None:
-            new_models = tuple(dask.get(dsk, new_models_name))
+        if halving and partial_fit_batches > 1:
+            dsk, models, survivors = _successive_halving(dsk,
+                                                         models,
+                                                         fit_score_kwargs,
+                                                         sample_keys_passed,
+                                                         partial_fit_batches,
+                                                         gen,
+                                                         get_func,
+                                                         mini_batches=mini_batches,
+                                                         **halving)
+            # members dropped in a rung stay in the ensemble with the
+            # fewer partial_fit batches they had; survivors come first
+            dropped = [idx for idx in range(len(models)) if idx not in survivors]
+            models = tuple(models[idx] for idx in survivors + dropped)
         else:
-            new_models = tuple(get_func(dsk, new_models_name))
-        models = tuple(zip(model_keys, new_models))
+            gen_dsk, model_keys, new_models_name = _one_generation_dask_graph(_live_graph(dsk, sample_keys_passed),
+                                                          models,
+                                                          fit_score_kwargs,
+                                                          sample_keys_passed,
+                                                          partial_fit_batches,
+                                                          gen,
+                                                          method,
+                                                          mini_batches=partial_fit_batches if mini_batches else None)
+            new_models = tuple(get_func(gen_dsk, new_models_name))
+            models = tuple(zip(model_keys, new_models))
         logger.info('Trained {} estimators'.format(len(models)))
         if model_selection:
             models = _run_model_selection(models,
@@ -237,6 +497,14 @@ def ensemble(pipe,
             pass # Just training all ensemble members
                  # without replacing / re-ininializing / editing
                  # the model params
+        if checkpoint is not None:
+            checkpoint.save(gen, ngen=ngen, models=models, sample_order=order)
+    if checkpoint is not None:
+        checkpoint.clear()
+    if cache is not None:
+        logger.info('Sample cache: {}'.format(cache))
+        if cache is not sample_cache:
+            cache.clear()
     if saved_ensemble_size:
         final_models = models[:saved_ensemble_size]
     else:
@@ -7,21 +7,45 @@ import numpy as np
 import pandas as pd
 
 from elm.config import import_callable, ConfigParser
-from elm.config.dask_settings import _find_get_func_for_client
+from elm.config.dask_settings import (_find_get_func_for_client,
+                                      _executor_for_client,
+                                      _first_completed,
+                                      _scatter_func_for_client,
+                                      get_sync,
+                                      Executor)
 from elm.model_selection.evolve import (ea_general,
+                                        ea_steady_state,
                                         evo_init_func,
                                         assign_check_fitness,
                                         ind_to_new_pipe)
+from elm.model_selection.fitness_cache import as_fitness_cache
 from elm.model_selection.util import get_args_kwargs_defaults
 from elm.pipeline.util import _validate_ensemble_members
-from elm.pipeline.ensemble import _one_generation_dask_graph, ensemble
+from elm.pipeline.checkpoint import as_checkpoint, sample_order
+from elm.pipeline.ensemble import (_as_successive_halving,
+                                   _live_graph,
+                                   _one_generation_dask_graph,
+                                   _successive_halving,
+                                   ensemble)
 from elm.pipeline.serialize import serialize_pipe
-from elm.sample_util.samplers import make_samples_dask
+from elm.sample_util.samplers import make_samples_dask, sample_tokens
+from elm.sample_util.sample_cache import as_sample_cache, TransformCache
 
 __all__ = ['evolve_train']
 
 logger = logging.getLogger(__name__)
 
+def _fitness_cache_keys(base_model, deap_params, fitness_cache,
+                        sample_tokens, sample_keys, invalid_ind):
+    tokens = [sample_tokens.get(key, key) for key in sample_keys]
+    keys = []
+    for ind in invalid_ind:
+        values = [choice[idx] for idx, choice in zip(ind, deap_params['choices'])]
+        keys.append(fitness_cache.key(deap_params['param_order'], values,
+                                      tokens, base_model.scoring))
+    return keys
+
+
 def _on_each_generation(base_model,
                        data_source,
                        deap_params,
@@ -29,34 +53,199 @@ def _on_each_generation(base_model,
                        partial_fit_batches,
                        method,
                        method_kwargs,
+                       transform_cache,
+                       fitness_cache,
+                       sample_tokens,
                        dsk,
                        gen,
                        sample_keys,
-                       invalid_ind):
-
-    new_models = []
-    fit_kwargs = []
-    for idx, ind in enumerate(invalid_ind):
-        model = ind_to_new_pipe(base_model, deap_params, ind)
-        new_models.append((ind.name, model))
-    dsk, model_keys, new_models_name = _one_generation_dask_graph(dsk,
-                                        new_models,
+                       invalid_ind,
+                       use_fitness_cache=True,
+                       successive_halving=None,
+                       mini_batches=False):
+    '''Fit the Pipelines of invalid_ind, returning ((name, model), ...)
+    for the Pipelines that were fit and a fitness for every individual
+    in invalid_ind.  Individuals whose params and sample(s) are in
+    fitness_cache, or repeat another individual of invalid_ind, are not
+    fit'''
+    if not use_fitness_cache:
+        fitness_cache = None
+    fitnesses = [None] * len(invalid_ind)
+    to_fit, repeats, first_pos = [], [], {}
+    if fitness_cache is not None:
+        cache_keys = _fitness_cache_keys(base_model, deap_params,
+                                         fitness_cache, sample_tokens,
+                                         sample_keys, invalid_ind)
+    for pos, ind in enumerate(invalid_ind):
+        if fitness_cache is not None:
+            key = cache_keys[pos]
+            fitness = fitness_cache.get(key)
+            if fitness is not None:
+                fitnesses[pos] = fitness
+                continue
+            if key in first_pos:
+                repeats.append((pos, first_pos[key]))
+                continue
+            first_pos[key] = pos
+        to_fit.append(pos)
+    models = ()
+    if to_fit:
+        new_models = []
+        for pos in to_fit:
+            ind = invalid_ind[pos]
+            model = ind_to_new_pipe(base_model, deap_params, ind)
+            new_models.append((ind.name, model))
+        if successive_halving and partial_fit_batches > 1:
+            dsk, models, survivors = _successive_halving(dsk,
+                                                         new_models,
+                                                         method_kwargs,
+                                                         sample_keys,
+                                                         partial_fit_batches,
+                                                         gen,
+                                                         get_func,
+                                                         mini_batches=mini_batches,
+                                                         **successive_halving)
+            survivors = set(survivors)
+        else:
+            gen_dsk, model_keys, new_models_name = _one_generation_dask_graph(_live_graph(dsk, sample_keys),
+                                                new_models,
+                                                method_kwargs,
+                                                sample_keys,
+                                                partial_fit_batches,
+                                                gen,
+                                                method,
+                                                transform_cache=transform_cache,
+                                                mini_batches=partial_fit_batches if mini_batches else None)
+            new_models = tuple(get_func(gen_dsk, new_models_name))
+            models = tuple(zip((invalid_ind[pos].name for pos in to_fit), new_models))
+            survivors = set(range(len(models)))
+        for idx, (pos, (name, model)) in enumerate(zip(to_fit, models)):
+            fitness = model._score
+            fitness = fitness if isinstance(fitness, Sequence) else [fitness]
+            fitnesses[pos] = fitness
+            # Fitnesses of models dropped by successive halving
+            # are from fewer partial_fit batches and not cached
+            if fitness_cache is not None and idx in survivors:
+                fitness_cache.set(cache_keys[pos], fitness)
+        if fitness_cache is not None:
+            fitness_cache.save()
+    for pos, first in repeats:
+        fitnesses[pos] = fitnesses[first]
+    logger.info('Trained {} estimators ({} fitnesses from '
+                'fitness_cache)'.format(len(models), len(invalid_ind) - len(models)))
+    return models, fitnesses
+
+
+def _sample_value(sample):
+    '''Dask helper giving a sample computed before the graph'''
+    return sample
+
+
+def _shared_samples(submit, dsk, keep_futures=False):
+    '''Return a function of sample_keys giving a graph of those samples,
+    each computed once with submit and reused by every individual that
+    is fit on it.  Samples of sample_keys no longer passed are dropped.
+
+    Parameters:
+        submit: submit method of an executor (see _executor_for_client)
+        dsk: graph of sample tasks (make_samples_dask)
+        keep_futures: if True (distributed), put the future of each sample
+            in the graph, otherwise its result
+    '''
+    samples = {}
+    def live_graph(sample_keys):
+        for key in tuple(samples):
+            if key not in sample_keys:
+                samples.pop(key)
+        for key in sample_keys:
+            if key not in samples:
+                future = submit(get_sync, {key: dsk[key]}, key)
+                samples[key] = future if keep_futures else future.result()
+        return {key: (_sample_value, samples[key]) for key in sample_keys}
+    return live_graph
+
+
+def _submit_individual(base_model,
+                       deap_params,
+                       partial_fit_batches,
+                       method,
+                       method_kwargs,
+                       transform_cache,
+                       submit,
+                       live_graph,
+                       gen,
+                       sample_keys,
+                       ind,
+                       mini_batches=False):
+    '''Submit the fitting of one individual's Pipeline on sample_keys,
+    returning a future of a tuple of fitted Pipeline(s).  live_graph
+    (see _shared_samples) gives the samples so they are not recomputed
+    for each individual'''
+    model = ind_to_new_pipe(base_model, deap_params, ind)
+    ind_dsk, _, new_models_name = _one_generation_dask_graph(live_graph(sample_keys),
+                                        [(ind.name, model)],
                                         method_kwargs,
                                         sample_keys,
                                         partial_fit_batches,
                                         gen,
-                                        method)
-    if get_func is None:
-        new_models = tuple(dask.get(dsk, new_models_name))
-    else:
-        new_models = tuple(get_func(dsk, new_models_name))
-    models = tuple(zip(model_keys, new_models))
-    logger.info('Trained {} estimators'.format(len(models)))
+                                        method,
+                                        transform_cache=transform_cache,
+                                        mini_batches=partial_fit_batches if mini_batches else None)
+    return submit(get_sync, ind_dsk, new_models_name)
 
-    fitnesses = [model._score for name, model in models]
-    fitnesses = [(item if isinstance(item, Sequence) else [item])
-                 for item in fitnesses]
-    return models, fitnesses
+
+def _steady_state(ea_gen, submit_one, fitness_cache, cache_keys, mu,
+                  gen_to_sample_keys):
+    '''Run ea_gen (ea_steady_state), submitting each new individual
+    with submit_one and sending each fitness to ea_gen as soon as its
+    fit finishes
+
+    Returns:
+        tuple of (pop, fitted_models, param_history, gen) where
+        fitted_models is a dict of individual name to fitted Pipeline
+        and gen is the number of individuals submitted // mu
+    '''
+    fitted_models = {}
+    pending = {}
+    n_submitted = 0
+    pop, new_ind, param_history = next(ea_gen)
+    try:
+        while new_ind is not None:
+            evaluated = []
+            for ind in new_ind:
+                gen = n_submitted // mu
+                sample_keys = gen_to_sample_keys(gen)
+                n_submitted += 1
+                key = None
+                if fitness_cache is not None:
+                    key = cache_keys(sample_keys, [ind])[0]
+                    fitness = fitness_cache.get(key)
+                    if fitness is not None:
+                        evaluated.append((ind, fitness))
+                        continue
+                pending[submit_one(gen, sample_keys, ind)] = (ind, key)
+            if not evaluated:
+                if not pending:
+                    break
+                future = _first_completed(pending)
+                ind, key = pending.pop(future)
+                model = future.result()[0]
+                fitness = model._score
+                fitness = fitness if isinstance(fitness, Sequence) else [fitness]
+                fitted_models[ind.name] = model
+                if fitness_cache is not None:
+                    fitness_cache.set(key, fitness)
+                    fitness_cache.save()
+                evaluated.append((ind, fitness))
+            pop, new_ind, param_history = ea_gen.send(evaluated)
+            pop_names = set(ind.name for ind in pop)
+            fitted_models = {k: v for k, v in fitted_models.items()
+                             if k in pop_names}
+    finally:
+        for future in pending:
+            future.cancel()
+    logger.info('Steady-state EA submitted {} individuals'.format(n_submitted))
+    return pop, fitted_models, param_history, n_submitted // mu
 
 
 def evolve_train(pipe,
@@ -75,6 +264,13 @@ def evolve_train(pipe,
                  partial_fit_batches=1,
                  classes=None,
                  method_kwargs=None,
+                 sample_cache=None,
+                 transform_cache=None,
+                 fitness_cache=True,
+                 steady_state=False,
+                 successive_halving=None,
+                 mini_batches=False,
+                 checkpoint=None,
                  **data_source):
     '''evolve_train runs an evolutionary algorithm to
     find the most fit elm.pipeline.Pipeline instances
@@ -86,6 +282,49 @@ def evolve_train(pipe,
             evo_params = ea_setup(param_grid=param_grid,
                           param_grid_name='param_grid_example',
                           score_weights=[-1]) # minimization
+        transform_cache: None (default), True, a dict of keyword
+            arguments to, or an instance of
+            elm.sample_util.sample_cache.TransformCache to reuse fitted
+            steps (and their outputs) across individuals whose params
+            for those steps, and all steps before them, are equal.
+            Only used when method is "fit".  The cache is held in the
+            memory of the process running each fit: with SERIAL or
+            THREAD_POOL clients all fits share one cache, but with
+            PROCESS_POOL, LOCAL_CLUSTER or DISTRIBUTED clients each
+            worker process has its own (tasks carry only the cache's
+            id, not its contents), so an individual reuses only steps
+            fitted on the same worker or, with a spill_dir shared by
+            the workers, steps spilled from any worker's cache
+        fitness_cache: True (default) to reuse fitnesses of repeated
+            params / sample combinations within this call, a JSON file
+            name to also save fitnesses after each generation and
+            reuse them when evolve_train is run again, an instance of
+            elm.model_selection.fitness_cache.FitnessCache, or
+            None / False to fit every new individual
+        steady_state: if True, run the asynchronous steady-state EA
+            (elm.model_selection.evolve.ea_steady_state): each
+            individual is submitted to the client as a future and new
+            offspring are bred as soon as any fit finishes, rather
+            than waiting on each generation.  ngen * mu individuals
+            are evaluated, with at most mu fits in progress
+        successive_halving: None (default) or, with partial_fit_batches
+            > 1, True or a dict with keys "eta" (default 3) and
+            "min_batches" (default 1): in each generation score
+            individuals after a fraction of the partial_fit batches and
+            continue only the best 1 / eta of them (by pareto_front with
+            evo_params.score_weights) in each rung.  Individuals dropped
+            keep the fitness from their last rung.  Not used with
+            steady_state
+        mini_batches: if True (with partial_fit_batches > 1), split
+            each sample into partial_fit_batches chunks of rows so that
+            each partial_fit call sees one chunk (see ensemble)
+        checkpoint: None (default), a file name, a dict of keyword
+            arguments to, or an instance of
+            elm.pipeline.checkpoint.Checkpoint to save the population,
+            offspring, param_history, fitted models, sample order and
+            random states after each generation and, with resume=True,
+            continue from the last checkpointed generation.  Not used
+            with steady_state
 
         See also the help from (elm.pipeline.ensemble) where
         most arguments are interpretted similary.
@@ -95,11 +334,29 @@ def evolve_train(pipe,
     method_kwargs = method_kwargs or {}
     scoring_kwargs = scoring_kwargs or {}
     get_func = _find_get_func_for_client(client)
+    tcache = as_sample_cache(transform_cache, cls=TransformCache)
+    fcache = as_fitness_cache(fitness_cache)
+    halving = _as_successive_halving(successive_halving)
+    if halving:
+        halving['score_weights'] = evo_params.score_weights
+    ckpt = as_checkpoint(checkpoint)
+    if ckpt is not None and steady_state:
+        raise ValueError('checkpoint is not supported with steady_state')
     control = evo_params.deap_params['control']
     required_args, _, _ = get_args_kwargs_defaults(ea_general)
     evo_args = [evo_params,]
     data_source = dict(X=X,y=y, sample_weight=sample_weight, sampler=sampler,
                        args_list=args_list, **data_source)
+
+    cache = as_sample_cache(sample_cache)
+    dsk = make_samples_dask(X, y, sample_weight, pipe, args_list, sampler, data_source,
+                            sample_cache=cache,
+                            scatter=_scatter_func_for_client(client))
+    sample_keys = list(dsk)
+    tokens = {}
+    if fcache is not None:
+        tokens = sample_tokens(dsk, X, y, sample_weight, args_list,
+                               sampler, data_source)
     fit_one_generation = partial(_on_each_generation,
                                  pipe,
                                  data_source,
@@ -107,13 +364,19 @@ def evolve_train(pipe,
                                  get_func,
                                  partial_fit_batches,
                                  method,
-                                 method_kwargs)
-
-
-    dsk = make_samples_dask(X, y, sample_weight, pipe, args_list, sampler, data_source)
-    sample_keys = list(dsk)
+                                 method_kwargs,
+                                 tcache,
+                                 fcache,
+                                 tokens,
+                                 successive_halving=halving,
+                                 mini_batches=mini_batches)
+    resumed = ckpt.load() if ckpt is not None else None
     if models_share_sample:
-        np.random.shuffle(sample_keys)
+        if resumed:
+            order = resumed['sample_order']
+        else:
+            order = sample_order(len(sample_keys), np.random.shuffle)
+        sample_keys = [sample_keys[idx] for idx in order]
         gen_to_sample_key = lambda gen: [sample_keys[gen]]
     else:
         gen_to_sample_key = lambda gen: sample_keys
@@ -127,55 +390,110 @@ def evolve_train(pipe,
                                  'to evolutionary '
                                  'algorithm)'.format(a, control))
             evo_args.append(control[a])
-        ea_gen = ea_general(*evo_args)
-        pop, _, _ = next(ea_gen)
-        sample_keys_passed = gen_to_sample_key(0)
-        def log_once(len_models, sample_keys_passed, gen):
-            total_calls = len_models * len(sample_keys_passed) * partial_fit_batches
-            msg = (len_models, len(sample_keys_passed), partial_fit_batches, method, gen, total_calls)
-            fmt = 'Evolve generation {4}: {0} models x {1} samples x {2} {3} calls = {5} calls in total'
-            logger.info(fmt.format(*msg))
-        log_once(len(pop), sample_keys_passed, 0)
-        pop_names = [ind.name for ind in pop]
-        models, fitnesses = fit_one_generation(dsk, 0, sample_keys_passed, pop)
-        assign_check_fitness(pop,
-                         fitnesses,
-                         param_history,
-                         evo_params.deap_params['choices'],
-                         evo_params.score_weights)
-        invalid_ind = True
-        fitted_models = {n: m for n, (_, m) in zip(pop_names, models)}
-        ngen = evo_params.deap_params['control'].get('ngen') or None
-        if not ngen and not evo_params.early_stop:
-            raise ValueError('param_grids: pg_name: control: has neither '
-                             'ngen or early_stop keys')
-        elif not ngen:
-            ngen = 1000000
-        for gen in range(ngen):
-            # on last generation invalid_ind becomes None
-            # and breaks this loop
-            if models_share_sample:
-                sample_keys_passed = (gen_to_sample_key(gen % len(sample_keys)),)
+        if steady_state:
+            ea_gen = ea_steady_state(*evo_args)
+            cache_keys = None
+            if fcache is not None:
+                cache_keys = partial(_fitness_cache_keys, pipe,
+                                     evo_params.deap_params, fcache, tokens)
+            distributed = bool(Executor and isinstance(client, Executor))
+            with _executor_for_client(client) as executor:
+                submit_one = partial(_submit_individual,
+                                     pipe,
+                                     evo_params.deap_params,
+                                     partial_fit_batches,
+                                     method,
+                                     method_kwargs,
+                                     tcache,
+                                     executor.submit,
+                                     _shared_samples(executor.submit, dsk,
+                                                     keep_futures=distributed),
+                                     mini_batches=mini_batches)
+                pop, fitted_models, param_history, gen = _steady_state(ea_gen,
+                                        submit_one,
+                                        fcache,
+                                        cache_keys,
+                                        control['mu'],
+                                        lambda gen: tuple(gen_to_sample_key(gen % len(sample_keys))))
+            sample_keys_passed = tuple(gen_to_sample_key(gen % len(sample_keys)))
+        else:
+            ea_state = resumed['ea_state'] if resumed else {}
+            ea_gen = ea_general(*evo_args, state=ea_state)
+            def log_once(len_models, sample_keys_passed, gen):
+                total_calls = len_models * len(sample_keys_passed) * partial_fit_batches
+                msg = (len_models, len(sample_keys_passed), partial_fit_batches, method, gen, total_calls)
+                fmt = 'Evolve generation {4}: {0} models x {1} samples x {2} {3} calls = {5} calls in total'
+                logger.info(fmt.format(*msg))
+            if resumed:
+                # the offspring of generation ea_state['gen'] are next
+                pop, invalid_ind, param_history = next(ea_gen)
+                fitted_models = resumed['fitted_models']
+                start = ea_state['gen']
             else:
-                sample_keys_passed = sample_keys
-
-            if gen > 0:
-                log_once(len(invalid_ind), sample_keys_passed, gen)
-                names = [ind.name for ind in invalid_ind]
-                models, fitnesses = fit_one_generation(dsk, gen, sample_keys_passed, invalid_ind)
-                fitted_models.update({n: m for n, (_, m) in zip(names,models)})
-            (pop, invalid_ind, param_history) = ea_gen.send(fitnesses)
-            pop_names = [ind.name for ind in pop]
-            fitted_models = {k: v for k, v in fitted_models.items()
-                             if k in pop_names}
-            if not invalid_ind:
-                break # If there are no new solutions to try, break
+                pop, _, _ = next(ea_gen)
+                sample_keys_passed = gen_to_sample_key(0)
+                log_once(len(pop), sample_keys_passed, 0)
+                models, fitnesses = fit_one_generation(dsk, 0, sample_keys_passed, pop)
+                assign_check_fitness(pop,
+                                 fitnesses,
+                                 param_history,
+                                 evo_params.deap_params['choices'],
+                                 evo_params.score_weights)
+                invalid_ind = True
+                fitted_models = dict(models)
+                start = 0
+            ngen = evo_params.deap_params['control'].get('ngen') or None
+            if not ngen and not evo_params.early_stop:
+                raise ValueError('param_grids: pg_name: control: has neither '
+                                 'ngen or early_stop keys')
+            elif not ngen:
+                ngen = 1000000
+            for gen in range(start, ngen):
+                # on last generation invalid_ind becomes None
+                # and breaks this loop
+                if models_share_sample:
+                    sample_keys_passed = tuple(gen_to_sample_key(gen % len(sample_keys)))
+                else:
+                    sample_keys_passed = sample_keys
+
+                if gen > 0:
+                    log_once(len(invalid_ind), sample_keys_passed, gen)
+                    models, fitnesses = fit_one_generation(dsk, gen, sample_keys_passed, invalid_ind)
+                    fitted_models.update(dict(models))
+                (pop, invalid_ind, param_history) = ea_gen.send(fitnesses)
+                pop_names = [ind.name for ind in pop]
+                fitted_models = {k: v for k, v in fitted_models.items()
+                                 if k in pop_names}
+                if not invalid_ind:
+                    break # If there are no new solutions to try, break
+                if ckpt is not None:
+                    ckpt.save(gen, ngen=ngen, ea_state=ea_state,
+                              fitted_models=fitted_models,
+                              sample_order=order)
         pop = evo_params.toolbox.select(pop, saved_ensemble_size)
+        not_fitted = [ind for ind in pop if ind.name not in fitted_models]
+        if not_fitted:
+            # Fitnesses of these were from fitness_cache
+            logger.info('Fit {} selected individuals not fit in this '
+                        'run'.format(len(not_fitted)))
+            models, _ = fit_one_generation(dsk, gen + 1, sample_keys_passed,
+                                           not_fitted, use_fitness_cache=False,
+                                           successive_halving=None)
+            fitted_models.update(dict(models))
         pop_names = [ind.name for ind in pop]
         models = [(k, v) for k, v in fitted_models.items()
                   if k in pop_names]
+        if ckpt is not None:
+            ckpt.clear()
 
     finally:
+        for c, arg in ((cache, sample_cache), (tcache, transform_cache)):
+            if c is not None:
+                logger.info('Evolve cache: {}'.format(c))
+                if c is not arg:
+                    c.clear()
+        if fcache is not None:
+            logger.info('Evolve cache: {}'.format(fcache))
         columns = list(evo_params.deap_params['param_order'])
         columns += ['objective_{}_{}'.format(idx, 'min' if sw == -1 else 'max')
                     for idx, sw in enumerate(evo_params.score_weights)]
@@ -8,11 +8,13 @@ from collections import defaultdict
 import copy
 from functools import partial
 import logging
+import os
 
 import dask
 
 from elm.config import ConfigParser, import_callable
 from elm.model_selection.evolve import ea_setup
+from elm.pipeline.checkpoint import CHECKPOINT_EXT
 from elm.pipeline.ensemble import ensemble
 from elm.pipeline.pipeline import Pipeline
 from elm.readers import *
@@ -20,7 +22,9 @@ from elm.readers import *
 
 from elm.pipeline.serialize import (serialize_prediction,
                                     serialize_pipe,
-                                    load_pipe_from_tag)
+                                    load_pipe_from_tag,
+                                    _get_path_for_tag,
+                                    PREDICTION_KWARGS)
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +33,57 @@ def _makedirs(config):
         if d and not os.path.exists(d):
             os.makedirs(d)
 
+def _checkpoint_kwargs(config, train_tag, checkpoint=None):
+    '''Keyword arguments to elm.pipeline.checkpoint.Checkpoint for a
+    train action: a checkpoint in ELM_TRAIN_PATH each generation,
+    resumed with elm-main --resume.  "checkpoint" in the ensemble's
+    config may be:
+
+        * None or True: the defaults above
+        * False: no checkpoints (returns None)
+        * An int: checkpoint after every this many generations
+        * A str: the checkpoint file name
+        * A dict of keyword arguments to Checkpoint
+    '''
+    if checkpoint is False:
+        return None
+    if checkpoint is None or checkpoint is True:
+        kw = {}
+    elif isinstance(checkpoint, int):
+        kw = {'every': checkpoint}
+    elif isinstance(checkpoint, str):
+        kw = {'filename': checkpoint}
+    elif isinstance(checkpoint, dict):
+        kw = dict(checkpoint)
+    else:
+        raise ValueError('Expected checkpoint to be a bool, int, str or dict, not {}'.format(checkpoint))
+    kw.setdefault('filename', os.path.join(config.ELM_TRAIN_PATH,
+                                           train_tag + CHECKPOINT_EXT))
+    kw.setdefault('resume', bool(getattr(config, 'RESUME', False)))
+    return kw
+
+
+def _prediction_kwargs(config, step):
+    '''Keyword arguments to serialize_prediction (prediction_format,
+    blocksize, complevel, chunks) from the config's "predict" section,
+    updated by those given in the "run" action step'''
+    predict = getattr(config, 'predict', None) or {}
+    kw = {k: predict[k] for k in PREDICTION_KWARGS if k in predict}
+    kw.update({k: step[k] for k in PREDICTION_KWARGS if k in step})
+    return kw
+
+
+def _trained_before_resume(config, train_tag):
+    '''True with --resume if train_tag was saved by a run that
+    finished training it (it has no checkpoint left)'''
+    if not getattr(config, 'RESUME', False):
+        return False
+    saved = any(os.path.exists(_get_path_for_tag(config.ELM_TRAIN_PATH, train_tag, compact=compact))
+                for compact in (True, False))
+    checkpoint = os.path.join(config.ELM_TRAIN_PATH, train_tag + CHECKPOINT_EXT)
+    return saved and not os.path.exists(checkpoint)
+
+
 def config_to_pipeline(config, client=None):
     '''
     Run the elm config's train and predict "run"
@@ -65,7 +120,11 @@ def config_to_pipeline(config, client=None):
         if callable(data_source.get('args_list')):
             kw = {k: v for k, v in data_source.items() if k != 'args_list'}
             data_source['args_list'] = tuple(data_source['args_list'](**kw))
-        if 'train' in step and not getattr(config, 'PREDICT_ONLY', False):
+        if ('train' in step and not getattr(config, 'PREDICT_ONLY', False)
+                and _trained_before_resume(config, step['train'])):
+            logger.info('Resume: load {} (trained and saved before)'.format(step['train']))
+            pipe = load_pipe_from_tag(config.ELM_TRAIN_PATH, step['train'])
+        elif 'train' in step and not getattr(config, 'PREDICT_ONLY', False):
             s = train.get('model_scoring')
             if s:
                 scoring = config.model_scoring[s]
@@ -88,11 +147,15 @@ def config_to_pipeline(config, client=None):
                 kw = dict(evo_params=evo_params)
                 kw.update(data_source)
                 kw.update(ensemble_kwargs)
+                kw['checkpoint'] = _checkpoint_kwargs(config, step['train'],
+                                                      ensemble_kwargs.get('checkpoint'))
                 pipe.fit_ea(**kw)
             else:
                 kw = {}
                 kw.update(data_source)
                 kw.update(ensemble_kwargs)
+                kw['checkpoint'] = _checkpoint_kwargs(config, step['train'],
+                                                      ensemble_kwargs.get('checkpoint'))
                 pipe.fit_ensemble(**kw)
 
             serialize_pipe(pipe, config.ELM_TRAIN_PATH, step['train'])
@@ -103,7 +166,8 @@ def config_to_pipeline(config, client=None):
             logger.info('Do nothing for {} (has no "train" or "predict" key)'.format(step))
         if 'predict' in step:
             # serialize is called with (prediction, sample, tag)
-            serialize = partial(serialize_prediction, config)
+            serialize = partial(serialize_prediction, config,
+                                **_prediction_kwargs(config, step))
             pipe.predict_many(serialize=serialize, **data_source)
 
 
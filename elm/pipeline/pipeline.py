@@ -30,6 +30,7 @@ and y and sample_weight as a numpy arrays or None if not needed.
 from collections import Sequence
 from functools import partial
 import copy
+import hashlib
 import logging
 
 import dill
@@ -39,14 +40,45 @@ from sklearn.exceptions import NotFittedError
 
 from elm.model_selection import get_args_kwargs_defaults
 from elm.model_selection.scoring import score_one_model
-from elm.readers import ElmStore
+from elm.readers import ElmStore, flatten_blocks
 from elm.pipeline.predict_many import predict_many
+from elm.pipeline.compact import (COMPACT_EXT, save_compact, load_compact,
+                                  is_compact)
 from elm.pipeline import steps as STEPS
 from elm.pipeline.ensemble import ensemble as _ensemble
 from elm.pipeline.util import _next_name
 
 logger = logging.getLogger(__name__)
 
+def _step_signature(name, step_cls):
+    '''Name, class and params of a step, used to compare steps
+    across Pipelines'''
+    params = sorted(step_cls.get_params().items(), key=lambda kv: kv[0])
+    return (name, step_cls.__class__.__name__, params)
+
+
+def _partial_fit_transform_step(step_cls, block_idx, X, y=None, sample_weight=None):
+    '''Fit and transform one step after Flatten for one block of rows
+    in Pipeline._run_steps_blocks.  Steps with an estimator are
+    partial_fit on each block if possible, otherwise fit on the first
+    block only'''
+    estimator = getattr(step_cls, '_estimator', None)
+    if estimator is None:
+        return step_cls.fit_transform(X, y=y, sample_weight=sample_weight)
+    if hasattr(estimator, 'partial_fit'):
+        if isinstance(step_cls, STEPS.Transform):
+            step_cls.partial_fit(X, y=y, sample_weight=sample_weight)
+        else:
+            args, kwargs, _, _ = step_cls._filter_kw(estimator.partial_fit, X,
+                                                     y=y, sample_weight=sample_weight)
+            estimator.partial_fit(*args, **kwargs)
+        return step_cls.transform(X, y=y, sample_weight=sample_weight)
+    if block_idx == 0:
+        logger.info('{} has no partial_fit - fitting it on the first block only'.format(estimator))
+        return step_cls.fit_transform(X, y=y, sample_weight=sample_weight)
+    return step_cls.transform(X, y=y, sample_weight=sample_weight)
+
+
 class Pipeline(object):
     '''
     Pipeline of transformation, fit steps for
@@ -63,10 +95,12 @@ class Pipeline(object):
                   http://scikit-learn.org/stable/modules/model_evaluation.html.
                   Also see a custom scoring example in :any:``elm.model_selection.kmeans.kmeans_aic``
         :scoring_kwargs: Keyword args passed to scoring
+        :block_size: If given, fit and partial_fit stream the flattened X through the steps after ``steps.Flatten`` and the final estimator's partial_fit in blocks of about block_size rows
     '''
 
 
-    def __init__(self, steps, scoring=None, scoring_kwargs=None):
+    def __init__(self, steps, scoring=None, scoring_kwargs=None,
+                 block_size=None):
         '''
         Pipeline of transformation, fit steps for
         ensemble, evolutionary and/or partial_fit with dask
@@ -92,13 +126,27 @@ class Pipeline(object):
                         :func:``elm.model_selection.kmeans.kmeans_aic``
 
             :scoring_kwargs: Keyword args passed to scoring
+
+            :block_size: None (default) or the approximate number of
+                     rows (pixels) per block when fitting scenes that
+                     do not fit in memory once flattened.  With
+                     block_size, fit and partial_fit run the steps
+                     before ``steps.Flatten`` on the full X, then
+                     for each block of rows: partial_fit (or, lacking
+                     partial_fit, fit on the first block only) the
+                     steps after Flatten and call partial_fit of the
+                     final estimator.  The final estimator must have
+                     partial_fit.  The score is the mean of the scores
+                     of the fitted Pipeline on each block, weighted by
+                     the number of rows in the block.
         '''
-        self._re_init_args_kwargs = copy.deepcopy(((steps,), dict(scoring=scoring, scoring_kwargs=scoring_kwargs)))
+        self._re_init_args_kwargs = copy.deepcopy(((steps,), dict(scoring=scoring, scoring_kwargs=scoring_kwargs, block_size=block_size)))
         self.steps = steps
         self._validate_steps()
         self._names = [_[0] for _ in self.steps]
         self.scoring_kwargs = scoring_kwargs
         self.scoring = scoring
+        self.block_size = block_size
 
     def new_with_params(self, **new_params):
         '''Return a copy of this Pipeline as it was initialized,
@@ -121,9 +169,18 @@ class Pipeline(object):
                   new_params=None,
                   partial_fit_batches=1,
                   return_X=False,
+                  skip_steps=0,
+                  transform_cache=None,
+                  sample_key=None,
                   **data_source):
         '''Evaluate each fit/transform step in self.steps.  Used
-        by fit, transform, predict and related methods'''
+        by fit, transform, predict and related methods.  skip_steps
+        is the number of leading steps already run on X (see
+        stateless_prefix).  With sklearn_method "fit", a
+        transform_cache (elm.sample_util.sample_cache.TransformCache)
+        and a sample_key naming the sample X, fitted steps and their
+        outputs are reused from Pipelines fit earlier on the same
+        sample with the same params for those steps'''
         from elm.sample_util.sample_pipeline import _split_pipeline_output
         method_kwargs = method_kwargs or {}
         if y is None:
@@ -143,8 +200,24 @@ class Pipeline(object):
                                                      **data_source)
         else:
             X, y, sample_weight = _split_pipeline_output(X, X, y, sample_weight, sklearn_method)
-        for idx, (_, step_cls) in enumerate(self.steps[:-1]):
-
+        if self.block_size and sklearn_method in ('fit', 'partial_fit'):
+            return self._run_steps_blocks(X, y=y, sample_weight=sample_weight,
+                                          method_kwargs=method_kwargs,
+                                          skip_steps=skip_steps)
+        use_cache = (transform_cache is not None and sample_key is not None
+                     and sklearn_method == 'fit')
+        for idx, (name, step_cls) in enumerate(self.steps[:-1]):
+            if idx < skip_steps:
+                continue
+            if use_cache:
+                cache_key = transform_cache.key(sample_key, idx,
+                                                self._steps_token(idx + 1))
+                cached = transform_cache.get(cache_key)
+                if cached is not None:
+                    X, y, sample_weight, fitted = cached
+                    self.steps[idx] = (name, copy.deepcopy(fitted))
+                    fit_func = self.steps[idx][1].fit_transform
+                    continue
             if prepare_for == 'train':
                 fit_func = step_cls.fit_transform
             else:
@@ -156,6 +229,9 @@ class Pipeline(object):
             if func_out is not None:
                 X, y, sample_weight = _split_pipeline_output(func_out, X, y,
                                                        sample_weight, repr(fit_func))
+            if use_cache:
+                transform_cache.put(cache_key, (X, y, sample_weight,
+                                                copy.deepcopy(step_cls)))
         if fit_func and not isinstance(X, (ElmStore, xr.Dataset)):
             raise ValueError('Expected the return value of {} to be an '
                              'elm.readers:ElmStore'.format(fit_func))
@@ -190,6 +266,113 @@ class Pipeline(object):
         # transform or fit_transform most likely
         return _split_pipeline_output(output, X, y, sample_weight, 'fit_transform')
 
+    def _run_steps_blocks(self, X, y=None, sample_weight=None,
+                          method_kwargs=None, skip_steps=0):
+        '''Fit the Pipeline on blocks of rows of the flattened X,
+        calling partial_fit of the final estimator once per block.
+        See block_size in __init__.  y and sample_weight, if given,
+        are indexed like the rows of the flattened X.  With scoring,
+        a second pass over the blocks scores the fitted Pipeline'''
+        from elm.sample_util.sample_pipeline import _split_pipeline_output
+        if not hasattr(self._estimator, 'partial_fit'):
+            raise ValueError('Pipeline with block_size requires a final '
+                             'estimator with partial_fit, not {}'.format(self._estimator))
+        flat_idx = [idx for idx, (_, step_cls) in enumerate(self.steps[:-1])
+                    if isinstance(step_cls, STEPS.Flatten)]
+        if not flat_idx:
+            raise ValueError('Pipeline with block_size requires a steps.Flatten() step')
+        flat_idx = flat_idx[0]
+        for _, step_cls in self.steps[skip_steps:flat_idx]:
+            func_out = step_cls.fit_transform(X, y=y, sample_weight=sample_weight)
+            if func_out is not None:
+                X, y, sample_weight = _split_pipeline_output(func_out, X, y,
+                                                       sample_weight, repr(step_cls))
+        fitted = False
+        for X_block, y_block, sw_block in self._flat_blocks(X, y, sample_weight,
+                                                            flat_idx, skip_steps, fit=True):
+            args, kwargs = self._post_run_pipeline(self._estimator.partial_fit,
+                                                   self._estimator,
+                                                   X_block,
+                                                   y=y_block,
+                                                   sample_weight=sw_block,
+                                                   method_kwargs=method_kwargs)
+            self._estimator.partial_fit(*args, **kwargs)
+            fitted = True
+        if not fitted:
+            raise ValueError('No rows of X remained in any block (block_size={})'.format(self.block_size))
+        if not self.scoring:
+            self._score_estimator(X, y=y, sample_weight=sample_weight)
+            return self
+        # Score the fitted Pipeline on every block, weighting
+        # each block's score by its number of rows, so that the
+        # score does not depend on the size of the last block
+        scores, rows = [], []
+        for X_block, y_block, sw_block in self._flat_blocks(X, y, sample_weight,
+                                                            flat_idx, skip_steps, fit=False):
+            self._score_estimator(X_block, y=y_block, sample_weight=sw_block)
+            scores.append(self._score)
+            rows.append(X_block.flat.values.shape[0])
+        self._score = np.average(scores, axis=0, weights=rows)
+        return self
+
+    def _flat_blocks(self, X, y, sample_weight, flat_idx, skip_steps, fit=True):
+        '''Generator of (X_block, y_block, sample_weight_block) of
+        flatten_blocks of X run through the steps after Flatten,
+        partial_fit on each block if fit is True, else only
+        transforming.  Blocks left with no rows are skipped'''
+        from elm.sample_util.sample_pipeline import _split_pipeline_output
+        dtype = self.steps[flat_idx][1].dtype
+        for block_idx, X_block in enumerate(flatten_blocks(X, self.block_size, dtype=dtype)):
+            space = X_block.flat.space.values
+            y_block, sw_block = (None if arr is None else np.asarray(arr)[space]
+                                 for arr in (y, sample_weight))
+            logger.debug('Pipeline block {} of {} rows'.format(block_idx, space.size))
+            for _, step_cls in self.steps[max(flat_idx + 1, skip_steps):-1]:
+                if fit:
+                    func_out = _partial_fit_transform_step(step_cls, block_idx, X_block,
+                                                           y=y_block, sample_weight=sw_block)
+                elif getattr(step_cls, '_estimator', None) is None:
+                    func_out = step_cls.fit_transform(X_block, y=y_block, sample_weight=sw_block)
+                else:
+                    func_out = step_cls.transform(X_block, y=y_block, sample_weight=sw_block)
+                X_block, y_block, sw_block = _split_pipeline_output(func_out, X_block, y_block,
+                                                       sw_block, repr(step_cls))
+            if not X_block.flat.values.shape[0]:
+                continue
+            yield X_block, y_block, sw_block
+
+    def stateless_prefix(self):
+        '''Return (n_steps, signature) for the leading steps that have
+        no fitted state, such as SelectCanvas, Flatten, DropNaRows and
+        Agg.  Pipelines with equal signatures give the same output
+        for those steps on the same sample (see fit_transform_prefix)'''
+        prefix = []
+        for name, step_cls in self.steps[:-1]:
+            if getattr(step_cls, '_estimator', None) is not None:
+                break
+            prefix.append(_step_signature(name, step_cls))
+        return len(prefix), repr(prefix)
+
+    def _steps_token(self, n_steps):
+        '''Hash of the names, classes and params of the first n_steps steps'''
+        sig = [_step_signature(name, step_cls)
+               for name, step_cls in self.steps[:n_steps]]
+        return hashlib.sha1(repr(sig).encode()).hexdigest()
+
+    def fit_transform_prefix(self, X, y=None, sample_weight=None, n_steps=0):
+        '''Run the first n_steps steps on a sample, returning
+        (X, y, sample_weight).  Fitting with skip_steps=n_steps on the
+        output is the same as fitting on the sample'''
+        from elm.sample_util.sample_pipeline import _split_pipeline_output
+        X, y, sample_weight = _split_pipeline_output(X, X, y, sample_weight,
+                                                     'fit_transform_prefix')
+        for _, step_cls in self.steps[:n_steps]:
+            func_out = step_cls.fit_transform(X, y=y, sample_weight=sample_weight)
+            if func_out is not None:
+                X, y, sample_weight = _split_pipeline_output(func_out, X, y,
+                                                       sample_weight, repr(step_cls))
+        return X, y, sample_weight
+
     def _post_run_pipeline(self, fitter_or_predict, estimator,
                            X, y=None, sample_weight=None, prepare_for='train',
                            method_kwargs=None):
@@ -487,7 +670,8 @@ class Pipeline(object):
     def predict_many(self, X=None, sampler=None, args_list=None,
                      client=None, ensemble=None, to_raster=True,
                      saved_model_tag=None,
-                     serialize=None, **data_source):
+                     serialize=None, tile_size=None, tile_threads=None,
+                     **data_source):
         '''
         Predict from an ensemble of models for fixed X or series of
         sampler calls.
@@ -531,6 +715,17 @@ class Pipeline(object):
                     :elm_predict_path: is the root dir for serialization
                         output, defaulting to ELM_PREDICT_PATH from environment
                         variables
+            :tile_size: None (default) to predict each sample in one
+               call, or an int or (rows, cols) tuple to predict each
+               sample in spatial windows of that size, in parallel with
+               tile_threads threads within each predict task, writing
+               each window into one (float64, NaN filled) raster.
+               Requires to_raster=True and 2-D bands with a shared Canvas
+            :tile_threads: number of threads predicting the windows of
+               each sample with tile_size, or None (default) for
+               DASK_THREADS divided by the number of (sample, model)
+               combinations, at least 1.  Used with any client, so that
+               a single model and sample use every core
             :\*\*data_source: keyword args passed to the sampler on each call
 
         Returns:
@@ -547,7 +742,9 @@ class Pipeline(object):
                  client=client,
                  serialize=serialize,
                  to_raster=to_raster,
-                 saved_model_tag=saved_model_tag)
+                 saved_model_tag=saved_model_tag,
+                 tile_size=tile_size,
+                 tile_threads=tile_threads)
 
 
     def _score_estimator(self, X, y=None, sample_weight=None):
@@ -572,26 +769,36 @@ class Pipeline(object):
         '''save the Pipeline to filename
 
         Parameters:
-            :filename: string filename
+            :filename: string filename.  If it ends with ".elm", save
+                       in the compact format of
+                       :mod:`elm.pipeline.compact` (a directory with
+                       a JSON manifest and memory-mappable arrays)
 
         Returns:
             None
 
-        Uses dill.dump
+        Uses dill.dump for other filenames
         '''
+        if filename.endswith(COMPACT_EXT):
+            save_compact(self, filename)
+            return
         with open(filename, 'wb') as f:
             return dill.dump(self, f)
 
     @classmethod
-    def load(self, filename):
-        '''load a Pipeline from dill dump
+    def load(self, filename, mmap=True):
+        '''load a Pipeline from dill dump or compact save directory
 
         Parameters:
             :filename: string filename
+            :mmap:     memory-map arrays of a compact save (see
+                       :func:`elm.pipeline.compact.load_compact`)
 
         Returns:
             :Pipeline: fitted pipeline with "ensemble" attribute if fit_ensemble or fit_ea were called.
         '''
+        if is_compact(filename):
+            return load_compact(filename, mmap=mmap)
         with open(filename, 'rb') as f:
             return dill.load(f)
 
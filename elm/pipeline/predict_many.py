@@ -1,17 +1,22 @@
+from collections import OrderedDict
 from functools import partial
 import copy
 import datetime
 import itertools
 import logging
+from multiprocessing.pool import ThreadPool
 import os
 
-import dask
 import numpy as np
 import xarray as xr
 
 
 from elm.config import import_callable, parse_env_vars
+from elm.config.dask_settings import (_find_get_func_for_client,
+                                      _scatter_func_for_client)
 from elm.readers import inverse_flatten, ElmStore
+from elm.readers.reshape import window_elm_store
+from elm.readers.util import canvas_to_coords, get_shared_canvas
 from elm.sample_util.samplers import make_samples_dask
 from elm.pipeline.util import _next_name
 
@@ -63,16 +68,100 @@ def _predict_one_sample_one_arg(estimator,
     return out
 
 
+def _tile_slices(canvas, tile_size):
+    '''Row, column slices of windows of tile_size over a 2-D canvas'''
+    if isinstance(tile_size, int):
+        tile_rows = tile_cols = tile_size
+    else:
+        tile_rows, tile_cols = tile_size
+    nrows, ncols = canvas.buf_ysize, canvas.buf_xsize
+    return [(slice(r, min(r + tile_rows, nrows)), slice(c, min(c + tile_cols, ncols)))
+            for r in range(0, nrows, tile_rows)
+            for c in range(0, ncols, tile_cols)]
+
+
+def _predict_tile(estimator, X, canvas, rows, cols):
+    '''Predict one window of X.  Returns the prediction (2-d) and
+    its row, col indices in the raster'''
+    tile = window_elm_store(X, canvas, rows, cols)
+    prediction, X_final = estimator.predict(tile, return_X=True)
+    if prediction.ndim == 1:
+        prediction = prediction[:, np.newaxis]
+    elif prediction.ndim != 2:
+        raise ValueError('Expected 1- or 2-d output of model.predict but found ndim of prediction: {}'.format(prediction.ndim))
+    shp = (rows.stop - rows.start, cols.stop - cols.start)
+    space = np.asarray(X_final.flat.space.values)
+    if space.size and space.max() >= shp[0] * shp[1]:
+        raise ValueError('Cannot use tile_size with a Pipeline that changes the Canvas of X (e.g. SelectCanvas with a different Canvas)')
+    r, c = np.unravel_index(space, shp)
+    r += rows.start
+    c += cols.start
+    return prediction, r, c
+
+
+def _predict_one_sample_tiles(estimator,
+                              serialize,
+                              tile_size,
+                              tile_threads,
+                              predict_tag,
+                              elm_predict_path,
+                              X_y_sample_weight):
+    '''Predict a sample in spatial windows of tile_size pixels, in
+    parallel with tile_threads threads, and reassemble the raster'''
+    X, y, sample_weight = X_y_sample_weight
+    if not isinstance(X, (ElmStore, xr.Dataset)):
+        raise ValueError('Expected an ElmStore or xarray.Dataset')
+    canvas = get_shared_canvas(X)
+    if not canvas or len(canvas.dims) != 2 or any(getattr(X, band).dims != tuple(canvas.dims)
+                                                  for band in X.band_order):
+        raise ValueError('tile_size requires 2-D bands that share a Canvas (call steps.SelectCanvas first)')
+    slices = _tile_slices(canvas, tile_size)
+    predict_tile = partial(_predict_tile, estimator, X, canvas)
+    tile_threads = min(tile_threads, len(slices))
+    if tile_threads > 1:
+        with ThreadPool(tile_threads) as pool:
+            tiles = pool.starmap(predict_tile, slices)
+    else:
+        tiles = [predict_tile(*slc) for slc in slices]
+    out = np.full((tiles[0][0].shape[1], canvas.buf_ysize, canvas.buf_xsize), np.NaN)
+    for prediction, r, c in tiles:
+        out[:, r, c] = prediction.T
+    if out.shape[0] == 1:
+        bands = ['predict']
+    else:
+        bands = ['predict_{}'.format(idx) for idx in range(out.shape[0])]
+    attrs = copy.deepcopy(X.attrs)
+    attrs['canvas'] = canvas
+    attrs['elm_predict_date'] = datetime.datetime.utcnow().isoformat()
+    attrs['band_order'] = bands
+    coords = canvas_to_coords(canvas)
+    logger.debug('Predicted {} tiles of X with canvas {}'.format(len(slices), canvas))
+    new_es = ElmStore(OrderedDict((band, xr.DataArray(out[idx],
+                                                      coords=coords,
+                                                      dims=canvas.dims,
+                                                      attrs=attrs))
+                                  for idx, band in enumerate(bands)),
+                      attrs=attrs)
+    if serialize:
+        new_es = serialize(y=new_es, X=X, tag=predict_tag,
+                           elm_predict_path=elm_predict_path)
+    return [new_es]
+
+
 def predict_many(data_source,
                  saved_model_tag=None,
                  ensemble=None,
                  client=None,
                  serialize=None,
                  to_raster=True,
-                 elm_predict_path=None):
+                 elm_predict_path=None,
+                 tile_size=None,
+                 tile_threads=None):
     '''See elm.pipeline.Pipeline.predict_many method
 
     '''
+    if tile_size and not to_raster:
+        raise ValueError('tile_size requires to_raster=True')
 
     env = parse_env_vars()
     elm_predict_path = elm_predict_path or env.get('ELM_PREDICT_PATH')
@@ -84,9 +173,14 @@ def predict_many(data_source,
     y = ds.pop('y', None)
     args_list = ds.pop('args_list', None)
     sampler = ds.pop('sampler', None)
-    dsk = make_samples_dask(X, y, None, pipe_example, args_list, sampler, ds)
+    dsk = make_samples_dask(X, y, None, pipe_example, args_list, sampler, ds,
+                            scatter=_scatter_func_for_client(client))
     sample_keys = tuple(dsk)
     args_list = tuple(itertools.product(sample_keys, ensemble))
+    if tile_size and not tile_threads:
+        # share DASK_THREADS among the (sample, model) predict tasks,
+        # which may run concurrently
+        tile_threads = max(1, env['DASK_THREADS'] // len(args_list))
     keys = []
     last_file_name = None
     for idx, (sample_key, (estimator_tag, estimator)) in enumerate(args_list):
@@ -94,13 +188,23 @@ def predict_many(data_source,
         predict_tag = '{}-{}'.format(estimator_tag, sample_key)
         if saved_model_tag:
             predict_tag += '-' + saved_model_tag
-        dsk[name] = (_predict_one_sample_one_arg,
-                     estimator,
-                     serialize,
-                     to_raster,
-                     predict_tag,
-                     elm_predict_path,
-                     sample_key,)
+        if tile_size:
+            dsk[name] = (_predict_one_sample_tiles,
+                         estimator,
+                         serialize,
+                         tile_size,
+                         tile_threads,
+                         predict_tag,
+                         elm_predict_path,
+                         sample_key,)
+        else:
+            dsk[name] = (_predict_one_sample_one_arg,
+                         estimator,
+                         serialize,
+                         to_raster,
+                         predict_tag,
+                         elm_predict_path,
+                         sample_key,)
 
 
         keys.append(name)
@@ -108,9 +212,6 @@ def predict_many(data_source,
                 '({} combination[s])'.format(len(ensemble),
                                          len(sample_keys),
                                          len(args_list)))
-    preds = []
-    if client is None:
-        new = dask.get(dsk, keys)
-    else:
-        new = client.get(dsk, keys)
+    get_func = _find_get_func_for_client(client)
+    new = get_func(dsk, keys)
     return tuple(itertools.chain.from_iterable(new))
@@ -3,27 +3,70 @@
 
 ``elm.pipeline.serialize``
 ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Predictions from the config file interface are written once each, by
+default as a chunked, zlib-compressed NetCDF4 (HDF5) file (``.nc``)
+per prediction tag and bounds, with the canvas and geo_transform in
+the attributes.  ``prediction_format='zarr'`` writes a Zarr directory
+instead and ``prediction_format='geotiff'`` a tiled, compressed
+Cloud-Optimized GeoTIFF with overviews (raster predictions, such as
+``predict_many(to_raster=True)`` outputs).  Each file is written to a temporary name and renamed, so
+predict_many workers can write their predictions in parallel.  See
+:func:`load_prediction` for reading them back lazily.
 '''
 import glob
+import json
 import logging
+import numbers
 import os
 import pickle
 import re
+import shutil
+import threading
 
+from affine import Affine
 import attr
 import dill
+import gdal
 import numpy as np
+import rasterio as rio
+from rasterio.coords import BoundingBox
+from rasterio.enums import Resampling
+import xarray as xr
+
+from elm.config import parse_env_vars
+from elm.pipeline.compact import COMPACT_EXT
+from elm.readers import ElmStore
+from elm.readers.util import Canvas
 
 
-__all__ = ['serialize_pipe', 'serialize_prediction']
+__all__ = ['serialize_pipe', 'serialize_prediction', 'load_prediction']
 
 logger = logging.getLogger(__name__)
 
 BOUNDS_FORMAT = '{:0.4f}_{:0.4f}_{:0.4f}_{:0.4f}'
 
+PREDICTION_FORMATS = {'netcdf': '.nc', 'zarr': '.zarr', 'geotiff': '.tif',
+                      'pickle': '.xr'}
+# serialize_prediction keywords that may be given in an elm config's
+# "predict" section or a "run" action with "predict"
+PREDICTION_KWARGS = ('prediction_format', 'blocksize', 'complevel', 'chunks')
+
+# overviews are added (factors 2, 4, 8...) until the coarsest
+# fits in about one tile
+MIN_OVERVIEW_SIZE = 256
+
+# attrs that are stored as JSON strings in NetCDF / Zarr output
+JSON_ATTRS = '_elm_json_attrs'
 
-def _get_path_for_tag(elm_train_path, tag):
-    return os.path.join(elm_train_path, tag + '.pkl')
+# the HDF5 library is not thread safe - serialize NetCDF4 writes
+# from threads of one process (processes / workers write in parallel)
+_NETCDF_LOCK = threading.Lock()
+
+
+def _get_path_for_tag(elm_train_path, tag, compact=True):
+    ext = COMPACT_EXT if compact else '.pkl'
+    return os.path.join(elm_train_path, tag + ext)
 
 
 def mkdir_p(path):
@@ -39,7 +82,9 @@ def serialize_pipe(pipe, elm_train_path, tag, **meta):
         :pipe: an elm.pipeline.Pipeline instance
         :elm_train_path: root dir for serializing trained ensembles
         :tag: tag for the ensemble
-        :\*\*meta: ignored
+        :\*\*meta: may contain compact=False to dill dump
+                  the Pipeline to a ".pkl" file rather than save the
+                  compact format of :mod:`elm.pipeline.compact`
 
     Returns: ``None``
 
@@ -47,7 +92,8 @@ def serialize_pipe(pipe, elm_train_path, tag, **meta):
     '''
     logger.debug('Save pipe at {} with tag {}'.format(elm_train_path, tag))
     mkdir_p(elm_train_path)
-    path = _get_path_for_tag(elm_train_path, tag)
+    path = _get_path_for_tag(elm_train_path, tag,
+                             compact=meta.get('compact', True))
     return pipe.save(path)
 
 
@@ -60,10 +106,14 @@ def load_pipe_from_tag(elm_train_path, tag):
 
     Returns:
         :elm.pipeline.Pipeline: instance (fitted if it was fitted before saving)
+
+    Loads the compact ".elm" save if it exists, otherwise a ".pkl"
         '''
     from elm.pipeline import Pipeline
     logger.debug('Load {} from {}'.format(tag, elm_train_path))
     path = _get_path_for_tag(elm_train_path, tag)
+    if not os.path.exists(path):
+        path = _get_path_for_tag(elm_train_path, tag, compact=False)
     if not os.path.exists(path):
         raise IOError('Cannot load from {} (does not exist)'.format(path))
     return Pipeline.load(path)
@@ -77,6 +127,234 @@ def predict_to_pickle(prediction, fname_base):
         return dill.dump(prediction, f)
 
 
+def _json_default(obj):
+    if isinstance(obj, Canvas):
+        return attr.asdict(obj)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    return repr(obj)
+
+
+def _encode_attrs(attrs):
+    '''Return attrs with values NetCDF cannot store (Canvas, dicts,
+    booleans, lists of str, None...) as JSON strings'''
+    out = {}
+    json_keys = []
+    for k, v in attrs.items():
+        if isinstance(v, (str, numbers.Number)) and not isinstance(v, bool):
+            out[k] = v
+            continue
+        if isinstance(v, (tuple, list, np.ndarray)) and len(v) and all(
+                isinstance(item, numbers.Number) and not isinstance(item, bool)
+                for item in v):
+            out[k] = np.asarray(v)
+            continue
+        out[k] = json.dumps(v, default=_json_default)
+        json_keys.append(k)
+    if json_keys:
+        out[JSON_ATTRS] = json.dumps(json_keys)
+    return out
+
+
+def _decode_attrs(attrs):
+    '''Inverse of _encode_attrs, making a Canvas of a "canvas" attr'''
+    attrs = dict(attrs)
+    for k in json.loads(attrs.pop(JSON_ATTRS, '[]')):
+        attrs[k] = json.loads(attrs[k])
+    if 'geo_transform' in attrs:
+        attrs['geo_transform'] = tuple(np.atleast_1d(attrs['geo_transform']).tolist())
+    canvas = attrs.get('canvas')
+    if isinstance(canvas, dict):
+        canvas['geo_transform'] = tuple(canvas['geo_transform'])
+        canvas['dims'] = tuple(canvas['dims'])
+        if canvas.get('bounds') is not None:
+            canvas['bounds'] = BoundingBox(*canvas['bounds'])
+        attrs['canvas'] = Canvas(**canvas)
+    return attrs
+
+
+def _encoded_dataset(prediction):
+    '''Copy of prediction with encoded attrs, geo_transform from canvas'''
+    ds = xr.Dataset(prediction.data_vars,
+                    attrs=dict(prediction.attrs)).copy(deep=False)
+    for obj in [ds] + [ds[band] for band in ds.data_vars]:
+        attrs = dict(obj.attrs)
+        canvas = attrs.get('canvas')
+        if isinstance(canvas, Canvas):
+            attrs['geo_transform'] = canvas.geo_transform
+        obj.attrs = _encode_attrs(attrs)
+    return ds
+
+
+def _netcdf_encoding(ds, complevel, chunks):
+    encoding = {}
+    for band in ds.data_vars:
+        arr = ds[band]
+        enc = {'zlib': bool(complevel), 'complevel': complevel}
+        if chunks and arr.ndim:
+            enc['chunksizes'] = tuple(min(chunks, size) for size in arr.shape)
+        encoding[band] = enc
+    return encoding
+
+
+def _replace(tmp, fname):
+    if os.path.isdir(fname):
+        shutil.rmtree(fname)
+    os.replace(tmp, fname)
+
+
+def predict_to_netcdf(prediction, fname_base, complevel=4, chunks=512):
+    '''Write a prediction ElmStore once as a chunked, compressed NetCDF4 file
+
+    Parameters:
+        :prediction: ElmStore
+        :fname_base: file name without extension (".nc" is added)
+        :complevel:  zlib compression level (0 for none)
+        :chunks:     chunk size (each dimension) of the HDF5 chunks
+
+    Returns:
+        :fname: file name written
+    '''
+    mkdir_p(fname_base)
+    fname = fname_base + PREDICTION_FORMATS['netcdf']
+    tmp = fname + '.tmp'
+    ds = _encoded_dataset(prediction)
+    with _NETCDF_LOCK:
+        ds.to_netcdf(tmp, format='NETCDF4', engine='netcdf4',
+                     encoding=_netcdf_encoding(ds, complevel, chunks))
+    _replace(tmp, fname)
+    return fname
+
+
+def predict_to_zarr(prediction, fname_base, chunks=512):
+    '''Write a prediction ElmStore once as a chunked Zarr directory
+    (".zarr" is added to fname_base).  Returns the directory name'''
+    mkdir_p(fname_base)
+    fname = fname_base + PREDICTION_FORMATS['zarr']
+    tmp = fname + '.tmp'
+    ds = _encoded_dataset(prediction)
+    if not hasattr(ds, 'to_zarr'):
+        raise ValueError('prediction_format="zarr" requires a newer xarray and zarr')
+    if chunks:
+        ds = ds.chunk(chunks)
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    ds.to_zarr(tmp)
+    _replace(tmp, fname)
+    return fname
+
+
+def _raster_bands(prediction):
+    '''Names of the 2-D bands of prediction and their shared canvas'''
+    bands = [band for band in getattr(prediction, 'band_order', prediction.data_vars)
+             if band != 'flat']
+    if not bands:
+        raise ValueError('Expected a raster prediction (e.g. predict_many(to_raster=True)), not "flat"')
+    canvas = getattr(prediction, 'canvas', None)
+    if canvas is None:
+        canvas = getattr(prediction, bands[0]).canvas
+    for band in bands:
+        if getattr(prediction, band).dims != tuple(canvas.dims) or len(canvas.dims) != 2:
+            raise ValueError('Expected 2-D bands on one canvas for GeoTIFF, found {} with dims {}'.format(band, getattr(prediction, band).dims))
+    return bands, canvas
+
+
+def _overview_factors(height, width):
+    factors = []
+    factor = 2
+    while max(height, width) // factor >= MIN_OVERVIEW_SIZE:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+def predict_to_geotiff(prediction, fname_base, blocksize=512,
+                       compress='DEFLATE', resampling='nearest', crs=None):
+    '''Write a raster prediction ElmStore as a Cloud-Optimized GeoTIFF:
+    tiled, compressed, with internal overviews and the canvas geo_transform
+
+    Parameters:
+        :prediction: ElmStore of 2-D bands sharing a canvas (one
+                     GeoTIFF band for each)
+        :fname_base: file name without extension (".tif" is added)
+        :blocksize:  tile size (multiple of 16)
+        :compress:   GeoTIFF COMPRESS creation option or None
+        :resampling: name of a rasterio.enums.Resampling for the overviews
+        :crs:        None or a CRS (e.g. "EPSG:4326") for the GeoTIFF
+
+    Returns:
+        :fname: file name written
+
+    Bands are written one block (tile) window at a time, so a
+    prediction of dask arrays (see load_prediction) is not loaded whole
+    '''
+    bands, canvas = _raster_bands(prediction)
+    mkdir_p(fname_base)
+    fname = fname_base + PREDICTION_FORMATS['geotiff']
+    tmp = fname + '.tmp.tif'
+    height, width = canvas.buf_ysize, canvas.buf_xsize
+    dtype = np.result_type(*(getattr(prediction, band).dtype for band in bands))
+    profile = dict(driver='GTiff', height=height, width=width,
+                   count=len(bands), dtype=dtype.name, crs=crs,
+                   transform=Affine.from_gdal(*canvas.geo_transform),
+                   tiled=True, blockxsize=blocksize, blockysize=blocksize,
+                   BIGTIFF='IF_SAFER')
+    if compress:
+        profile['compress'] = compress
+    if dtype.kind == 'f':
+        profile['nodata'] = np.nan
+    with rio.open(tmp, 'w', **profile) as dst:
+        for idx, band in enumerate(bands, 1):
+            band_arr = getattr(prediction, band)
+            for row in range(0, height, blocksize):
+                rows = (row, min(row + blocksize, height))
+                for col in range(0, width, blocksize):
+                    cols = (col, min(col + blocksize, width))
+                    block = np.asarray(band_arr[slice(*rows), slice(*cols)].values,
+                                       dtype=dtype)
+                    dst.write(block, idx, window=(rows, cols))
+        factors = _overview_factors(height, width)
+        if factors:
+            dst.build_overviews(factors, getattr(Resampling, resampling))
+            dst.update_tags(ns='rio_overview', resampling=resampling)
+        dst.update_tags(band_order=json.dumps(bands))
+    # COPY_SRC_OVERVIEWS puts the overviews before the full resolution
+    # tiles - the Cloud-Optimized layout
+    options = ['TILED=YES', 'COPY_SRC_OVERVIEWS=YES', 'BIGTIFF=IF_SAFER',
+               'BLOCKXSIZE={}'.format(blocksize),
+               'BLOCKYSIZE={}'.format(blocksize)]
+    if compress:
+        options.append('COMPRESS={}'.format(compress))
+    out = gdal.Translate(fname + '.tmp', tmp, format='GTiff',
+                         creationOptions=options)
+    out = None # flush and close
+    os.remove(tmp)
+    _replace(fname + '.tmp', fname)
+    return fname
+
+
+def load_prediction(fname, chunks=None):
+    '''Open a prediction written by serialize_prediction as an ElmStore
+
+    Parameters:
+        :fname:  a ".nc" file or ".zarr" directory name
+        :chunks: dask chunks dict for a NetCDF file, or None for
+                 one chunk per variable
+
+    Returns:
+        :ElmStore: with dask arrays, read lazily chunk by chunk
+    '''
+    if os.path.isdir(fname):
+        ds = xr.open_zarr(fname)
+    else:
+        ds = xr.open_dataset(fname, chunks=chunks or {})
+    for band in ds.data_vars:
+        ds[band].attrs = _decode_attrs(ds[band].attrs)
+    return ElmStore(ds.data_vars, attrs=_decode_attrs(ds.attrs))
+
+
 def predict_file_name(elm_predict_path, tag, bounds):
     '''Form a file name from bounds'''
     fmt = '{:0.4f}_{:0.4f}_{:0.4f}_{:0.4f}'
@@ -88,6 +366,39 @@ def predict_file_name(elm_predict_path, tag, bounds):
                                    bounds.top))
 
 
+def _find_crs(attrs, depth=0):
+    '''Return the "crs" in attrs of an ElmStore or DataArray, looking
+    in the rasterio "meta" of GeoTiff bands (elm.readers.load_tif_meta)
+    and in "band_meta" of a directory of GeoTiffs, or None'''
+    if isinstance(attrs, (list, tuple)):
+        for item in attrs:
+            crs = _find_crs(item, depth)
+            if crs:
+                return crs
+        return None
+    if not isinstance(attrs, dict) or depth > 3:
+        return None
+    if attrs.get('crs'):
+        return attrs['crs']
+    for key in ('meta', 'band_meta'):
+        crs = _find_crs(attrs.get(key), depth + 1)
+        if crs:
+            return crs
+    return None
+
+
+def _sample_crs(*stores):
+    '''CRS from the attrs of the first of stores (or their bands) having one'''
+    for es in stores:
+        if es is None:
+            continue
+        attrs = [es.attrs] + [getattr(es, band).attrs for band in es.data_vars]
+        crs = _find_crs(attrs)
+        if crs:
+            return crs
+    return None
+
+
 def serialize_prediction(config, y, X, tag, **kwargs):
     '''This function is called by elm.pipeline.parse_run_config
     to serialize the prediction outputs of models run through
@@ -102,6 +413,14 @@ def serialize_prediction(config, y, X, tag, **kwargs):
         :tag:     unique tag based on sample, estimator, ensemble
         :kwargs:  keywords may contain:
                   elm_predict_path: defaulting
+                  prediction_format: "netcdf" (default), "zarr",
+                                     "geotiff" or "pickle"
+                  complevel: zlib compression level for "netcdf"
+                  chunks: chunk size for "netcdf" or "zarr"
+                  blocksize: tile size for "geotiff"
+                  crs: CRS for "geotiff", defaulting to the CRS
+                       in the attrs of y or X (e.g. the rasterio
+                       meta of GeoTiff bands), if any
 
     Returns: ``True``
 
@@ -119,10 +438,24 @@ def serialize_prediction(config, y, X, tag, **kwargs):
             root = parse_env_vars()['ELM_PREDICT_PATH']
     else:
         root = config.ELM_PREDICT_PATH
-    for band in X.data_vars:
-        band_arr = getattr(X, band)
-        fname = predict_file_name(root,
-                                  tag,
-                                  getattr(band_arr, 'canvas', getattr(X, 'canvas')).bounds)
+    prediction_format = kwargs.get('prediction_format', 'netcdf')
+    if prediction_format not in PREDICTION_FORMATS:
+        raise ValueError('prediction_format {} not in {}'.format(prediction_format, tuple(PREDICTION_FORMATS)))
+    canvas = getattr(X, 'canvas', None)
+    if canvas is None:
+        band_arr = getattr(X, tuple(X.data_vars)[0])
+        canvas = getattr(band_arr, 'canvas')
+    fname = predict_file_name(root, tag, canvas.bounds)
+    chunks = kwargs.get('chunks', 512)
+    if prediction_format == 'netcdf':
+        predict_to_netcdf(y, fname, complevel=kwargs.get('complevel', 4),
+                          chunks=chunks)
+    elif prediction_format == 'zarr':
+        predict_to_zarr(y, fname, chunks=chunks)
+    elif prediction_format == 'geotiff':
+        crs = kwargs.get('crs') or _sample_crs(y, X)
+        predict_to_geotiff(y, fname, blocksize=kwargs.get('blocksize', 512),
+                           crs=crs)
+    else:
         predict_to_pickle(y, fname)
     return True
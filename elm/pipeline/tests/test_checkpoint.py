@@ -0,0 +1,98 @@
+import os
+import random
+
+import pytest
+from sklearn.cluster import MiniBatchKMeans
+
+from elm.pipeline import Pipeline, steps
+from elm.pipeline.checkpoint import Checkpoint, as_checkpoint
+from elm.pipeline.tests.util import random_elm_store
+
+
+def test_checkpoint_save_load(tmpdir):
+    fname = os.path.join(str(tmpdir), 'run.checkpoint')
+    ckpt = Checkpoint(fname, every=2)
+    assert not ckpt.save(0, ngen=10, models=[])
+    assert ckpt.save(1, ngen=10, models=['a'])
+    assert not ckpt.save(9, ngen=10, models=[])
+    after_save = random.random()
+    assert Checkpoint(fname).load() is None
+    state = Checkpoint(fname, resume=True).load()
+    assert state['gen'] == 1 and state['models'] == ['a']
+    assert random.random() == after_save
+    ckpt.clear()
+    assert not os.path.exists(fname)
+
+
+def test_as_checkpoint():
+    assert as_checkpoint(None) is None
+    assert as_checkpoint(False) is None
+    ckpt = as_checkpoint({'filename': 'x.checkpoint', 'every': 3})
+    assert ckpt.every == 3 and not ckpt.resume
+    assert as_checkpoint(ckpt) is ckpt
+    with pytest.raises(ValueError):
+        as_checkpoint(1)
+    with pytest.raises(ValueError):
+        Checkpoint('x.checkpoint', every=0)
+
+
+class _Config(object):
+    ELM_TRAIN_PATH = 'train_path'
+    RESUME = True
+
+
+@pytest.mark.parametrize('checkpoint, expected', [
+    (None, {}),
+    (True, {}),
+    (5, {'every': 5}),
+    ('x.checkpoint', {'filename': 'x.checkpoint'}),
+    ({'every': 2, 'resume': False}, {'every': 2, 'resume': False}),
+])
+def test_checkpoint_kwargs(checkpoint, expected):
+    from elm.pipeline.parse_run_config import _checkpoint_kwargs
+    kw = _checkpoint_kwargs(_Config, 'kmeans', checkpoint)
+    default = {'filename': os.path.join('train_path', 'kmeans.checkpoint'),
+               'resume': True}
+    assert kw == dict(default, **expected)
+    ckpt = as_checkpoint(kw)
+    assert ckpt.every == expected.get('every', 1)
+
+
+def test_checkpoint_kwargs_off_or_invalid():
+    from elm.pipeline.parse_run_config import _checkpoint_kwargs
+    assert _checkpoint_kwargs(_Config, 'kmeans', False) is None
+    with pytest.raises(ValueError):
+        _checkpoint_kwargs(_Config, 'kmeans', [1])
+
+
+class _CrashAfter(Checkpoint):
+    '''Raises after checkpointing generation crash_gen'''
+    crash_gen = 1
+    def save(self, gen, **kwargs):
+        saved = super(_CrashAfter, self).save(gen, **kwargs)
+        if gen == self.crash_gen:
+            raise RuntimeError('Worker lost')
+        return saved
+
+
+class _RecordResume(Checkpoint):
+    resumed_gen = None
+    def load(self):
+        state = super(_RecordResume, self).load()
+        self.resumed_gen = state['gen']
+        return state
+
+
+def test_ensemble_resume(tmpdir):
+    fname = os.path.join(str(tmpdir), 'kmeans.checkpoint')
+    X = random_elm_store(bands=3, height=30, width=40)
+    kw = dict(X=X, ngen=4, init_ensemble_size=2)
+    pipe = Pipeline([steps.Flatten(), MiniBatchKMeans(n_clusters=3)])
+    with pytest.raises(RuntimeError):
+        pipe.fit_ensemble(checkpoint=_CrashAfter(fname), **kw)
+    assert os.path.exists(fname)
+    ckpt = _RecordResume(fname, resume=True)
+    fitted = pipe.fit_ensemble(checkpoint=ckpt, **kw)
+    assert ckpt.resumed_gen == 1
+    assert len(fitted.ensemble) == 2
+    assert not os.path.exists(fname)
@@ -0,0 +1,65 @@
+import json
+import os
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import IncrementalPCA
+
+from elm.pipeline import Pipeline, steps
+from elm.pipeline.compact import LazyEnsemble, MANIFEST
+from elm.pipeline.serialize import serialize_pipe, load_pipe_from_tag
+from elm.pipeline.tests.util import random_elm_store
+
+
+def _fitted():
+    X = random_elm_store(bands=4, height=40, width=50)
+    pipe = Pipeline([steps.Flatten(),
+                     steps.Transform(IncrementalPCA(n_components=3)),
+                     MiniBatchKMeans(n_clusters=4)])
+    return X, pipe.fit_ensemble(X=X, ngen=1, init_ensemble_size=3,
+                                saved_ensemble_size=3)
+
+
+def test_compact_save_load(tmpdir):
+    X, fitted = _fitted()
+    path = os.path.join(str(tmpdir), 'pipe.elm')
+    fitted.save(path)
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    assert len(manifest['ensemble']) == 3
+    assert manifest['arrays']
+    loaded = Pipeline.load(path)
+    assert isinstance(loaded.ensemble, LazyEnsemble)
+    assert len(loaded.ensemble) == 3
+    for (tag, member), (tag2, member2) in zip(fitted.ensemble, loaded.ensemble):
+        assert tag == tag2
+        assert np.array_equal(member.predict(X), member2.predict(X))
+    assert len(loaded.predict_many(X=X)) == 3
+
+
+def test_serialize_pipe_compact(tmpdir):
+    X, fitted = _fitted()
+    serialize_pipe(fitted, str(tmpdir), 'tag')
+    assert os.path.isdir(os.path.join(str(tmpdir), 'tag.elm'))
+    loaded = load_pipe_from_tag(str(tmpdir), 'tag')
+    assert len(loaded.ensemble) == len(fitted.ensemble)
+    serialize_pipe(fitted, str(tmpdir), 'tag_pkl', compact=False)
+    assert os.path.isfile(os.path.join(str(tmpdir), 'tag_pkl.pkl'))
+    assert len(load_pipe_from_tag(str(tmpdir), 'tag_pkl').ensemble) == 3
+
+
+def test_compact_shared_arrays_stored_once(tmpdir):
+    X, fitted = _fitted()
+    path = os.path.join(str(tmpdir), 'pipe.elm')
+    fitted.save(path)
+    with open(os.path.join(path, MANIFEST)) as f:
+        stats = json.load(f)['array_stats']
+    # IncrementalPCA is fit to the same sample by each member
+    assert stats['stored'] < stats['referenced']
+    assert stats['stored_bytes'] < stats['referenced_bytes']
+    assert os.path.getsize(os.path.join(path, 'arrays.bin')) < stats['referenced_bytes']
+    loaded = Pipeline.load(path)
+    pca1, pca2 = (member.steps[1][1]._estimator for _, member in loaded.ensemble[:2])
+    assert np.array_equal(pca1.components_, pca2.components_)
+    pca1.components_[:] = 0
+    assert not np.array_equal(pca1.components_, pca2.components_)
@@ -184,3 +184,172 @@ def test_kmeans_model_selection(client=None):
     assert len(fitted.ensemble) == en['saved_ensemble_size']
     preds = fitted.predict_many(**sa)
     assert len(preds) == len(fitted.ensemble) * len(SAMPLER_DATA_SOURCE['args_list'])
+
+
+def test_predict_many_tile_size():
+    pipe = Pipeline([steps.Flatten(),
+                     MiniBatchKMeans(n_clusters=3)])
+    fitted = pipe.fit_ensemble(X=X, ngen=1, init_ensemble_size=1,
+                               saved_ensemble_size=1)
+    whole = fitted.predict_many(X=X)[0]
+    tiled = fitted.predict_many(X=X, tile_size=(7, 30))[0]
+    assert tiled.predict.shape == whole.predict.shape
+    assert tiled.canvas == whole.canvas
+    assert np.all(tiled.predict.values == whole.predict.values)
+
+
+def test_predict_many_tile_threads_with_client(monkeypatch):
+    import threading
+    import elm.pipeline.predict_many as predict_many_module
+    pipe = Pipeline([steps.Flatten(),
+                     MiniBatchKMeans(n_clusters=3)])
+    fitted = pipe.fit_ensemble(X=X, ngen=1, init_ensemble_size=1,
+                               saved_ensemble_size=1)
+    whole = fitted.predict_many(X=X)[0]
+    threads = set()
+    predict_tile = predict_many_module._predict_tile
+    def recording_predict_tile(*args, **kwargs):
+        threads.add(threading.current_thread().ident)
+        return predict_tile(*args, **kwargs)
+    monkeypatch.setattr(predict_many_module, '_predict_tile', recording_predict_tile)
+    with client_context('THREAD_POOL') as client:
+        tiled = fitted.predict_many(X=X, tile_size=(7, 30), tile_threads=4,
+                                    client=client)[0]
+    # tiles of the single (sample, model) task run in parallel
+    assert len(threads) > 1
+    assert np.all(tiled.predict.values == whole.predict.values)
+
+
+def test_sample_cache_reuses_samples():
+    calls = []
+    def counting_sampler(h, w, bands, **kwargs):
+        calls.append((h, w, bands))
+        return example_sampler(h, w, bands)
+    pipe = Pipeline([steps.Flatten(), MiniBatchKMeans(n_clusters=3)])
+    kw = dict(sampler=counting_sampler, args_list=[(20, 30, 3)],
+              ngen=3, init_ensemble_size=2)
+    pipe.fit_ensemble(**kw)
+    assert len(calls) == 3
+    del calls[:]
+    pipe.fit_ensemble(sample_cache=True, **kw)
+    assert len(calls) == 1
+
+
+def test_stateless_prefix_shared_by_members():
+    calls = []
+    def counting_modify(X, y=None, sample_weight=None, **kwargs):
+        calls.append(1)
+        return (X, y, sample_weight)
+    pipe = Pipeline([steps.ModifySample(counting_modify),
+                     steps.Flatten(),
+                     MiniBatchKMeans(n_clusters=3)])
+    assert pipe.stateless_prefix()[0] == 2
+    X = example_sampler(20, 30, 3)
+    fitted = pipe.fit_ensemble(X=X, ngen=1, init_ensemble_size=4)
+    assert len(fitted.ensemble) == 4
+    assert len(calls) == 1
+    for tag, member in fitted.ensemble:
+        assert member.predict(X).size == 20 * 30
+
+
+def test_successive_halving():
+    from elm.pipeline.ensemble import _halving_rungs
+    assert _halving_rungs(9, 9) == [(9, 1), (3, 3), (1, 9)]
+    assert _halving_rungs(9, 2) == [(9, 2)]
+    assert _halving_rungs(4, 8, eta=2, min_batches=2) == [(4, 2), (2, 4), (1, 8)]
+    pipe = Pipeline([steps.Flatten(), MiniBatchKMeans(n_clusters=3)])
+    X = example_sampler(20, 30, 3)
+    fitted = pipe.fit_ensemble(X=X, ngen=1, init_ensemble_size=9,
+                               partial_fit_batches=9,
+                               successive_halving=dict(score_weights=[1]))
+    # halving cuts partial_fit calls, not ensemble members
+    assert len(fitted.ensemble) == 9
+    for tag, member in fitted.ensemble:
+        assert member.predict(X).size == 20 * 30
+    fitted = pipe.fit_ensemble(X=X, ngen=2, init_ensemble_size=9,
+                               saved_ensemble_size=3,
+                               partial_fit_batches=9,
+                               successive_halving=dict(score_weights=[1]))
+    assert len(fitted.ensemble) == 3
+
+
+def test_mini_batches_row_chunks():
+    X = example_sampler(20, 30, 3)
+    chunks = [row_chunk(X, idx, 3) for idx in range(3)]
+    assert [rows for _, rows in chunks] == [slice(0, 180), slice(180, 390), slice(390, 600)]
+    assert [chunk.canvas.buf_ysize for chunk, _ in chunks] == [6, 7, 7]
+    flat = flatten(X)
+    assert np.all(flatten(chunks[1][0]).flat.values == flat.flat.values[180:390])
+    flat_chunk, rows = row_chunk(flat, 1, 3)
+    assert rows == slice(200, 400)
+    assert np.all(flat_chunk.flat.values == flat.flat.values[200:400])
+    n_rows = []
+    class CountingKMeans(MiniBatchKMeans):
+        def partial_fit(self, X, *args, **kwargs):
+            n_rows.append(X.shape[0])
+            return super(CountingKMeans, self).partial_fit(X, *args, **kwargs)
+    pipe = Pipeline([steps.Flatten(), CountingKMeans(n_clusters=3)])
+    pipe.fit_ensemble(X=X, ngen=1, init_ensemble_size=1,
+                      partial_fit_batches=3, mini_batches=True)
+    assert n_rows == [180, 210, 210]
+
+
+def test_graph_size_constant_over_generations(monkeypatch):
+    import elm.pipeline.ensemble as ens
+    from elm.config.dask_settings import _find_get_func_for_client
+    graph_sizes = []
+    def recording_get_func(client):
+        get = _find_get_func_for_client(client)
+        def recording_get(dsk, keys, **kwargs):
+            graph_sizes.append(len(dsk))
+            return get(dsk, keys, **kwargs)
+        return recording_get
+    monkeypatch.setattr(ens, '_find_get_func_for_client', recording_get_func)
+    pipe = Pipeline([steps.Flatten(), MiniBatchKMeans(n_clusters=3)])
+    pipe.fit_ensemble(X=example_sampler(20, 30, 3), ngen=4, init_ensemble_size=2)
+    assert len(graph_sizes) == 4
+    assert len(set(graph_sizes)) == 1
+
+
+def test_make_samples_dask_scatter():
+    from elm.config.dask_settings import _scatter_func_for_client
+    from elm.sample_util.samplers import make_samples_dask
+    assert _scatter_func_for_client(None) is None
+    scattered = []
+    def scatter(items):
+        scattered.append(items)
+        return ['future-{}'.format(idx) if item is not None else None
+                for idx, item in enumerate(items)]
+    pipe = Pipeline([steps.Flatten(), MiniBatchKMeans(n_clusters=3)])
+    dsk = make_samples_dask(X, None, None, pipe, None, None, {},
+                            scatter=scatter)
+    (task,) = dsk.values()
+    assert len(scattered) == 1 and scattered[0][0] is X
+    assert task[1:] == ('future-0', None, None)
+
+
+def test_process_pool_client(monkeypatch):
+    monkeypatch.setenv('DASK_PROCESSES', '2')
+    pipe = Pipeline([steps.Flatten(), MiniBatchKMeans(n_clusters=3)])
+    X = example_sampler(20, 30, 3)
+    with client_context('PROCESS_POOL') as client:
+        fitted = pipe.fit_ensemble(X=X, ngen=2, init_ensemble_size=2,
+                                   client=client)
+    _train_asserts(fitted, 2)
+    assert fitted.ensemble[0][1].predict(X).size == 20 * 30
+    with client_context('PROCESS_POOL') as client:
+        preds = fitted.predict_many(X=X, client=client)
+    assert len(preds) == 2
+    assert all(pred.predict.shape == (20, 30) for pred in preds)
+
+
+def test_local_cluster_client(monkeypatch):
+    pytest.importorskip('distributed')
+    monkeypatch.setenv('DASK_PROCESSES', '2')
+    pipe = Pipeline([steps.Flatten(), MiniBatchKMeans(n_clusters=3)])
+    X = example_sampler(20, 30, 3)
+    with client_context('LOCAL_CLUSTER') as client:
+        assert len(client.ncores()) == 2
+        fitted = pipe.fit_ensemble(X=X, ngen=2, init_ensemble_size=2,
+                                   client=client)
+    _train_asserts(fitted, 2)
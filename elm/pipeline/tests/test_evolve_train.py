@@ -102,3 +102,21 @@ def test_finds_true_num_clusters_fast():
 def test_finds_true_num_clusters_slow(n_clusters, n_features, early_stop):
     tst_finds_true_n_clusters_once(n_clusters, n_features, early_stop)
 
+
+
+def test_steady_state_samples_computed_once():
+    from elm.config.dask_settings import _executor_for_client
+    from elm.pipeline.evolve_train import _shared_samples
+    calls = []
+    def sampler(key):
+        calls.append(key)
+        return key
+    dsk = {'sample_0': (sampler, 0), 'sample_1': (sampler, 1)}
+    with _executor_for_client(None) as executor:
+        live_graph = _shared_samples(executor.submit, dsk)
+        for _ in range(4):  # individuals of one generation
+            live_graph(('sample_0',))
+        assert calls == [0]
+        graph = live_graph(('sample_1',))
+    assert calls == [0, 1]
+    assert set(graph) == {'sample_1'}
@@ -200,3 +200,90 @@ def test_pipeline_new_with_params():
     assert p2.steps[-1][-1].cluster_centers_.shape[0] == 7
 
 
+
+
+def test_pipeline_block_size():
+    from sklearn.cluster import MiniBatchKMeans
+    X = random_elm_store()
+    blocks = list(flatten_blocks(X, 1000))
+    flat = flatten(X)
+    assert sum(b.flat.shape[0] for b in blocks) == flat.flat.shape[0]
+    assert np.all(np.concatenate([b.flat.values for b in blocks]) == flat.flat.values)
+    assert np.all(blocks[1].flat.space.values == np.arange(960, 1920))
+    p = Pipeline([steps.Flatten(),
+                  ('scale', steps.StandardScaler()),
+                  ('pca', steps.Transform(IncrementalPCA(n_components=2))),
+                  ('kmeans', MiniBatchKMeans(n_clusters=3))],
+                 block_size=1000)
+    p.fit(X)
+    assert p.steps[1][-1]._estimator.n_samples_seen_ == flat.flat.shape[0]
+    assert p.steps[2][-1]._estimator.n_samples_seen_ == flat.flat.shape[0]
+    pred = p.predict(X)
+    assert pred.size == flat.flat.shape[0]
+    p2 = Pipeline([steps.Flatten(), KMeans(n_clusters=3)], block_size=1000)
+    with pytest.raises(ValueError):
+        p2.fit(X)
+
+
+def _mean_sq_distance(model, X, **kwargs):
+    '''Mean squared distance of rows of X to the nearest cluster center'''
+    return -model._estimator.score(X.flat.values) / X.flat.values.shape[0]
+
+
+@pytest.mark.parametrize('block_size', [1000, 999, 7999])
+def test_pipeline_block_size_score(block_size):
+    from sklearn.cluster import MiniBatchKMeans
+    X = random_elm_store()
+    flat = flatten(X)
+    # 8000 rows (100 x 80) in blocks of whole raster rows: the last
+    # block has 320 rows with block_size=999 and 80 with block_size=7999
+    p = Pipeline([steps.Flatten(), ('kmeans', MiniBatchKMeans(n_clusters=3))],
+                 scoring=_mean_sq_distance,
+                 block_size=block_size)
+    p.fit(X)
+    expected = _mean_sq_distance(p, flat)
+    assert np.isclose(p._score, expected)
+
+
+def test_transform_cache():
+    from elm.sample_util.sample_cache import TransformCache
+    cache = TransformCache(max_items=10)
+    X = random_elm_store()
+    p = Pipeline([steps.Flatten(),
+                  ('pca', steps.Transform(IncrementalPCA(n_components=3))),
+                  ('kmeans', KMeans(n_clusters=2))])
+    p.fit(X, transform_cache=cache, sample_key='sample_0')
+    assert len(cache) == 2 and cache.hits == 0
+    p2 = p.new_with_params(kmeans__n_clusters=3)
+    p2.fit(X, transform_cache=cache, sample_key='sample_0')
+    assert cache.hits == 2
+    assert p2.steps[1][1] is not p.steps[1][1]
+    assert np.all(p2.steps[1][1]._estimator.components_ == p.steps[1][1]._estimator.components_)
+    assert p2.predict(X).size == X.band_1.size
+    p3 = p.new_with_params(pca__n_components=2)
+    p3.fit(X, transform_cache=cache, sample_key='sample_0')
+    assert cache.hits == 3 and len(cache) == 3
+
+
+def test_transform_cache_not_in_fit_tasks():
+    import dill
+    from elm.pipeline.ensemble import _one_generation_dask_graph
+    from elm.sample_util.sample_cache import TransformCache
+    cache = TransformCache(max_items=10)
+    X = random_elm_store()
+    p = Pipeline([steps.Flatten(),
+                  ('pca', steps.Transform(IncrementalPCA(n_components=3))),
+                  ('kmeans', KMeans(n_clusters=2))])
+    p.fit(X, transform_cache=cache, sample_key='sample_0')
+    assert cache.nbytes > X.band_1.nbytes
+    dsk = {'sample_0': (X, None, None)}
+    dsk, _, _ = _one_generation_dask_graph(dsk, [('tag_0', p)], {}, ('sample_0',),
+                                           1, 0, 'fit', transform_cache=cache)
+    fit_tasks = [v for k, v in dsk.items() if k.startswith('fit-gen-0')]
+    assert fit_tasks
+    for task in fit_tasks:
+        func = task[0]
+        assert func.keywords['transform_cache'] is cache
+        # the task carries the cache id and settings, not cached outputs
+        assert len(dill.dumps(func.keywords['transform_cache'])) < 1000
+    assert dill.loads(dill.dumps(cache)) is cache
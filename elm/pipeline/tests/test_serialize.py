@@ -0,0 +1,91 @@
+from functools import partial
+import glob
+import os
+
+import numpy as np
+import pytest
+import rasterio as rio
+
+from elm.pipeline.parse_run_config import _prediction_kwargs
+from elm.pipeline.serialize import (serialize_prediction, load_prediction,
+                                    predict_to_netcdf, predict_to_geotiff)
+from elm.pipeline.tests.util import random_elm_store
+
+
+def test_predict_to_netcdf_round_trip(tmpdir):
+    y = random_elm_store(bands=['predict'], height=20, width=30)
+    fname = predict_to_netcdf(y, os.path.join(str(tmpdir), 'tag', 'pred'), chunks=8)
+    assert fname.endswith('.nc') and os.path.exists(fname)
+    loaded = load_prediction(fname)
+    assert np.allclose(loaded.predict.values, y.predict.values)
+    assert loaded.canvas.geo_transform == tuple(y.canvas.geo_transform)
+    assert loaded.canvas.bounds == y.canvas.bounds
+    assert list(loaded.band_order) == ['predict']
+
+
+def test_serialize_prediction_writes_once(tmpdir):
+    X = random_elm_store(bands=['band_1', 'band_2', 'band_3'], height=20, width=30)
+    y = random_elm_store(bands=['predict'], height=20, width=30)
+    assert serialize_prediction(None, y, X, 'tag', elm_predict_path=str(tmpdir))
+    files = glob.glob(os.path.join(str(tmpdir), 'tag', '*'))
+    assert len(files) == 1 and files[0].endswith('.nc')
+    with pytest.raises(ValueError):
+        serialize_prediction(None, y, X, 'tag', elm_predict_path=str(tmpdir),
+                             prediction_format='csv')
+
+
+def test_predict_to_geotiff(tmpdir):
+    y = random_elm_store(bands=['predict_0', 'predict_1'], height=600, width=700)
+    fname = predict_to_geotiff(y, os.path.join(str(tmpdir), 'tag', 'pred'), blocksize=256)
+    assert fname.endswith('.tif')
+    with rio.open(fname) as r:
+        assert r.count == 2
+        assert r.block_shapes[0] == (256, 256)
+        assert r.overviews(1) == [2]
+        assert np.allclose(r.read(2), y.predict_1.values)
+        assert tuple(r.transform.to_gdal()) == tuple(y.canvas.geo_transform)
+
+
+def _x_with_crs():
+    X = random_elm_store(bands=['band_1', 'band_2'], height=300, width=300)
+    # as in the rasterio meta of a band from elm.readers.load_dir_of_tifs_array
+    X.band_1.attrs['meta'] = {'crs': rio.crs.CRS.from_epsg(32618)}
+    return X
+
+
+def test_serialize_prediction_geotiff_crs(tmpdir):
+    X = _x_with_crs()
+    y = random_elm_store(bands=['predict'], height=300, width=300)
+    serialize_prediction(None, y, X, 'tag', elm_predict_path=str(tmpdir),
+                         prediction_format='geotiff', blocksize=256)
+    fname, = glob.glob(os.path.join(str(tmpdir), 'tag', '*.tif'))
+    with rio.open(fname) as r:
+        assert r.crs.to_epsg() == 32618
+
+
+class _Config(object):
+    def __init__(self, elm_predict_path, predict):
+        self.ELM_PREDICT_PATH = elm_predict_path
+        self.predict = predict
+
+
+def test_serialize_prediction_from_config(tmpdir):
+    X = _x_with_crs()
+    y = random_elm_store(bands=['predict'], height=300, width=300)
+    config = _Config(str(tmpdir), {'prediction_format': 'geotiff', 'blocksize': 128})
+    step = {'pipeline': [], 'data_source': 'ds', 'predict': 'kmeans'}
+    assert _prediction_kwargs(config, step) == {'prediction_format': 'geotiff',
+                                                'blocksize': 128}
+    # as in elm.pipeline.parse_run_config.config_to_pipeline
+    serialize = partial(serialize_prediction, config, **_prediction_kwargs(config, step))
+    assert serialize(y=y, X=X, tag='tag', elm_predict_path=None)
+    fname, = glob.glob(os.path.join(str(tmpdir), 'tag', '*.tif'))
+    with rio.open(fname) as r:
+        assert r.block_shapes[0] == (128, 128)
+        assert r.crs.to_epsg() == 32618
+    # keys in the "run" action override the "predict" section
+    step.update(prediction_format='netcdf', complevel=1)
+    serialize = partial(serialize_prediction, config, **_prediction_kwargs(config, step))
+    assert serialize(y=y, X=X, tag='tag2', elm_predict_path=None)
+    files = glob.glob(os.path.join(str(tmpdir), 'tag2', '*'))
+    assert len(files) == 1 and files[0].endswith('.nc')
@@ -11,6 +11,8 @@ import logging
 import os
 import re
 
+from elm.config import parse_env_vars
+from elm.readers.meta_cache import cached_load_meta, META_CACHE_FILE
 from elm.readers.netcdf import load_netcdf_array, load_netcdf_meta
 from elm.readers.hdf4 import load_hdf4_array, load_hdf4_meta
 from elm.readers.hdf5 import load_hdf5_array, load_hdf5_meta
@@ -43,7 +45,7 @@ def _find_file_type(filename):
     return ftype
 
 
-def load_array(filename, meta=None, band_specs=None, reader=None):
+def load_array(filename, meta=None, band_specs=None, reader=None, **reader_kwargs):
     '''Create ElmStore from HDF4 / 5 or NetCDF files or TIF directories
 
     Parameters:
@@ -51,11 +53,16 @@ def load_array(filename, meta=None, band_specs=None, reader=None):
         :meta:       meta data from "filename" already loaded
         :band_specs: list of strings or elm.readers.BandSpec objects
         :reader:     named reader from elm.readers - one of:  ('tif', 'hdf4', 'hdf5', 'netcdf')
+        :reader_kwargs: keyword arguments to the TIF reader, such as
+                     lazy=True.  See :func:`elm.readers.load_dir_of_tifs_array`
 
     Returns:
         :es:         ElmStore (xarray.Dataset) with bands specified by band_specs as DataArrays in "data_vars" attribute
     '''
     ftype = reader or _find_file_type(filename)
+    if reader_kwargs and ftype != 'tif':
+        raise ValueError('Keyword arguments {} are only used by the tif '
+                         'reader (reader: {})'.format(reader_kwargs, ftype))
     if meta is None:
         if ftype == 'tif':
             meta = _load_meta(filename, ftype, band_specs=band_specs)
@@ -68,7 +75,8 @@ def load_array(filename, meta=None, band_specs=None, reader=None):
     elif ftype == 'hdf4':
         return load_hdf4_array(filename, meta, band_specs=band_specs)
     elif ftype == 'tif':
-        return load_dir_of_tifs_array(filename, meta, band_specs=band_specs)
+        return load_dir_of_tifs_array(filename, meta, band_specs=band_specs,
+                                      **reader_kwargs)
     elif ftype == 'hdf':
         try:
             es = load_hdf4_array(filename, meta, band_specs=band_specs)
@@ -79,6 +87,17 @@ def load_array(filename, meta=None, band_specs=None, reader=None):
 
 
 def _load_meta(filename, ftype, **kwargs):
+    '''Load meta, using the cache in ELM_TRAIN_PATH if ELM_META_CACHE
+    is set in the environment'''
+    env = parse_env_vars()
+    if env.get('ELM_META_CACHE') and env.get('ELM_TRAIN_PATH'):
+        cache_file = os.path.join(env['ELM_TRAIN_PATH'], META_CACHE_FILE)
+        return cached_load_meta(_load_meta_uncached, cache_file,
+                                filename, ftype, **kwargs)
+    return _load_meta_uncached(filename, ftype, **kwargs)
+
+
+def _load_meta_uncached(filename, ftype, **kwargs):
 
     if ftype == 'netcdf':
         return load_netcdf_meta(filename)
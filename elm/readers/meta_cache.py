@@ -0,0 +1,125 @@
+'''
+--------------------------
+
+``elm.readers.meta_cache``
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+A persistent cache of metadata from :func:`elm.readers.load_meta`,
+stored in a SQLite file in ELM_TRAIN_PATH.
+
+Entries are keyed by the absolute path, reader type and keyword
+arguments (e.g. band_specs) and are invalidated when the modification
+time or size of the file (or of any file in a TIF directory) changes.
+
+Enable the cache with the environment variable ``ELM_META_CACHE=1``.
+'''
+
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+__all__ = []
+
+META_CACHE_FILE = 'elm_meta_cache.sqlite'
+
+_CREATE_TABLE = '''CREATE TABLE IF NOT EXISTS meta
+                   (key TEXT PRIMARY KEY,
+                    filename TEXT,
+                    stamp TEXT,
+                    meta BLOB)'''
+
+
+def _file_stamp(filename):
+    '''Return a string of (name, mtime, size) for filename or, for a
+    directory, for each file in it'''
+    if os.path.isdir(filename):
+        stamps = []
+        for fname in sorted(os.listdir(filename)):
+            st = os.stat(os.path.join(filename, fname))
+            stamps.append((fname, st.st_mtime, st.st_size))
+        return repr(stamps)
+    st = os.stat(filename)
+    return repr((os.path.basename(filename), st.st_mtime, st.st_size))
+
+
+def _cache_key(filename, ftype, **kwargs):
+    '''Hash of absolute filename, reader type and keyword arguments'''
+    kw = repr(sorted(kwargs.items()))
+    token = repr((os.path.abspath(filename), ftype, kw))
+    return hashlib.sha1(token.encode()).hexdigest()
+
+
+def _connect(cache_file):
+    dirname = os.path.dirname(cache_file)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+    conn = sqlite3.connect(cache_file, timeout=30)
+    conn.execute(_CREATE_TABLE)
+    return conn
+
+
+def get_cached_meta(cache_file, filename, ftype, **kwargs):
+    '''Return cached metadata for filename or None if not cached
+    or if the file has changed since it was cached
+
+    Parameters:
+        :cache_file: SQLite file name
+        :filename:   file or TIF directory passed to load_meta
+        :ftype:      reader type, such as "tif" or "hdf4"
+        :kwargs:     other keyword arguments to load_meta, e.g. band_specs
+    '''
+    key = _cache_key(filename, ftype, **kwargs)
+    try:
+        conn = _connect(cache_file)
+        try:
+            row = conn.execute('SELECT stamp, meta FROM meta WHERE key = ?',
+                               (key,)).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.info('Failed to read meta cache {}: {}'.format(cache_file, repr(e)))
+        return None
+    if row is None:
+        return None
+    stamp, meta = row
+    if stamp != _file_stamp(filename):
+        logger.debug('Meta cache is stale for {}'.format(filename))
+        return None
+    return pickle.loads(meta)
+
+
+def set_cached_meta(cache_file, filename, ftype, meta, **kwargs):
+    '''Save metadata for filename in the cache (see get_cached_meta)'''
+    key = _cache_key(filename, ftype, **kwargs)
+    try:
+        blob = pickle.dumps(meta, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        logger.info('Cannot cache meta for {}: {}'.format(filename, repr(e)))
+        return
+    try:
+        conn = _connect(cache_file)
+        try:
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?, ?, ?)',
+                             (key, filename, _file_stamp(filename),
+                              sqlite3.Binary(blob)))
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.info('Failed to write meta cache {}: {}'.format(cache_file, repr(e)))
+
+
+def cached_load_meta(load_meta_func, cache_file, filename, ftype, **kwargs):
+    '''Call load_meta_func(filename, ftype, \*\*kwargs) unless its
+    output is already in cache_file'''
+    meta = get_cached_meta(cache_file, filename, ftype, **kwargs)
+    if meta is not None:
+        logger.debug('Meta cache hit for {}'.format(filename))
+        return meta
+    meta = load_meta_func(filename, ftype, **kwargs)
+    set_cached_meta(cache_file, filename, ftype, meta, **kwargs)
+    return meta
@@ -24,7 +24,8 @@ from elm.readers import ElmStore, Canvas
 from elm.readers.util import (canvas_to_coords,
                               VALID_X_NAMES,
                               VALID_Y_NAMES,
-                              get_shared_canvas)
+                              get_shared_canvas,
+                              xy_canvas)
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +34,9 @@ AGG_METHODS = tuple('all any argmax argmin max mean median min prod sum std var'
 __all__ = ['select_canvas',
            'drop_na_rows',
            'flatten',
+           'flatten_blocks',
+           'row_chunk',
+           'window_elm_store',
            'filled_flattened',
            'check_is_flat',
            'inverse_flatten',
@@ -150,13 +154,19 @@ def drop_na_rows(flat):
     return no_na
 
 
-def flatten(es, ravel_order='C'):
+def flatten(es, ravel_order='C', dtype=np.float64):
     '''Given an ElmStore with different rasters (DataArray) as bands,
     flatten the rasters into a single 2-D DataArray called "flat"
     in a new ElmStore.
 
     Params:
         :elm_store:  3-d ElmStore (band, y, x)
+        :ravel_order: order argument to numpy.ravel
+        :dtype:      dtype of the "flat" DataArray (default float64)
+                     or None to keep the dtype of the bands, e.g.
+                     uint16 for Landsat.  Only with dtype=None and one
+                     band is "flat" a view of the band (where possible),
+                     so that in-place changes to "flat" change the band
 
     Returns:
         :elm_store:  2-d ElmStore (space, band)
@@ -170,37 +180,191 @@ def flatten(es, ravel_order='C'):
     band_names = [band for idx, band in enumerate(es.band_order)]
     old_canvases = []
     old_dims = []
-    for idx, band in enumerate(band_names):
-        data_arr = getattr(es, band, None)
+    band_arrs = [getattr(es, band, None) for band in band_names]
+    # a view of the band only if the caller opted in with dtype=None
+    view_ok = dtype is None and len(band_arrs) == 1
+    if dtype is None:
+        dtype = np.result_type(*(data_arr.dtype for data_arr in band_arrs))
+    dtype = np.dtype(dtype)
+    for idx, (band, data_arr) in enumerate(zip(band_names, band_arrs)):
         canvas = getattr(data_arr, 'canvas', None)
         old_canvases.append(canvas)
         old_dims.append(data_arr.dims)
+        values = data_arr.values
+        if values.ndim == 1:
+            # its already flat
+            new_values = values
+        else:
+            # ravel is a view, not a copy, if values are contiguous
+            new_values = values.ravel(order=ravel_order)
         if store is None:
             # TODO consider canvas here instead
             # of assume fixed size, but that
             # makes reverse transform harder (is that important?)
-            store = np.empty((data_arr.values.size,
-                              len(es.data_vars))) * np.NaN
-        if data_arr.values.ndim == 1:
-            # its already flat
-            new_values = data_arr.values
-        else:
-            new_values = data_arr.values.ravel(order=ravel_order)
+            if view_ok and new_values.dtype == dtype:
+                store = new_values[:, np.newaxis]
+                continue
+            store = np.empty((new_values.size, len(band_arrs)), dtype=dtype)
         store[:, idx] = new_values
+    attrs = _flat_attrs(es, shared_canvas, old_canvases, old_dims)
+    return _flat_elm_store(store, np.arange(store.shape[0]), band_names, attrs)
+
+
+def _flat_attrs(es, shared_canvas, old_canvases, old_dims):
+    '''attrs of a flattened ElmStore, used by inverse_flatten'''
     attrs = {}
     attrs['canvas'] = shared_canvas
     attrs['old_canvases'] = old_canvases
     attrs['old_dims'] = old_dims
     attrs['flatten_data_array'] = True
     attrs.update(copy.deepcopy(es.attrs))
-    flat = ElmStore({'flat': xr.DataArray(store,
-                        coords=[('space', np.arange(store.shape[0])),
+    return attrs
+
+
+def _flat_elm_store(store, space, band_names, attrs):
+    return ElmStore({'flat': xr.DataArray(store,
+                        coords=[('space', space),
                                 ('band', band_names)],
                         dims=('space',
                               'band'),
                         attrs=attrs)},
                     attrs=attrs)
-    return flat
+
+
+def flatten_blocks(es, block_size, ravel_order='C', dtype=np.float64):
+    '''Generator of flattened ElmStores, each with about block_size
+    rows ("space") of the ElmStore that flatten would return.
+
+    When all bands are 2-D and ravel_order is "C", each block
+    is read from whole raster rows, so for lazy (dask) bands only the
+    rows of one block are in memory at once.  The "space" coordinate
+    of each block is its index in the full flattened ElmStore.
+
+    Params:
+        :es:         3-d ElmStore (band, y, x)
+        :block_size: approximate number of rows (pixels) per block
+        :ravel_order: order argument to numpy.ravel
+        :dtype:      dtype of the "flat" DataArray (see flatten)
+
+    Returns:
+        :generator:  of 2-d ElmStores (space, band)
+    '''
+    if not block_size or block_size < 1:
+        raise ValueError('Expected block_size to be a positive int, not {}'.format(block_size))
+    if check_is_flat(es, raise_err=False):
+        size = es.flat.shape[0]
+        for start in range(0, size, block_size):
+            block = es.flat.isel(space=slice(start, start + block_size))
+            yield ElmStore({'flat': block}, attrs=copy.deepcopy(es.attrs))
+        return
+    shared_canvas = get_shared_canvas(es)
+    if not shared_canvas:
+        raise ValueError('es.select_canvas should be called before flatten_blocks when, as in this case, the bands do not all have the same Canvas')
+    band_names = list(es.band_order)
+    band_arrs = [getattr(es, band) for band in band_names]
+    if dtype is None:
+        dtype = np.result_type(*(data_arr.dtype for data_arr in band_arrs))
+    dtype = np.dtype(dtype)
+    old_canvases = [getattr(data_arr, 'canvas', None) for data_arr in band_arrs]
+    old_dims = [data_arr.dims for data_arr in band_arrs]
+    attrs = _flat_attrs(es, shared_canvas, old_canvases, old_dims)
+    by_rows = ravel_order == 'C' and all(data_arr.ndim == 2 for data_arr in band_arrs)
+    if by_rows:
+        nrows, ncols = band_arrs[0].shape
+        rows_per_block = max(1, block_size // ncols)
+        slices = [(slice(start, start + rows_per_block), start * ncols)
+                  for start in range(0, nrows, rows_per_block)]
+    else:
+        band_values = [data_arr.values.ravel(order=ravel_order)
+                       for data_arr in band_arrs]
+        size = band_values[0].size
+        slices = [(slice(start, start + block_size), start)
+                  for start in range(0, size, block_size)]
+    for slc, offset in slices:
+        store = None
+        for idx, data_arr in enumerate(band_arrs):
+            if by_rows:
+                new_values = np.asarray(data_arr[slc].values).ravel()
+            else:
+                new_values = band_values[idx][slc]
+            if store is None:
+                store = np.empty((new_values.size, len(band_arrs)), dtype=dtype)
+            store[:, idx] = new_values
+        space = np.arange(offset, offset + store.shape[0])
+        yield _flat_elm_store(store, space, band_names, copy.deepcopy(attrs))
+
+
+def _window_canvas(canvas, rows, cols):
+    '''Canvas of the window (rows, cols) of canvas'''
+    gt = list(canvas.geo_transform)
+    gt[0] += cols.start * gt[1] + rows.start * gt[2]
+    gt[3] += cols.start * gt[4] + rows.start * gt[5]
+    return xy_canvas(gt, cols.stop - cols.start, rows.stop - rows.start,
+                     canvas.dims, ravel_order=canvas.ravel_order)
+
+
+def window_elm_store(X, canvas, rows, cols):
+    '''ElmStore of the window (rows, cols) of every band in X
+
+    Params:
+        :X:      3-d ElmStore (band, y, x) with bands on canvas
+        :canvas: Canvas shared by the bands of X
+        :rows:   slice of rows (canvas.dims[0])
+        :cols:   slice of columns (canvas.dims[1])
+
+    Returns:
+        :es:     ElmStore with the canvas of the window
+    '''
+    tile_canvas = _window_canvas(canvas, rows, cols)
+    ydim, xdim = canvas.dims
+    es_dict = OrderedDict()
+    for band in X.band_order:
+        data_arr = getattr(X, band)
+        tile = data_arr.isel(**{ydim: rows, xdim: cols})
+        tile.attrs = copy.deepcopy(data_arr.attrs)
+        tile.attrs['canvas'] = tile_canvas
+        es_dict[band] = tile
+    attrs = copy.deepcopy(X.attrs)
+    attrs['canvas'] = tile_canvas
+    return ElmStore(es_dict, attrs=attrs)
+
+
+
+def _chunk_bounds(size, idx, n_chunks):
+    '''Start, stop of chunk idx of n_chunks nearly equal chunks of size'''
+    return size * idx // n_chunks, size * (idx + 1) // n_chunks
+
+
+def row_chunk(es, idx, n_chunks):
+    '''Return chunk idx of n_chunks of the rows of an ElmStore.  For a
+    flat ElmStore the chunk is of the rows ("space") of es.flat, otherwise
+    of whole raster rows of every band, so that the chunk flattens to
+    contiguous rows of flatten(es).
+
+    Params:
+        :es:       flat ElmStore or 3-d ElmStore (band, y, x) with all
+                   bands on the same Canvas (ravel_order "C")
+        :idx:      index of the chunk, 0 <= idx < n_chunks
+        :n_chunks: number of chunks
+
+    Returns:
+        :(chunk, flat_rows): the ElmStore chunk and the slice of the rows
+            of flatten(es) it contains, e.g. for indexing y or sample_weight
+    '''
+    if not 0 <= idx < n_chunks:
+        raise ValueError('Expected 0 <= idx < n_chunks, not idx={} n_chunks={}'.format(idx, n_chunks))
+    if check_is_flat(es, raise_err=False):
+        start, stop = _chunk_bounds(es.flat.shape[0], idx, n_chunks)
+        chunk = es.flat.isel(space=slice(start, stop))
+        return ElmStore({'flat': chunk}, attrs=copy.deepcopy(es.attrs)), slice(start, stop)
+    canvas = get_shared_canvas(es)
+    if not canvas or canvas.ravel_order != 'C':
+        raise ValueError('row_chunk requires an ElmStore with all bands on '
+                         'one Canvas with ravel_order "C" (or a flat ElmStore)')
+    nrows, ncols = canvas.buf_ysize, canvas.buf_xsize
+    start, stop = _chunk_bounds(nrows, idx, n_chunks)
+    chunk = window_elm_store(es, canvas, slice(start, stop), slice(0, ncols))
+    return chunk, slice(start * ncols, stop * ncols)
 
 
 def filled_flattened(na_dropped):
@@ -210,7 +374,7 @@ def filled_flattened(na_dropped):
     if not shp:
         return na_dropped
     shp = (shp[0], len(na_dropped.band_order))
-    filled = np.empty(shp) * np.NaN
+    filled = np.full(shp, np.NaN)
     filled[na_dropped.space, :] = na_dropped.flat.values
     attrs = copy.deepcopy(na_dropped.attrs)
     attrs.update(copy.deepcopy(na_dropped.flat.attrs))
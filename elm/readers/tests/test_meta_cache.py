@@ -0,0 +1,32 @@
+import os
+import time
+
+from elm.readers.meta_cache import (cached_load_meta,
+                                    get_cached_meta,
+                                    set_cached_meta)
+
+
+def test_meta_cache(tmpdir):
+    cache_file = os.path.join(str(tmpdir), 'cache', 'meta.sqlite')
+    fname = os.path.join(str(tmpdir), 'granule.hdf')
+    with open(fname, 'w') as f:
+        f.write('abc')
+    calls = []
+    def load(filename, ftype, **kwargs):
+        calls.append(filename)
+        return {'name': filename, 'band_meta': [{'long_name': 'Band 1'}]}
+    assert get_cached_meta(cache_file, fname, 'hdf4') is None
+    meta = cached_load_meta(load, cache_file, fname, 'hdf4')
+    meta2 = cached_load_meta(load, cache_file, fname, 'hdf4')
+    assert meta == meta2
+    assert len(calls) == 1
+    # Other kwargs are a different key
+    cached_load_meta(load, cache_file, fname, 'hdf4', band_specs=['band_1'])
+    assert len(calls) == 2
+    # Changing the file invalidates the entry
+    time.sleep(0.01)
+    with open(fname, 'w') as f:
+        f.write('abcdef')
+    assert get_cached_meta(cache_file, fname, 'hdf4') is None
+    set_cached_meta(cache_file, fname, 'hdf4', {'name': 'x'})
+    assert get_cached_meta(cache_file, fname, 'hdf4') == {'name': 'x'}
@@ -100,3 +100,55 @@ def test_reader_kwargs_window(ftype):
         expected_shape = tuple(map(np.diff, window))
         assert subset.shape == expected_shape
 
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_map_bands_order(threads):
+    out = map_bands(lambda idx, band: (idx, band),
+                    [(idx, 'band_{}'.format(idx)) for idx in range(10)],
+                    threads=threads)
+    assert out == [(idx, 'band_{}'.format(idx)) for idx in range(10)]
+
+
+def test_map_bands_serial_in_worker_thread(monkeypatch):
+    import threading
+    from multiprocessing.pool import ThreadPool
+    import elm.readers.util as reader_util
+    monkeypatch.setattr(reader_util, '_READ_THREADS_ENV', (None, 4))
+    assert reader_util._default_read_threads() == 4
+    names = []
+    def read(idx):
+        names.append(threading.current_thread().name)
+        return idx
+    with ThreadPool(1) as pool:
+        out = pool.apply(map_bands, (read, [(idx,) for idx in range(10)]))
+    assert out == list(range(10))
+    assert len(set(names)) == 1
+    monkeypatch.setattr(reader_util, '_READ_THREADS_ENV', (3, 4))
+    assert reader_util._default_read_threads() == 3
+
+
+def test_flatten_dtype():
+    es = random_elm_store_no_meta()
+    for band in es.data_vars:
+        band_arr = getattr(es, band)
+        band_arr.values = (band_arr.values * 1000).astype(np.uint16)
+    flat = flatten(es, dtype=None)
+    assert flat.flat.values.dtype == np.uint16
+    assert np.all(flat.flat.values[:, 1] == es.band_2.values.ravel(order='C'))
+    flat = flatten(es)
+    assert flat.flat.values.dtype == np.float64
+    one_band = ElmStore({'band_1': es.band_1}, add_canvas=False)
+    flat = flatten(one_band, dtype=None)
+    assert np.shares_memory(flat.flat.values, es.band_1.values)
+
+
+def test_flatten_copies_by_default():
+    es = random_elm_store_no_meta()
+    one_band = ElmStore({'band_1': es.band_1}, add_canvas=False)
+    before = one_band.band_1.values.copy()
+    flat = flatten(one_band)
+    assert flat.flat.values.dtype == np.float64
+    assert not np.shares_memory(flat.flat.values, one_band.band_1.values)
+    flat.flat.values[:] = -1
+    assert np.all(one_band.band_1.values == before)
@@ -5,6 +5,8 @@ import sys
 import attr
 import numpy as np
 import pytest
+import rasterio as rio
+from rasterio.transform import from_origin
 
 from elm.readers.tif import (load_dir_of_tifs_meta,
                              load_dir_of_tifs_array,
@@ -82,3 +84,69 @@ def test_reader_kwargs():
     for b in es.band_order:
         assert getattr(es, b).values.shape == (300, 200)
 
+
+@pytest.mark.skipif(not ELM_HAS_EXAMPLES,
+               reason='elm-data repo has not been cloned')
+def test_read_array_lazy():
+    meta = load_dir_of_tifs_meta(TIF_DIR, band_specs[:2])
+    es = load_dir_of_tifs_array(TIF_DIR, meta, band_specs[:2])
+    meta = load_dir_of_tifs_meta(TIF_DIR, band_specs[:2])
+    es_lazy = load_dir_of_tifs_array(TIF_DIR, meta, band_specs[:2], lazy=True)
+    assert es.band_order == es_lazy.band_order
+    for b in es.band_order:
+        band_arr = getattr(es_lazy, b)
+        assert band_arr.chunks is not None
+        assert np.all(band_arr.values == getattr(es, b).values)
+        assert band_arr.canvas == getattr(es, b).canvas
+
+
+def _write_small_tifs(dirname, **creation_kwargs):
+    '''Write two single band float32 GeoTiffs matching small_band_specs'''
+    arrs = []
+    for band in (1, 2):
+        arr = np.random.uniform(0, 100, (40, 30)).astype(np.float32)
+        fname = os.path.join(dirname, 'small_B{}.TIF'.format(band))
+        with rio.open(fname, 'w', driver='GTiff', height=40, width=30,
+                      count=1, dtype='float32',
+                      transform=from_origin(0., 40., 1., 1.),
+                      **creation_kwargs) as r:
+            r.write(arr, 1)
+        arrs.append(arr)
+    return arrs
+
+
+small_band_specs = [BandSpec('name', '_B1.TIF', 'band_1'),
+                    BandSpec('name', '_B2.TIF', 'band_2')]
+
+
+def _is_memmap(data_arr):
+    arr = data_arr.values
+    while arr is not None:
+        if isinstance(arr, np.memmap):
+            return True
+        arr = arr.base
+    return False
+
+
+def test_read_array_memmap(tmpdir):
+    arrs = _write_small_tifs(str(tmpdir), blockysize=8)
+    meta = load_dir_of_tifs_meta(str(tmpdir), small_band_specs)
+    es = load_dir_of_tifs_array(str(tmpdir), meta, small_band_specs)
+    meta = load_dir_of_tifs_meta(str(tmpdir), small_band_specs)
+    es_memmap = load_dir_of_tifs_array(str(tmpdir), meta, small_band_specs, memmap=True)
+    for b, arr in zip(es.band_order, arrs):
+        assert _is_memmap(getattr(es_memmap, b))
+        assert not _is_memmap(getattr(es, b))
+        assert np.all(getattr(es_memmap, b).values == getattr(es, b).values)
+        assert np.all(getattr(es_memmap, b).values == arr)
+    with pytest.raises(ValueError):
+        load_dir_of_tifs_array(str(tmpdir), meta, small_band_specs, memmap=True, lazy=True)
+
+
+def test_read_array_memmap_compressed_fallback(tmpdir):
+    arrs = _write_small_tifs(str(tmpdir), compress='DEFLATE')
+    meta = load_dir_of_tifs_meta(str(tmpdir), small_band_specs)
+    es_memmap = load_dir_of_tifs_array(str(tmpdir), meta, small_band_specs, memmap=True)
+    for b, arr in zip(es_memmap.band_order, arrs):
+        assert not _is_memmap(getattr(es_memmap, b))
+        assert np.all(getattr(es_memmap, b).values == arr)
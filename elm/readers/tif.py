@@ -12,10 +12,15 @@ Tools for reading GeoTiff files.  Typically use the interface through
 '''
 from collections import OrderedDict
 import copy
+from functools import partial
 import gc
 import logging
 import os
 
+import dask.array as da
+from dask.base import tokenize
+import gdal
+from gdalconst import GA_ReadOnly
 import numpy as np
 import rasterio as rio
 import xarray as xr
@@ -27,6 +32,7 @@ from elm.readers.util import (geotransform_to_coords,
                               raster_as_2d,
                               READ_ARRAY_KWARGS,
                               take_geo_transform_from_meta,
+                              map_bands,
                               BandSpec)
 
 from elm.readers import ElmStore
@@ -37,6 +43,11 @@ __all__ = ['load_tif_meta',
            'load_dir_of_tifs_meta',
            'load_dir_of_tifs_array',]
 
+# With lazy=True, chunks are whole multiples of the GeoTiff's
+# internal blocks, grown to at least this many pixels, so that
+# striped (one-row block) files do not become a chunk per row
+LAZY_MIN_CHUNK_PIXELS = 1024 * 1024
+
 
 def load_tif_meta(filename):
     '''Read the metadata of one TIF file
@@ -150,7 +161,219 @@ def open_prefilter(filename, meta, **reader_kwargs):
         logger.info('Failed to rasterio.open {}'.format(filename))
         raise
 
-def load_dir_of_tifs_array(dir_of_tiffs, meta, band_specs=None):
+
+class _TifBandWindowReader(object):
+    '''Array-like view of band 1 of a GeoTiff that reads only the
+    window requested by __getitem__.  Used with dask.array.from_array
+    by load_dir_of_tifs_array(..., lazy=True)
+
+    Parameters:
+        :filename: GeoTiff file name
+        :window:   None or ((row_start, row_stop), (col_start, col_stop))
+                   limiting the view to part of the file
+    '''
+    def __init__(self, filename, window=None):
+        self.filename = filename
+        with rio.open(filename) as r:
+            self.dtype = np.dtype(r.dtypes[0])
+            self.block_shape = tuple(r.block_shapes[0])
+            if window is None:
+                window = ((0, r.height), (0, r.width))
+        self.window = tuple(map(tuple, window))
+        (row_start, row_stop), (col_start, col_stop) = self.window
+        self.shape = (row_stop - row_start, col_stop - col_start)
+        self.ndim = 2
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (2 - len(key))
+        slcs = []
+        read_window = []
+        for k, size, (start, _) in zip(key, self.shape, self.window):
+            if isinstance(k, slice):
+                k_start, k_stop, step = k.indices(size)
+                slcs.append(slice(None, None, step))
+            else:
+                k_start, k_stop = k, k + 1
+                slcs.append(0)
+            read_window.append((start + k_start, start + k_stop))
+        with rio.open(self.filename) as r:
+            raster = r.read(1, window=tuple(read_window))
+        return raster[tuple(slcs)]
+
+
+def _chunks_from_blocks(block_shape, shape):
+    '''Return dask chunks that are whole multiples of block_shape,
+    each with at least LAZY_MIN_CHUNK_PIXELS pixels where possible'''
+    block_rows, block_cols = block_shape
+    rows, cols = shape
+    mult = max(1, LAZY_MIN_CHUNK_PIXELS // (block_rows * block_cols))
+    if block_cols >= cols:
+        # Striped layout - group strips
+        chunk_rows, chunk_cols = block_rows * mult, cols
+    else:
+        side = max(1, int(np.sqrt(mult)))
+        chunk_rows, chunk_cols = block_rows * side, block_cols * side
+    return (min(chunk_rows, rows), min(chunk_cols, cols))
+
+
+def open_lazy(filename, meta, **reader_kwargs):
+    '''Open a single band GeoTiff as a dask array chunked along
+    its internal block structure.  No pixels are read until the
+    dask array is computed.
+
+    Parameters:
+        :filename: GeoTiff file name
+        :meta:     band metadata from load_tif_meta
+        :reader_kwargs: may contain "window" but not "height" or "width"
+
+    Returns:
+        :(handle, raster): rasterio handle and 2-D dask array
+    '''
+    if 'height' in reader_kwargs or 'width' in reader_kwargs:
+        raise ValueError('load_dir_of_tifs_array with lazy=True does not '
+                         'support resampling with buf_xsize / buf_ysize '
+                         '(BandSpec for {})'.format(filename))
+    reader = _TifBandWindowReader(filename, window=reader_kwargs.get('window'))
+    chunks = _chunks_from_blocks(reader.block_shape, reader.shape)
+    name = 'open-lazy-{}'.format(tokenize(filename,
+                                          reader.window,
+                                          os.path.getmtime(filename)))
+    raster = da.from_array(reader, chunks=chunks, name=name)
+    logger.debug('Lazy open {} shape {} chunks {}'.format(filename, raster.shape, chunks))
+    return rio.open(filename), raster
+
+def _contiguous_band_offset(filename):
+    '''Return (offset, byteorder) of the pixels of a single band GeoTiff
+    if it is uncompressed, striped and its strips are stored contiguously
+    in the file, else None'''
+    ds = gdal.Open(filename, GA_ReadOnly)
+    if ds is None or ds.RasterCount != 1:
+        return None
+    for key in ('COMPRESSION', 'NBITS'):
+        if ds.GetMetadataItem(key, 'IMAGE_STRUCTURE'):
+            return None
+    band = ds.GetRasterBand(1)
+    block_xsize, block_ysize = band.GetBlockSize()
+    if block_xsize != ds.RasterXSize:
+        # Tiled GeoTiff
+        return None
+    with rio.open(filename) as r:
+        itemsize = np.dtype(r.dtypes[0]).itemsize
+    strip_bytes = block_ysize * ds.RasterXSize * itemsize
+    num_strips = -(-ds.RasterYSize // block_ysize)
+    offset = None
+    for strip in range(num_strips):
+        strip_offset = band.GetMetadataItem('BLOCK_OFFSET_0_{}'.format(strip), 'TIFF')
+        if not strip_offset:
+            # Older GDAL or a sparse file with a missing strip
+            return None
+        strip_offset = int(strip_offset)
+        if offset is None:
+            offset = strip_offset
+        elif strip_offset != offset + strip * strip_bytes:
+            return None
+    with open(filename, 'rb') as f:
+        byteorder = {b'II': '<', b'MM': '>'}.get(f.read(2))
+    if byteorder is None:
+        return None
+    return offset, byteorder
+
+
+def open_memmap(filename, meta, **reader_kwargs):
+    '''Open a single band GeoTiff as a read-only numpy.memmap if
+    it is uncompressed and its strips are contiguous, so that
+    repeated loads of the same file share the OS page cache.
+
+    Parameters:
+        :filename: GeoTiff file name
+        :meta:     band metadata from load_tif_meta
+        :reader_kwargs: may contain "window" but not "height" or "width"
+
+    Returns:
+        :(handle, raster): rasterio handle and 2-D numpy.memmap
+            or None if the file layout cannot be memory mapped
+    '''
+    if 'height' in reader_kwargs or 'width' in reader_kwargs:
+        return None
+    layout = _contiguous_band_offset(filename)
+    if layout is None:
+        return None
+    offset, byteorder = layout
+    r = rio.open(filename)
+    dtype = np.dtype(r.dtypes[0]).newbyteorder(byteorder)
+    raster = np.memmap(filename, dtype=dtype, mode='r',
+                       offset=offset, shape=(r.height, r.width))
+    if 'window' in reader_kwargs:
+        (row_start, row_stop), (col_start, col_stop) = reader_kwargs['window']
+        raster = raster[row_start:row_stop, col_start:col_stop]
+    logger.debug('Memory mapped {} at offset {}'.format(filename, offset))
+    return r, raster
+
+
+def _load_tif_band(attrs, lazy, memmap, band_order_info, band_meta):
+    '''Read one GeoTiff of a directory as a DataArray
+
+    Returns:
+        :(band_name, data_arr): band name and xarray.DataArray
+    '''
+    native_dims = ('y', 'x')
+    idx, filename, band_spec = band_order_info
+    band_name = getattr(band_spec, 'name', band_spec)
+    if not isinstance(band_spec, str):
+        reader_kwargs = {k: getattr(band_spec, k)
+                         for k in READ_ARRAY_KWARGS
+                         if getattr(band_spec, k)}
+    else:
+        reader_kwargs = {}
+    if 'buf_xsize' in reader_kwargs:
+        reader_kwargs['width'] = reader_kwargs.pop('buf_xsize')
+    if 'buf_ysize' in reader_kwargs:
+        reader_kwargs['height'] = reader_kwargs.pop('buf_ysize')
+    if 'window' in reader_kwargs:
+        reader_kwargs['window'] = tuple(map(tuple, reader_kwargs['window']))
+        # TODO multx, multy should be handled here as well?
+    if reader_kwargs:
+        multy = band_meta['height'] / reader_kwargs.get('height', band_meta['height'])
+        multx = band_meta['width'] / reader_kwargs.get('width', band_meta['width'])
+    else:
+        multx = multy = 1.
+    band_meta.update(reader_kwargs)
+    geo_transform = take_geo_transform_from_meta(band_spec, **attrs)
+    opened = None
+    if memmap:
+        opened = open_memmap(filename, band_meta, **reader_kwargs)
+    if lazy:
+        handle, raster = open_lazy(filename, band_meta, **reader_kwargs)
+    elif opened is not None:
+        handle, raster = opened
+    else:
+        handle, raster = open_prefilter(filename, band_meta, **reader_kwargs)
+        raster = raster_as_2d(raster)
+    if getattr(band_spec, 'stored_coords_order', ['y', 'x'])[0] == 'y':
+        rows, cols = raster.shape
+    else:
+        rows, cols = raster.T.shape
+    if geo_transform is None:
+        band_meta['geo_transform'] = handle.get_transform()
+    else:
+        band_meta['geo_transform'] = geo_transform
+    band_meta['geo_transform'][1]  *= multx
+    band_meta['geo_transform'][-1] *= multy
+
+    coords_x, coords_y = geotransform_to_coords(cols,
+                                                rows,
+                                                band_meta['geo_transform'])
+    return band_name, xr.DataArray(raster,
+                                   coords=[('y', coords_y),
+                                           ('x', coords_x),],
+                                   dims=native_dims,
+                                   attrs=band_meta)
+
+
+def load_dir_of_tifs_array(dir_of_tiffs, meta, band_specs=None, lazy=False,
+                           memmap=False):
     '''Return an ElmStore where each subdataset is a DataArray
 
     Parameters:
@@ -160,12 +383,20 @@ def load_dir_of_tifs_array(dir_of_tiffs, meta, band_specs=None):
         :band_specs: list of elm.readers.BandSpec objects,
                     defaulting to reading all subdatasets
                     as bands
+        :lazy:     if True, each DataArray is backed by a dask array
+                   chunked along the GeoTiff block structure and
+                   pixels are only read when a chunk is computed
+        :memmap:   if True, bands in uncompressed, striped GeoTiffs
+                   are read-only numpy.memmap views of the files.
+                   Other GeoTiffs are read as usual
     Returns:
         :X: ElmStore
 
     '''
 
     logger.debug('load_dir_of_tifs_array: {}'.format(dir_of_tiffs))
+    if lazy and memmap:
+        raise ValueError('Expected only one of lazy=True or memmap=True')
     band_order_info = meta['band_order_info']
     tifs = ls_tif_files(dir_of_tiffs)
     logger.info('Load tif files from {}'.format(dir_of_tiffs))
@@ -173,54 +404,16 @@ def load_dir_of_tifs_array(dir_of_tiffs, meta, band_specs=None):
     if not len(band_order_info):
         raise ValueError('No matching bands with '
                          'band_specs {}'.format(band_specs))
-    native_dims = ('y', 'x')
     elm_store_dict = OrderedDict()
     attrs = {'meta': meta}
     attrs['band_order'] = []
-    for (idx, filename, band_spec), band_meta in zip(band_order_info, meta['band_meta']):
-        band_name = getattr(band_spec, 'name', band_spec)
-        if not isinstance(band_spec, str):
-            reader_kwargs = {k: getattr(band_spec, k)
-                             for k in READ_ARRAY_KWARGS
-                             if getattr(band_spec, k)}
-        else:
-            reader_kwargs = {}
-        if 'buf_xsize' in reader_kwargs:
-            reader_kwargs['width'] = reader_kwargs.pop('buf_xsize')
-        if 'buf_ysize' in reader_kwargs:
-            reader_kwargs['height'] = reader_kwargs.pop('buf_ysize')
-        if 'window' in reader_kwargs:
-            reader_kwargs['window'] = tuple(map(tuple, reader_kwargs['window']))
-            # TODO multx, multy should be handled here as well?
-        if reader_kwargs:
-            multy = band_meta['height'] / reader_kwargs.get('height', band_meta['height'])
-            multx = band_meta['width'] / reader_kwargs.get('width', band_meta['width'])
-        else:
-            multx = multy = 1.
-        band_meta.update(reader_kwargs)
-        geo_transform = take_geo_transform_from_meta(band_spec, **attrs)
-        handle, raster = open_prefilter(filename, band_meta, **reader_kwargs)
-        raster = raster_as_2d(raster)
-        if getattr(band_spec, 'stored_coords_order', ['y', 'x'])[0] == 'y':
-            rows, cols = raster.shape
-        else:
-            rows, cols = raster.T.shape
-        if geo_transform is None:
-            band_meta['geo_transform'] = handle.get_transform()
-        else:
-            band_meta['geo_transform'] = geo_transform
-        band_meta['geo_transform'][1]  *= multx
-        band_meta['geo_transform'][-1] *= multy
-
-        coords_x, coords_y = geotransform_to_coords(cols,
-                                                    rows,
-                                                    band_meta['geo_transform'])
-        elm_store_dict[band_name] = xr.DataArray(raster,
-                                                 coords=[('y', coords_y),
-                                                         ('x', coords_x),],
-                                                 dims=native_dims,
-                                                 attrs=band_meta)
-
+    # Threads search a snapshot of attrs for geo transform words
+    # because each updates its band_meta (within meta)
+    loaded = map_bands(partial(_load_tif_band, copy.deepcopy(attrs), lazy, memmap),
+                       [(info, band_meta) for info, band_meta
+                        in zip(band_order_info, meta['band_meta'])])
+    for band_name, data_arr in loaded:
+        elm_store_dict[band_name] = data_arr
         attrs['band_order'].append(band_name)
     gc.collect()
     return ElmStore(elm_store_dict, attrs=attrs)
@@ -8,8 +8,11 @@
 from collections import namedtuple, OrderedDict, Sequence
 from itertools import product
 import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import numbers
 import re
+import threading
 
 import gdal
 import numpy as np
@@ -20,14 +23,14 @@ import scipy.interpolate as spi
 import attr
 from attr.validators import instance_of
 
-from elm.config import import_callable
+from elm.config import import_callable, parse_env_vars
 
 __all__ = ['Canvas', 'xy_to_row_col', 'row_col_to_xy',
            'geotransform_to_coords', 'geotransform_to_bounds',
            'canvas_to_coords', 'VALID_X_NAMES', 'VALID_Y_NAMES',
            'xy_canvas','dummy_canvas', 'BandSpec',
            'set_na_from_meta', 'get_shared_canvas',
-           'take_geo_transform_from_meta']
+           'take_geo_transform_from_meta', 'map_bands']
 logger = logging.getLogger(__name__)
 
 SPATIAL_KEYS = ('height', 'width', 'geo_transform', 'bounds')
@@ -200,6 +203,52 @@ def window_to_gdal_read_kwargs(**reader_kwargs):
     return reader_kwargs
 
 
+_READ_THREADS_ENV = None
+
+def _default_read_threads():
+    '''ELM_READ_THREADS if set, else 1 within a dask worker thread
+    or process (tasks already run concurrently there), else
+    DASK_THREADS (number of CPUs).  The environment is parsed
+    once per process'''
+    global _READ_THREADS_ENV
+    if _READ_THREADS_ENV is None:
+        env = parse_env_vars()
+        _READ_THREADS_ENV = (env['ELM_READ_THREADS'], env['DASK_THREADS'])
+    read_threads, dask_threads = _READ_THREADS_ENV
+    if read_threads:
+        return read_threads
+    if (threading.current_thread() is not threading.main_thread()
+            or multiprocessing.current_process().daemon):
+        return 1
+    return dask_threads
+
+
+def map_bands(func, args_list, threads=None):
+    '''Call func on each element of args_list using a thread pool,
+    returning outputs in the same order as args_list.  GDAL and rasterio
+    release the GIL while reading and decompressing, so the bands
+    of a file can be read concurrently.  Used by the GeoTiff reader;
+    not for GDAL drivers that are not thread-safe (HDF4, HDF5).
+
+    Parameters:
+        :func:      function called as func(\*args) for args in args_list
+        :args_list: sequence of argument tuples, typically one per band
+        :threads:   number of threads or None for ELM_READ_THREADS
+                    from the environment (see _default_read_threads)
+
+    Returns:
+        :outputs: list of func outputs
+    '''
+    args_list = list(args_list)
+    threads = threads or _default_read_threads()
+    threads = min(int(threads), len(args_list))
+    if threads <= 1:
+        return [func(*args) for args in args_list]
+    logger.debug('Map {} calls over {} threads'.format(len(args_list), threads))
+    with ThreadPool(threads) as pool:
+        return pool.starmap(func, args_list)
+
+
 def take_geo_transform_from_meta(band_spec=None, required=True, **meta):
     if band_spec and getattr(band_spec, 'meta_to_geotransform', False):
         func = import_callable(band_spec.meta_to_geotransform)
@@ -54,6 +54,8 @@ def select_from_file(*sampler_args,
         :load_meta: Function, typically from elm.readers, to load metadata
         :load_array: Function, typically from elm.readers, to load ElmStore
         :kwargs: may contain "reader" such as "hdf4", "tif", "hdf5", "netcdf"
+                 and "reader_kwargs", a dict passed to load_array,
+                 e.g. {"lazy": True} with the tif reader
 
     '''
     filename = sampler_args[0]
@@ -64,5 +66,8 @@ def select_from_file(*sampler_args,
     args_required, default_kwargs, var_keywords = get_args_kwargs_defaults(load_meta)
     if dry_run:
         return True
-    sample = load_array(filename, band_specs=band_specs, reader=kwargs.get('reader', None))
+    reader_kwargs = kwargs.get('reader_kwargs') or {}
+    sample = load_array(filename, band_specs=band_specs,
+                        reader=kwargs.get('reader', None),
+                        **reader_kwargs)
     return sample
@@ -72,29 +72,35 @@ class Flatten(StepMixin):
     flatten an ElmStore from rasters in separate DataArrays to
     single flat DataArray
 
+    Parameters:
+        :dtype: dtype of the flat DataArray (default float64) or None
+                to keep the dtype of the bands
+
     See also:
         :class:`elm.readers.flatten`
         :mod:`elm.readers.reshape`
     '''
     _sp_step = 'flatten'
 
-    def __init__(self):
-        pass
+    def __init__(self, dtype=np.float64):
+        self.dtype = dtype
 
     def fit_transform(self, X, y=None, sample_weight=None, **kwargs):
-        return (_flatten(X), y, sample_weight)
+        return (_flatten(X, dtype=self.dtype), y, sample_weight)
 
     transform = fit = fit_transform
 
     def get_params(self):
-        return {}
+        return {'dtype': self.dtype}
 
     def set_params(self, **params):
-        if params:
-            raise ValueError("Flatten takes no arguments")
+        if params and not set(params) <= set(('dtype',)):
+            raise ValueError("Flatten takes only the 'dtype' argument")
+        self.dtype = params.get('dtype', self.dtype)
+
     @classmethod
     def from_config_dict(cls, **kwargs):
-        return cls()
+        return cls(**{k: v for k, v in kwargs.items() if k == 'dtype'})
 
 class DropNaRows(StepMixin):
     '''In an ElmStore that has a DataArray flat, drop NA rows
@@ -6,7 +6,7 @@
 
 '''
 import numpy as np
-from numba import njit
+from numba import njit, prange
 from matplotlib.path import Path
 import matplotlib.patches as patches
 import matplotlib.pyplot as plt
@@ -14,7 +14,8 @@ import matplotlib.pyplot as plt
 # Implementation inspired by pseudo-code and pros at:
 # http://www.inf.usi.ch/hormann/papers/Hormann.2001.TPI.pdf
 # These are essentially winding algorithms with a variety of shortcuts
-# A bounding box is also employed as an initial filter.
+# A bounding box is also employed as an initial filter, after a uniform
+# grid index over the bounding boxes selects candidate polygons.
 # If a set of polygons overlap then once a point is included it is not
 # rechecked for its presence in future polygons.
 
@@ -100,15 +101,216 @@ def point_in_poly(x, y, vx, vy, inon=True, closedPoly=False):
     return w
 
 
+def _pack_polys(polys, closedPolys=False):
+    """
+    Concatenate the closed polygons in polys for the numba kernels below.
+
+    Returns:
+        :tuple(vx, vy, offsets, bbox): vertices of polygon p are
+            vx[offsets[p]:offsets[p + 1]] (likewise vy) and bbox[p] is
+            its (minx, maxx, miny, maxy)
+    """
+    vxs, vys = [], []
+    offsets = np.zeros(len(polys) + 1, dtype=np.int64)
+    bbox = np.empty((len(polys), 4))
+    for idx, p in enumerate(polys):
+        p = np.asarray(p, dtype=np.float64)
+        vx = np.ascontiguousarray(p[:, 0])
+        vy = np.ascontiguousarray(p[:, 1])
+        bbox[idx] = (vx.min(), vx.max(), vy.min(), vy.max())
+        if not closedPolys:
+            (vx, vy) = close_poly(vx, vy)
+        vxs.append(vx)
+        vys.append(vy)
+        offsets[idx + 1] = offsets[idx] + vx.size
+    if not vxs:
+        return (np.empty(0), np.empty(0), offsets, bbox)
+    return (np.concatenate(vxs), np.concatenate(vys), offsets, bbox)
+
+
+@njit
+def _grid_cell(x, y, grid):
+    """
+    Index of the grid cell containing (x, y) or -1 if outside the grid.
+    grid is (x0, y0, x1, y1, dx, dy, nxc, nyc) - see _poly_grid
+    """
+    if x < grid[0] or x > grid[2] or y < grid[1] or y > grid[3]:
+        return -1
+    nxc = int(grid[6])
+    nyc = int(grid[7])
+    ix = min(int((x - grid[0]) / grid[4]), nxc - 1)
+    iy = min(int((y - grid[1]) / grid[5]), nyc - 1)
+    return iy * nxc + ix
+
+
 @njit
+def _grid_buckets(bbox, grid):
+    """
+    For each grid cell, the polygons whose bounding box overlaps the
+    cell, in polygon order, as (cell_start, cell_polys) where the
+    polygons of cell c are cell_polys[cell_start[c]:cell_start[c + 1]]
+    """
+    nxc = int(grid[6])
+    nyc = int(grid[7])
+    npoly = bbox.shape[0]
+    counts = np.zeros(nxc * nyc + 1, dtype=np.int64)
+    for p in range(npoly):
+        c0 = _grid_cell(bbox[p, 0], bbox[p, 2], grid)
+        c1 = _grid_cell(bbox[p, 1], bbox[p, 3], grid)
+        for iy in range(c0 // nxc, c1 // nxc + 1):
+            for ix in range(c0 % nxc, c1 % nxc + 1):
+                counts[iy * nxc + ix + 1] += 1
+    cell_start = np.cumsum(counts)
+    fill = cell_start[:-1].copy()
+    cell_polys = np.empty(cell_start[-1], dtype=np.int64)
+    for p in range(npoly):
+        c0 = _grid_cell(bbox[p, 0], bbox[p, 2], grid)
+        c1 = _grid_cell(bbox[p, 1], bbox[p, 3], grid)
+        for iy in range(c0 // nxc, c1 // nxc + 1):
+            for ix in range(c0 % nxc, c1 % nxc + 1):
+                c = iy * nxc + ix
+                cell_polys[fill[c]] = p
+                fill[c] += 1
+    return (cell_start, cell_polys)
+
+
+def _poly_grid(bbox, max_cells=1024):
+    """
+    Uniform grid bucket index over the polygon bounding boxes, with
+    about one cell per polygon (at most max_cells per axis).
+
+    Returns:
+        :tuple(grid, cell_start, cell_polys): see _grid_cell and _grid_buckets
+    """
+    n = max(1, min(max_cells, int(np.ceil(np.sqrt(bbox.shape[0])))))
+    x0, x1 = bbox[:, 0].min(), bbox[:, 1].max()
+    y0, y1 = bbox[:, 2].min(), bbox[:, 3].max()
+    dx = (x1 - x0) / n if x1 > x0 else 1.
+    dy = (y1 - y0) / n if y1 > y0 else 1.
+    grid = np.array([x0, y0, x1, y1, dx, dy, n, n], dtype=np.float64)
+    return (grid,) + _grid_buckets(bbox, grid)
+
+
+@njit
+def _in_packed_polys(x, y, vx, vy, offsets, bbox, grid, cell_start,
+                     cell_polys, inon):
+    """
+    True if (x, y) is in any of the packed polygons that are candidates
+    in its grid cell
+    """
+    c = _grid_cell(x, y, grid)
+    if c < 0:
+        return False
+    for i in range(cell_start[c], cell_start[c + 1]):
+        p = cell_polys[i]
+        if x >= bbox[p, 0] and x <= bbox[p, 1]:
+            if y >= bbox[p, 2] and y <= bbox[p, 3]:
+                if point_in_poly(x, y, vx[offsets[p]:offsets[p + 1]],
+                                 vy[offsets[p]:offsets[p + 1]], inon, True):
+                    return True
+    return False
+
+
+@njit(parallel=True)
+def _points_in_packed_polys(xs, ys, vx, vy, offsets, bbox, grid,
+                            cell_start, cell_polys, inon):
+    n = xs.size
+    inpoly = np.zeros(n, dtype=np.int16)
+    for k in prange(n):
+        if _in_packed_polys(xs[k], ys[k], vx, vy, offsets, bbox, grid,
+                            cell_start, cell_polys, inon):
+            inpoly[k] = True
+    return inpoly
+
+
+@njit(parallel=True)
+def _vec_points_in_packed_polys(x_vec, y_vec, vx, vy, offsets, bbox, grid,
+                                cell_start, cell_polys, inon):
+    nx = x_vec.size
+    ny = y_vec.size
+    inpoly = np.zeros((ny, nx), dtype=np.int16)
+    for ky in prange(ny):
+        y = y_vec[ky]
+        for kx in range(nx):
+            if _in_packed_polys(x_vec[kx], y, vx, vy, offsets, bbox, grid,
+                                cell_start, cell_polys, inon):
+                inpoly[ky, kx] = True
+    return inpoly
+
+
+@njit(parallel=True)
+def _vec_scanline_packed_polys(x_vec, y_vec, vx, vy, offsets, bbox, inon):
+    """
+    Scanline version of _vec_points_in_packed_polys for ascending x_vec.
+    For each row y and polygon, the winding number is accumulated over
+    the sorted edge crossings of the row.  Rows through a vertex and
+    points within rounding of a crossing use point_in_poly.
+    """
+    nx = x_vec.size
+    ny = y_vec.size
+    npoly = offsets.size - 1
+    inpoly = np.zeros((ny, nx), dtype=np.int16)
+    for ky in prange(ny):
+        y = y_vec[ky]
+        for p in range(npoly):
+            if y < bbox[p, 2] or y > bbox[p, 3]:
+                continue
+            kx0 = np.searchsorted(x_vec, bbox[p, 0])
+            kx1 = np.searchsorted(x_vec, bbox[p, 1], side='right')
+            if kx0 >= kx1:
+                continue
+            Px = vx[offsets[p]:offsets[p + 1]]
+            Py = vy[offsets[p]:offsets[p + 1]]
+            on_vertex = False
+            for i in range(Py.size):
+                if Py[i] == y:
+                    on_vertex = True
+                    break
+            if on_vertex:
+                for kx in range(kx0, kx1):
+                    if inpoly[ky, kx] == False:
+                        if point_in_poly(x_vec[kx], y, Px, Py, inon, True):
+                            inpoly[ky, kx] = True
+                continue
+            xc = np.empty(Py.size)
+            dc = np.empty(Py.size, dtype=np.int64)
+            nc = 0
+            for i in range(Py.size - 1):
+                if (Py[i] < y) != (Py[i + 1] < y):
+                    xc[nc] = Px[i] + (y - Py[i]) * (Px[i + 1] - Px[i]) / (Py[i + 1] - Py[i])
+                    dc[nc] = 1 if Py[i + 1] > Py[i] else -1
+                    nc += 1
+            order = np.argsort(xc[:nc])
+            w = 0
+            j = 0
+            for kx in range(kx0, kx1):
+                x = x_vec[kx]
+                tol = 1e-9 * (abs(x) + 1.)
+                while j < nc and xc[order[j]] < x - tol:
+                    w += dc[order[j]]
+                    j += 1
+                if inpoly[ky, kx] == False:
+                    if j < nc and xc[order[j]] <= x + tol:
+                        # on or within rounding of an edge
+                        if point_in_poly(x, y, Px, Py, inon, True):
+                            inpoly[ky, kx] = True
+                    elif w != 0:
+                        inpoly[ky, kx] = True
+    return inpoly
+
+
 def points_in_polys(xs, ys, polys, inon=True, closedPolys=False):
     """
     Checks a set of points to determine those which are in a set of polygons
 
+    The polygon bounding boxes are bucketed in a uniform grid, so each
+    point is only tested against polygons whose bounding box overlaps
+    its grid cell, and points are tested in parallel (numba prange).
+
     Parameters:
         :xs: The x coordinates of the points to test (1D numpy array)
         :ys: The y coordinates of the points to test (must be the same size of xs)
-        :polys: A tuple of numpy arrays size (N, 2), where the first column
+        :polys: A sequence of numpy arrays size (N, 2), where the first column
                 contains the x coordinates of a polygon and the second the y
         :inon: If True consider points on edges and vertices as inside the polygon
         :closedPolys: If True the polygons are closed in the polygons' coordinate definitions
@@ -116,36 +318,18 @@ def points_in_polys(xs, ys, polys, inon=True, closedPolys=False):
     Returns:
         :vector: A vector the size of xs which has a nonzero at an index, i, corresponding to (xs[i], ys[i]) if the point is within the polygons.
     """
-    n = xs.size
-    inpoly = np.zeros(n, dtype=np.int16)
-    for p in polys:
-        vx = p[:, 0]
-        vy = p[:, 1]
-        # compute bounding box
-        maxvx = np.max(vx)
-        minvx = np.min(vx)
-        maxvy = np.max(vy)
-        minvy = np.min(vy)
-        # close the poly
-        if not closedPolys:
-            (Px, Py) = close_poly(vx, vy)
-        else:
-            Px = vx
-            Py = vy
-        for k in range(n):
-            # see if it is already in a polygon, if so, skip
-            if inpoly[k] == False:
-                x = xs[k]
-                y = ys[k]
-                if x >= minvx and x <= maxvx:
-                    if y >= minvy and y <= maxvy:
-                        if point_in_poly(x, y, Px, Py, inon, True):
-                            inpoly[k] = True
-    return inpoly
+    xs = np.ascontiguousarray(xs, dtype=np.float64)
+    ys = np.ascontiguousarray(ys, dtype=np.float64)
+    vx, vy, offsets, bbox = _pack_polys(polys, closedPolys)
+    if not bbox.shape[0]:
+        return np.zeros(xs.size, dtype=np.int16)
+    grid, cell_start, cell_polys = _poly_grid(bbox)
+    return _points_in_packed_polys(xs, ys, vx, vy, offsets, bbox, grid,
+                                   cell_start, cell_polys, inon)
 
 
-@njit
-def vec_points_in_polys(x_vec, y_vec, polys, inon=True, closedPolys=False):
+def vec_points_in_polys(x_vec, y_vec, polys, inon=True, closedPolys=False,
+                        scanline=False):
     """
     Checks a set of points defined by the meshgrid of two input vectors to determine
     those which are in a set of polygons.
@@ -153,45 +337,35 @@ def vec_points_in_polys(x_vec, y_vec, polys, inon=True, closedPolys=False):
     Parameters:
         :x_vec: The x coordinates of the points to test (1D numpy array)
         :y_vec: The y coordinates of the points to test (1D numpy array)
-        :polys: A tuple of numpy arrays size (N, 2), where the first column contains the x coordinates of a polygon and the second the y.
+        :polys: A sequence of numpy arrays size (N, 2), where the first column contains the x coordinates of a polygon and the second the y.
         :inon: If True consider points on edges and vertices as inside the polygon
         :closedPolys: If True the polygons are closed in the polygons' coordinate definitions.
+        :scanline: If True rasterize each polygon row by row from its
+                   edge crossings instead of testing every grid point.
+                   Faster for large polygons on regular grids
 
     Returns:
-        :array: an array size (x_vec.size, y_vect.size) which has a nonzero at an index  (i, j), corresponding to:
+        :array: an array size (y_vec.size, x_vec.size) which has a nonzero at an index  (j, i), corresponding to:
 
             (X, Y) = meshgrid(x_vec, y_vec);
-            (X[i], Y[j]) if the point is within the polygons.
-            
+            (X[j, i], Y[j, i]) if the point is within the polygons.
+
     """
-    nx = x_vec.size
-    ny = y_vec.size
-    inpoly = np.zeros((nx, ny), dtype=np.int16)
-    for p in polys:
-        vx = p[:, 0]
-        vy = p[:, 1]
-        # compute bounding box
-        maxvx = np.max(vx)
-        minvx = np.min(vx)
-        maxvy = np.max(vy)
-        minvy = np.min(vy)
-        # close the poly
-        if not closedPolys:
-            (Px, Py) = close_poly(vx, vy)
-        else:
-            Px = vx
-            Py = vy
-        for ky in range(len(y_vec)):
-            y = y_vec[ky]
-            for kx in range(len(x_vec)):
-                x = x_vec[kx]
-                # see if it is already in a polygon, if so, skip
-                if inpoly[ky, kx] == False:
-                    if x >= minvx and x <= maxvx:
-                        if y >= minvy and y <= maxvy:
-                            if point_in_poly(x, y, Px, Py, inon, True):
-                                inpoly[ky, kx] = True
-    return inpoly
+    x_vec = np.ascontiguousarray(x_vec, dtype=np.float64)
+    y_vec = np.ascontiguousarray(y_vec, dtype=np.float64)
+    vx, vy, offsets, bbox = _pack_polys(polys, closedPolys)
+    if not bbox.shape[0]:
+        return np.zeros((y_vec.size, x_vec.size), dtype=np.int16)
+    if scanline:
+        order = np.argsort(x_vec, kind='mergesort')
+        inpoly = np.empty((y_vec.size, x_vec.size), dtype=np.int16)
+        inpoly[:, order] = _vec_scanline_packed_polys(x_vec[order], y_vec,
+                                                      vx, vy, offsets, bbox,
+                                                      inon)
+        return inpoly
+    grid, cell_start, cell_polys = _poly_grid(bbox)
+    return _vec_points_in_packed_polys(x_vec, y_vec, vx, vy, offsets, bbox,
+                                       grid, cell_start, cell_polys, inon)
 
 
 def plot_poly(plt, poly_x, poly_y):
@@ -0,0 +1,243 @@
+'''
+-----------------------------------
+
+``elm.sample_util.sample_cache``
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+LRU cache of the samples (X, y, sample_weight) returned by a sampler
+in ensemble and evolve_train.  Without it, every generation calls the
+sampler (reading files and running the sampler's steps) again because
+dask does not keep results between graph evaluations.
+
+Give ``sample_cache`` to ``Pipeline.fit_ensemble`` or ``Pipeline.fit_ea``
+as True, a dict of SampleCache keyword arguments or a SampleCache::
+
+    pipe.fit_ensemble(sampler=sampler, args_list=args_list, ngen=5,
+                      sample_cache=dict(max_bytes=4e9,
+                                        spill_dir='/tmp/elm-samples'))
+
+Samples are cached in the memory of the process running the task
+that made them.  Pickling a cache (as PROCESS_POOL, LOCAL_CLUSTER and
+DISTRIBUTED clients do with each task) sends only its id and settings,
+not the cached samples: each worker process keeps one cache per id,
+reused by later tasks (and generations) run in that process.  Samples
+evicted to spill_dir are saved in ``<spill_dir>/<cache_id>/`` and are
+reused by every process that can read spill_dir, so give a spill_dir
+on a filesystem shared by the workers for reuse across workers.  The
+``clear`` method of the cache in the calling process removes that
+directory, including samples spilled by workers.  Hit and miss counts
+are per process.
+'''
+from collections import OrderedDict
+import logging
+import os
+import shutil
+import threading
+import uuid
+import weakref
+
+from dask.base import tokenize
+import dill
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['SampleCache', 'TransformCache']
+
+# Caches by cache_id in this process.  Caches created by unpickling
+# (in a worker process) are also held in _WORKER_CACHES so that later
+# tasks in the worker reuse them
+_CACHES = weakref.WeakValueDictionary()
+_WORKER_CACHES = {}
+_CACHES_LOCK = threading.RLock()
+
+
+def _cache_in_process(cls, cache_id, kwargs):
+    '''Return the cache with cache_id in this process, creating
+    it on first use in a worker (see SampleCache.__reduce__)'''
+    with _CACHES_LOCK:
+        cache = _CACHES.get(cache_id)
+        if cache is None:
+            cache = cls(cache_id=cache_id, **kwargs)
+            _WORKER_CACHES[cache_id] = cache
+        return cache
+
+
+def _sample_nbytes(sample):
+    '''Total nbytes of the ElmStore / arrays in a sample'''
+    if not isinstance(sample, (tuple, list)):
+        sample = (sample,)
+    return sum(getattr(item, 'nbytes', 0) for item in sample
+               if item is not None)
+
+
+class SampleCache(object):
+    '''LRU cache of samples keyed by sampler, sampler args and data_source
+
+    Parameters:
+        :max_items: maximum number of samples in memory or None for no limit
+        :max_bytes: maximum total nbytes of samples in memory or None for no limit
+        :spill_dir: None to discard samples evicted from memory or a
+                    directory where evicted samples are saved (with dill)
+                    and reloaded from when used again
+        :cache_id:  None (default) for a new cache, otherwise the id
+                    of a cache in another process (see module docstring)
+    '''
+    def __init__(self, max_items=None, max_bytes=None, spill_dir=None,
+                 cache_id=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.cache_id = cache_id or uuid.uuid4().hex
+        self.hits = 0
+        self.misses = 0
+        self._mem = OrderedDict()
+        self._nbytes = {}
+        self._spilled = set()
+        self._lock = threading.RLock()
+        with _CACHES_LOCK:
+            _CACHES.setdefault(self.cache_id, self)
+
+    def __len__(self):
+        return len(self._mem)
+
+    def __contains__(self, key):
+        if key in self._mem:
+            return True
+        fname = self._spill_fname(key)
+        return fname is not None and os.path.exists(fname)
+
+    def _spill_fname(self, key):
+        if not self.spill_dir:
+            return None
+        return os.path.join(self.spill_dir, self.cache_id, key + '.pkl')
+
+    @property
+    def nbytes(self):
+        '''Total nbytes of samples in memory'''
+        return sum(self._nbytes.values())
+
+    def get(self, key):
+        '''Return the sample for key or None if not cached'''
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return self._mem[key]
+            fname = self._spill_fname(key)
+            if fname is None or not os.path.exists(fname):
+                self.misses += 1
+                return None
+            logger.debug('Load spilled sample {}'.format(fname))
+            with open(fname, 'rb') as f:
+                sample = dill.load(f)
+            self.hits += 1
+            self._put(key, sample)
+            return sample
+
+    def put(self, key, sample):
+        '''Add a sample to the cache, evicting least recently used
+        samples if max_items or max_bytes are exceeded'''
+        with self._lock:
+            self._put(key, sample)
+
+    def _put(self, key, sample):
+        self._mem[key] = sample
+        self._mem.move_to_end(key)
+        self._nbytes[key] = _sample_nbytes(sample)
+        self._evict()
+
+    def _evict(self):
+        while self._mem and ((self.max_items is not None and len(self._mem) > self.max_items) or
+                             (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            key, sample = self._mem.popitem(last=False)
+            self._nbytes.pop(key)
+            self._spill(key, sample)
+
+    def _spill(self, key, sample):
+        fname = self._spill_fname(key)
+        if fname is None or os.path.exists(fname):
+            return
+        dirname = os.path.dirname(fname)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        logger.debug('Spill sample to {}'.format(fname))
+        # Other processes may read fname as soon as it exists
+        tmp = '{}.{}.tmp'.format(fname, os.getpid())
+        with open(tmp, 'wb') as f:
+            dill.dump(sample, f, protocol=dill.HIGHEST_PROTOCOL)
+        os.replace(tmp, fname)
+        self._spilled.add(key)
+
+    def get_or_create(self, key, func, *args, **kwargs):
+        '''Return the cached sample for key or call func(\*args, \*\*kwargs)
+        and cache its output'''
+        sample = self.get(key)
+        if sample is None:
+            sample = func(*args, **kwargs)
+            self.put(key, sample)
+        return sample
+
+    def clear(self):
+        '''Remove all samples from memory and spill_dir, including
+        samples spilled by copies of this cache in other processes'''
+        with self._lock:
+            self._mem.clear()
+            self._nbytes.clear()
+            if self.spill_dir:
+                shutil.rmtree(os.path.join(self.spill_dir, self.cache_id),
+                              ignore_errors=True)
+            self._spilled.clear()
+
+    def __repr__(self):
+        return ('<elm.sample_util.sample_cache.SampleCache> {} samples ({} bytes) in '
+                'memory, {} spilled, {} hits, {} misses').format(len(self),
+                                                                self.nbytes,
+                                                                len(self._spilled),
+                                                                self.hits,
+                                                                self.misses)
+
+    def __reduce__(self):
+        '''Pickle only the id and settings of the cache.  Unpickling
+        returns the cache with that id in the unpickling process'''
+        kwargs = dict(max_items=self.max_items,
+                      max_bytes=self.max_bytes,
+                      spill_dir=self.spill_dir)
+        return (_cache_in_process, (self.__class__, self.cache_id, kwargs))
+
+
+class TransformCache(SampleCache):
+    '''LRU cache of fitted Pipeline steps and their outputs
+    (X, y, sample_weight, fitted_step), keyed by sample key, step index
+    and a hash of the params of that step and all steps before it.
+    Used by evolve_train so that individuals that differ only in later
+    steps (e.g. the final estimator) reuse fitted earlier steps such as
+    StandardScaler or steps.Transform(PCA()).  Parameters are the same
+    as SampleCache; max_bytes counts the cached outputs.
+    '''
+    def key(self, sample_key, step_idx, params_token):
+        '''Cache key of step step_idx of a Pipeline on sample_key'''
+        return tokenize(sample_key, step_idx, params_token)
+
+    def __repr__(self):
+        return super(TransformCache, self).__repr__().replace('SampleCache', 'TransformCache')
+
+
+def sample_cache_key(sampler, args, data_source):
+    '''Cache key for one sampler call'''
+    return tokenize(sampler, args, data_source)
+
+
+def as_sample_cache(sample_cache, cls=SampleCache):
+    '''Return a cls instance (SampleCache or TransformCache) or None from
+    the sample_cache (or transform_cache) argument of ensemble /
+    evolve_train: None, False, True, a dict of keyword arguments to
+    cls or an instance of cls'''
+    if sample_cache is None or sample_cache is False:
+        return None
+    if sample_cache is True:
+        return cls()
+    if isinstance(sample_cache, dict):
+        return cls(**sample_cache)
+    if isinstance(sample_cache, cls):
+        return sample_cache
+    raise ValueError('Expected None, True, a dict or a {}, not {}'.format(cls.__name__, sample_cache))
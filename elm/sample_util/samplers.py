@@ -6,11 +6,20 @@
 
 '''
 from collections import namedtuple
+from functools import partial
+import hashlib
+import json
 
 import attr
+from dask.base import tokenize
 import numpy as np
 import pandas as pd
 
+from elm.sample_util.sample_cache import sample_cache_key
+
+_NOT_SAMPLER_KWARGS = ('X', 'y', 'sample_weight', 'sampler', 'args_list',
+                       'sampler_args', 'scoring', 'models_share_sample')
+
 sample_idx = 0
 def _next_name(token):
     global sample_idx
@@ -26,7 +35,12 @@ def _make_sample(pipe, args, sampler, data_source):
     return out
 
 
-def make_samples(pipe, args_list, sampler, data_source):
+def _make_sample_cached(sample_cache, key, pipe, args, sampler, data_source):
+    return sample_cache.get_or_create(key, _make_sample, pipe, args,
+                                      sampler, data_source)
+
+
+def make_samples(pipe, args_list, sampler, data_source, sample_cache=None):
     dsk = {}
     if not args_list:
         if 'sampler_args' in data_source:
@@ -35,11 +49,21 @@ def make_samples(pipe, args_list, sampler, data_source):
             raise ValueError('Expected "args_list" or "sampler_args" in data_source')
     for arg in args_list:
         sample_name = _next_name('make_samples_dask')
-        dsk[sample_name] = (_make_sample, pipe, arg, sampler, data_source)
+        if sample_cache is None:
+            dsk[sample_name] = (_make_sample, pipe, arg, sampler, data_source)
+        else:
+            key = sample_cache_key(sampler, arg, data_source)
+            dsk[sample_name] = (partial(_make_sample_cached, sample_cache, key),
+                                pipe, arg, sampler, data_source)
     return dsk
 
 
-def make_samples_dask(X, y, sample_weight, pipe, args_list, sampler, data_source):
+def _sample_tuple(X, y, sample_weight):
+    return (X, y, sample_weight)
+
+
+def make_samples_dask(X, y, sample_weight, pipe, args_list, sampler, data_source,
+                      sample_cache=None, scatter=None):
     '''Dask graph of sampler calls, used in ensemble and EA methods
 
     Parameters:
@@ -49,13 +73,87 @@ def make_samples_dask(X, y, sample_weight, pipe, args_list, sampler, data_source
         :args_list: arguments to pass to sampler
         :sampler: function called on each element of args_list sampler(\*each_element) if X not given
         :data_source: keyword args to sampler
+        :sample_cache: None or a SampleCache of sampler outputs (ignored if X is given)
+        :scatter: None or a function from
+                  elm.config.dask_settings._scatter_func_for_client
+                  to send X, y and sample_weight to distributed workers
+                  once, rather than with every task that uses them
 
     Returns:
         :dsk:  Dask dict
 
     '''
     if X is None:
-        dsk = make_samples(pipe, args_list, sampler, data_source)
+        dsk = make_samples(pipe, args_list, sampler, data_source,
+                           sample_cache=sample_cache)
+    elif scatter is not None:
+        dsk = {_next_name('make_samples_dask'): (_sample_tuple,) + tuple(scatter([X, y, sample_weight]))}
     else:
         dsk = {_next_name('make_samples_dask'): (lambda: (X, y, sample_weight),)}
     return dsk
+
+
+def _callable_name(func):
+    if isinstance(func, str):
+        return func
+    return '{}.{}'.format(getattr(func, '__module__', ''),
+                          getattr(func, '__qualname__',
+                                  getattr(func, '__name__', repr(func))))
+
+
+def _stable_json_default(obj):
+    '''JSON-able form of obj that does not depend on the process,
+    for objects json cannot serialize: attrs classes (e.g. BandSpec)
+    as their class and fields, callables as their qualified names
+    and numpy arrays as a hash of their content'''
+    if attr.has(obj.__class__):
+        return {'__class__': _callable_name(obj.__class__),
+                'fields': attr.asdict(obj, recurse=False)}
+    if isinstance(obj, partial):
+        return {'__partial__': _callable_name(obj.func),
+                'args': obj.args,
+                'keywords': obj.keywords or {}}
+    if callable(obj):
+        return _callable_name(obj)
+    if isinstance(obj, np.ndarray):
+        h = hashlib.sha1(repr((obj.dtype.str, obj.shape)).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+        return {'__ndarray__': h.hexdigest()}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=repr)
+    return repr(obj)
+
+
+def _stable_token(*args):
+    '''Hash of the JSON serialization (with sorted keys) of args'''
+    doc = json.dumps(args, sort_keys=True, default=_stable_json_default)
+    return hashlib.sha1(doc.encode()).hexdigest()
+
+
+def sample_tokens(dsk, X, y, sample_weight, args_list, sampler, data_source):
+    '''Tokens identifying the samples of make_samples_dask across runs
+    (unlike the keys of dsk), e.g. for a FitnessCache saved to disk.
+    Tokens of sampler calls are hashes of a JSON serialization of the
+    sampler's qualified name, its args and the data_source keyword
+    arguments (see _stable_json_default), so they are the same in a
+    new process given equal BandSpecs and args
+
+    Parameters:
+        :dsk: Dask dict returned by make_samples_dask
+        Other parameters are as in make_samples_dask
+
+    Returns:
+        :tokens: dict of dsk key to token
+    '''
+    keys = list(dsk)
+    if X is not None:
+        return {keys[0]: tokenize(X, y, sample_weight)}
+    if not args_list:
+        args_list = [data_source.get('sampler_args')]
+    kwargs = {k: v for k, v in data_source.items()
+              if k not in _NOT_SAMPLER_KWARGS}
+    name = _callable_name(sampler)
+    return {key: _stable_token(name, arg, kwargs)
+            for key, arg in zip(keys, args_list)}
@@ -4,6 +4,7 @@ _DEBUG = False
 from elm.sample_util.polygon_tools import (points_in_polys,
                                            vec_points_in_polys,
                                            plot_poly,
+                                           point_in_poly,
                                            close_poly)
 import numpy as np
 from itertools import product
@@ -61,8 +62,12 @@ def test_points_in_poly_functions():
     def vect_func(polys, inon, closedPolys):
         return vec_points_in_polys(x, y, polys, inon, closedPolys)
 
+    def scanline_func(polys, inon, closedPolys):
+        return vec_points_in_polys(x, y, polys, inon, closedPolys,
+                                   scanline=True)
+
     # functions to test, with their grid input wrapped
-    funcs = [grid_func, vect_func]
+    funcs = [grid_func, vect_func, scanline_func]
 
     # There are 100 points on the grid in total.
     sz = Xr.size
@@ -143,3 +148,33 @@ def test_points_in_poly_functions():
         inpoly = f(polys, inon, closed)
         assert(np.count_nonzero(inpoly) == 31)
         assert(inpoly.size == sz)
+
+
+def test_many_polys_index_and_scanline():
+    # Compare the indexed and scanline results with a brute force
+    # point_in_poly check on a non-square grid with many small polygons
+    rng = np.random.RandomState(0)
+    polys = []
+    for _ in range(300):
+        cx, cy = rng.uniform(0, 50, 2)
+        angles = np.sort(rng.uniform(0, 2 * np.pi, 6))
+        radii = rng.uniform(0.5, 3, 6)
+        polys.append(np.array([cx + radii * np.cos(angles),
+                               cy + radii * np.sin(angles)]).T)
+    x = np.linspace(-1, 51, 157)
+    y = np.linspace(51, -1, 93)
+    expected = np.zeros((y.size, x.size), dtype=np.int16)
+    for j, i in product(range(y.size), range(x.size)):
+        for p in polys:
+            vx, vy = close_poly(p[:, 0], p[:, 1])
+            if point_in_poly(x[i], y[j], vx, vy, True, True):
+                expected[j, i] = 1
+                break
+    vec = vec_points_in_polys(x, y, polys)
+    scan = vec_points_in_polys(x, y, polys, scanline=True)
+    (X, Y) = np.meshgrid(x, y)
+    pts = points_in_polys(X.ravel(), Y.ravel(), polys)
+    assert np.count_nonzero(expected)
+    assert np.array_equal(vec, expected)
+    assert np.array_equal(scan, expected)
+    assert np.array_equal(pts.reshape(expected.shape), expected)
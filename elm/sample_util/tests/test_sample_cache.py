@@ -0,0 +1,94 @@
+from multiprocessing.pool import Pool as ProcessPool
+import os
+
+import dill
+import numpy as np
+
+from elm.config.dask_settings import _find_get_func_for_client
+from elm.sample_util.sample_cache import SampleCache, as_sample_cache
+
+
+def _sample(value, size=10):
+    return (np.full(size, value, dtype=np.float64), None, None)
+
+
+def test_lru_eviction():
+    cache = SampleCache(max_items=2)
+    for key in 'abc':
+        cache.put(key, _sample(ord(key)))
+    assert len(cache) == 2
+    assert cache.get('a') is None
+    cache.get('b')
+    cache.put('d', _sample(0))
+    # "c" was least recently used
+    assert 'c' not in cache and 'b' in cache and 'd' in cache
+    cache = SampleCache(max_bytes=200)
+    for key in 'abc':
+        cache.put(key, _sample(0))  # 80 bytes each
+    assert len(cache) == 2 and cache.nbytes == 160
+
+
+def test_spill_and_reload(tmpdir):
+    spill_dir = str(tmpdir.join('spill'))
+    cache = SampleCache(max_items=1, spill_dir=spill_dir)
+    cache.put('a', _sample(1))
+    cache.put('b', _sample(2))
+    assert len(cache) == 1 and 'a' in cache
+    assert os.listdir(os.path.join(spill_dir, cache.cache_id)) == ['a.pkl']
+    X, _, _ = cache.get('a')
+    assert np.all(X == 1)
+    cache.clear()
+    assert not os.listdir(spill_dir)
+
+
+def test_get_or_create():
+    calls = []
+    def sampler(value):
+        calls.append(value)
+        return _sample(value)
+    cache = as_sample_cache(dict(max_items=4))
+    for _ in range(3):
+        X, _, _ = cache.get_or_create('key', sampler, 5)
+    assert calls == [5]
+    assert cache.hits == 2 and cache.misses == 1
+    assert as_sample_cache(None) is None
+    assert as_sample_cache(cache) is cache
+
+
+def _get_or_create_in_worker(cache, key, value):
+    X, _, _ = cache.get_or_create(key, _sample, value)
+    return X[0], cache.hits, cache.misses, os.getpid()
+
+
+def test_pickle_sends_id_not_samples():
+    cache = SampleCache(max_items=4)
+    cache.put('a', _sample(1, size=100000))
+    assert len(dill.dumps(cache)) < 1000
+    assert dill.loads(dill.dumps(cache)) is cache
+
+
+def test_cache_in_process_pool(tmpdir):
+    spill_dir = str(tmpdir.join('spill'))
+    cache = SampleCache(max_items=1, spill_dir=spill_dir)
+    pool = ProcessPool(1)
+    try:
+        get_func = _find_get_func_for_client(pool)
+        outs = []
+        for gen in range(3):
+            dsk = {'sample': (_get_or_create_in_worker, cache, 'a', 1)}
+            outs.append(get_func(dsk, 'sample'))
+        # one cache in the worker process is reused by each generation
+        assert len(set(out[-1] for out in outs)) == 1
+        assert os.getpid() not in set(out[-1] for out in outs)
+        assert [out[1:3] for out in outs] == [(0, 1), (1, 1), (2, 1)]
+        assert len(cache) == 0 and cache.misses == 0
+        # "a" is spilled by the worker to the shared spill_dir
+        get_func({'sample': (_get_or_create_in_worker, cache, 'b', 2)}, 'sample')
+    finally:
+        pool.close()
+        pool.join()
+    assert 'a' in cache
+    X, _, _ = cache.get('a')
+    assert np.all(X == 1)
+    cache.clear()
+    assert not os.listdir(spill_dir)
@@ -0,0 +1,28 @@
+from elm.readers.util import BandSpec
+from elm.sample_util.samplers import sample_tokens
+
+
+def _sampler(fname, band_specs=None, **kwargs):
+    return fname
+
+
+def _band_specs(window=None):
+    return [BandSpec(search_key='name', search_value='_B{}.TIF'.format(idx),
+                     name='band_{}'.format(idx), window=window)
+            for idx in range(1, 4)]
+
+
+def _tokens(band_specs):
+    dsk = {'make_samples_dask_0': None, 'make_samples_dask_1': None}
+    args_list = ['a.tif', 'b.tif']
+    data_source = {'band_specs': band_specs, 'sampler': _sampler,
+                   'reader_kwargs': {'lazy': True}}
+    return sample_tokens(dsk, None, None, None, args_list, _sampler, data_source)
+
+
+def test_sample_tokens_stable():
+    tokens = _tokens(_band_specs())
+    # fresh BandSpec instances, as in a new process
+    assert tokens == _tokens(_band_specs())
+    assert len(set(tokens.values())) == 2
+    assert tokens != _tokens(_band_specs(window=[[0, 10], [0, 10]]))
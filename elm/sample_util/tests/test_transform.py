@@ -47,3 +47,17 @@ def test_fit():
     trans, y, sample_weight = fitted.transform(X)
     _run_assertions(trans, y, sample_weight)
 
+
+
+def test_partial_fit_mini_batches():
+    rows = []
+    class CountingPCA(IncrementalPCA):
+        def partial_fit(self, X, *args, **kwargs):
+            rows.append(X.shape[0])
+            return super(CountingPCA, self).partial_fit(X, *args, **kwargs)
+    t = steps.Transform(CountingPCA(n_components=3), partial_fit_batches=3,
+                        mini_batches=True)
+    trans, y, sample_weight = t.fit_transform(X)
+    _run_assertions(trans, y, sample_weight)
+    assert len(rows) == 3
+    assert sum(rows) == X.flat.values.shape[0]
@@ -50,3 +50,28 @@ def test_ts_describe():
     bands = tuple(X.band)
     assert bands == ('var', 'skew', 'kurt', 'min', 'max', 'median', 'std', 'np_skew')
 
+
+
+def test_ts_describe_chunks_match_per_pixel():
+    from scipy.stats import describe
+    orig = make_3d()
+    X, _, _ = steps.TSDescribe(band='band_1', axis=0).fit_transform(orig)
+    X2, _, _ = steps.TSDescribe(band='band_1', axis=0, chunk_size=150).fit_transform(orig)
+    assert np.allclose(X.flat.values, X2.flat.values)
+    values = orig.band_1.values
+    for row, (i, j) in enumerate(((0, 0), (0, 1), (3, 7), (9, 99))):
+        pix = values[:, i, j]
+        d = describe(pix)
+        expected = (d.variance, d.skewness, d.kurtosis,
+                    d.minmax[0], d.minmax[1], np.median(pix), np.std(pix))
+        assert np.allclose(X.flat.values[i * 100 + j, :7], expected)
+
+
+def test_ts_probs_histogram_matches_numpy():
+    orig = make_3d()
+    s = steps.TSProbs(band='band_1', num_bins=10, log_probs=False, chunk_size=333)
+    X, _, _ = s.fit_transform(orig)
+    values = orig.band_1.values
+    for i, j in ((0, 0), (5, 50), (9, 99)):
+        hist, _ = np.histogram(values[:, i, j], 10)
+        assert np.allclose(X.flat.values[i * 100 + j], hist / hist.sum())
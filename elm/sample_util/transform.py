@@ -13,6 +13,7 @@ import xarray as xr
 
 from elm.sample_util.step_mixin import StepMixin
 from elm.readers import ElmStore
+from elm.readers.reshape import row_chunk
 
 logger = logging.getLogger(__name__)
 
@@ -22,31 +23,38 @@ __all__ = ['Transform',]
 
 class Transform(StepMixin):
     '''Wraps transform models like IncrementalPCA for use in elm.pipeline.Pipeline'''
-    def __init__(self, estimator, partial_fit_batches=None):
+    def __init__(self, estimator, partial_fit_batches=None, mini_batches=False):
         '''Wraps transform models like IncrementalPCA for use in elm.pipeline.Pipeline
 
            Parameters:
                 :estimator: such as sklearn.decomposition.IncrementalPCA, a model with fit and transform methods
                 :partial_fit_batches: how many times to call partial_fit  each time Pipeline is evaluated
+                :mini_batches: if True, split the rows of X into partial_fit_batches
+                               chunks and call partial_fit once on each chunk,
+                               rather than partial_fit_batches times on all of X
 
         '''
 
         self._estimator = estimator
         self._partial_fit_batches = partial_fit_batches
+        self._mini_batches = mini_batches
         self._params = estimator.get_params()
 
     def set_params(self, **params):
         filtered = {k: v for k, v in params.items()
-                    if k != 'partial_fit_batches'}
+                    if k not in ('partial_fit_batches', 'mini_batches')}
         self._estimator.set_params(**filtered)
         self._params.update(params)
         p = params.get('partial_fit_batches')
         if p:
             self._partial_fit_batches = p
+        if 'mini_batches' in params:
+            self._mini_batches = params['mini_batches']
 
     def get_params(self, **kwargs):
         params = self._estimator.get_params(**kwargs)
         params['partial_fit_batches'] = self._partial_fit_batches
+        params['mini_batches'] = self._mini_batches
         return params
 
     def _fit_trans(self, method, X, y=None, sample_weight=None, **kwargs):
@@ -81,11 +89,23 @@ class Transform(StepMixin):
         return out # a fitted "self"
 
     def partial_fit_batches(self, X, y=None, sample_weight=None, **kwargs):
+        if self._mini_batches:
+            return self._partial_fit_row_chunks(X, y=y, sample_weight=sample_weight, **kwargs)
         for _ in range(self._partial_fit_batches):
             logger.debug('Transform partial fit batch {} of {}'.format(_ + 1, self._partial_fit_batches))
             self.partial_fit(X, y=y, sample_weight=sample_weight, **kwargs)
         return self
 
+    def _partial_fit_row_chunks(self, X, y=None, sample_weight=None, **kwargs):
+        n_chunks = self._partial_fit_batches
+        for idx in range(n_chunks):
+            logger.debug('Transform partial fit row chunk {} of {}'.format(idx + 1, n_chunks))
+            X_chunk, rows = row_chunk(X, idx, n_chunks)
+            y_chunk, sw_chunk = (None if arr is None else np.asarray(arr)[rows]
+                                 for arr in (y, sample_weight))
+            self.partial_fit(X_chunk, y=y_chunk, sample_weight=sw_chunk, **kwargs)
+        return self
+
     def partial_fit(self, X, y=None, sample_weight=None, **kwargs):
         if not hasattr(self._estimator, 'partial_fit'):
             raise ValueError('Cannot give partial_fit_batches to {} (does not have "partial_fit" method)'.format(self._estimator))
@@ -9,7 +9,7 @@ import calendar
 from collections import OrderedDict
 import copy
 import gc
-from itertools import product, combinations
+from itertools import combinations
 import logging
 import glob
 import random
@@ -17,7 +17,7 @@ import random
 from sklearn.cluster import MiniBatchKMeans
 import numpy as np
 import pandas as pd
-from scipy.stats import describe
+from scipy.stats import kurtosis, skew
 import xarray as xr
 
 from elm.model_selection.kmeans import kmeans_aic, kmeans_model_averaging
@@ -26,17 +26,51 @@ from elm.sample_util.step_mixin import StepMixin
 
 
 logger = logging.getLogger(__name__)
-slc = slice(None)
-
-def _ij_for_axis(axis, i, j):
-    if axis == 0:
-        return (slc, i, j)
-    elif axis == 1:
-        return (i, slc, j)
-    elif axis == 2:
-        return (i, j, slc)
-    else:
+
+
+def _iter_ts_chunks(band_arr, axis, chunk_size=None):
+    '''Yield 2-D arrays (pixels, time) of a 3-D cube DataArray whose
+    time axis is axis.  Pixels are in C order of the 2 spatial axes
+    (the order of "space" in ts_describe / ts_probs).  With chunk_size,
+    each array has about chunk_size pixels, taken from consecutive
+    indices of the first spatial axis, so only that part of a lazy
+    (dask) cube is loaded at once'''
+    if axis not in (0, 1, 2):
         raise ValueError("Expected axis in (0, 1, 2)")
+    spatial = [idx for idx in range(3) if idx != axis]
+    shp = band_arr.shape
+    num_rows = shp[spatial[0]] * shp[spatial[1]]
+    if not chunk_size:
+        step = shp[spatial[0]]
+    else:
+        step = max(1, int(chunk_size) // max(1, shp[spatial[1]]))
+    dim = band_arr.dims[spatial[0]]
+    for start in range(0, shp[spatial[0]], step):
+        if step >= shp[spatial[0]]:
+            values = band_arr.values
+        else:
+            values = band_arr.isel(**{dim: slice(start, start + step)}).values
+        values = np.moveaxis(values, axis, -1)
+        yield values.reshape(-1, values.shape[-1])
+
+
+def _spatial_size(band_arr, axis):
+    return int(np.prod([s for idx, s in enumerate(band_arr.shape) if idx != axis]))
+
+
+def _describe_rows(values):
+    '''ts_describe statistics for each row of 2-D values (pixels, time)'''
+    mean = values.mean(axis=1)
+    median = np.median(values, axis=1)
+    std = values.std(axis=1)
+    return np.column_stack((values.var(axis=1, ddof=1),
+                            skew(values, axis=1),
+                            kurtosis(values, axis=1),
+                            values.min(axis=1),
+                            values.max(axis=1),
+                            median,
+                            std,
+                            (mean - median) / std))
 
 
 def ts_describe(X, y=None, sample_weight=None, **kwargs):
@@ -50,6 +84,7 @@ def ts_describe(X, y=None, sample_weight=None, **kwargs):
         kwargs: Keywords:
             axis: Integer like 0, 1, 2 to indicate which is the time axis of cube
             band: The name of the DataArray in ElmStore to run scipy.describe on
+            chunk_size: Number of pixels per chunk, or None for the whole cube at once
     Returns:
         X:  ElmStore with DataArray class "flat"
     '''
@@ -58,22 +93,13 @@ def ts_describe(X, y=None, sample_weight=None, **kwargs):
     band_arr = getattr(X, band)
     cols = ('var', 'skew', 'kurt', 'min', 'max', 'median', 'std', 'np_skew')
     num_cols = len(cols)
-
-    inds = _ij_for_axis(kwargs['axis'], 0, 0)
-    shp = tuple(s for idx, s in enumerate(band_arr.values.shape)
-                if isinstance(inds[idx], int))
-    num_rows = np.prod(shp)
+    num_rows = _spatial_size(band_arr, kwargs['axis'])
     new_arr = np.empty((num_rows, num_cols))
-    for row, (i, j) in enumerate(product(*(range(s) for s in shp))):
-        ind1, ind2, ind3 = _ij_for_axis(kwargs['axis'], i, j)
-        values = band_arr.values[ind1, ind2, ind3]
-        d = describe(values)
-        t = (d.variance, d.skewness, d.kurtosis, d.minmax[0], d.minmax[1])
-        median = np.median(values)
-        std = np.std(values)
-        non_param_skew = (d.mean - median) / std
-        r = t + (median, std, non_param_skew)
-        new_arr[row, :] = r
+    row = 0
+    for values in _iter_ts_chunks(band_arr, kwargs['axis'],
+                                  kwargs.get('chunk_size')):
+        new_arr[row: row + values.shape[0]] = _describe_rows(values)
+        row += values.shape[0]
     attrs = copy.deepcopy(X.attrs)
     attrs.update(kwargs)
     da = xr.DataArray(new_arr,
@@ -85,6 +111,33 @@ def ts_describe(X, y=None, sample_weight=None, **kwargs):
     return (X_new, y, sample_weight)
 
 
+def _bin_indices(values, num_bins, bins=None):
+    '''Bin index of each element of 2-D values (pixels, time).
+    With bins, bins are fixed edges for numpy.searchsorted, otherwise
+    each row has num_bins equal width bins between its min and max
+    like numpy.histogram'''
+    if bins is not None:
+        return np.searchsorted(bins, values, side='left')
+    lo = values.min(axis=1)[:, np.newaxis]
+    hi = values.max(axis=1)[:, np.newaxis]
+    width = hi - lo
+    same = width == 0
+    # numpy.histogram uses the range (v - 0.5, v + 0.5) for constant v
+    lo = np.where(same, lo - 0.5, lo)
+    width = np.where(same, 1., width)
+    indices = ((values - lo) / width * num_bins).astype(np.int64)
+    return np.clip(indices, 0, num_bins - 1)
+
+
+def _count_rows(indices, num_bins):
+    '''Count of each bin index (< num_bins) in each row of indices'''
+    num_rows = indices.shape[0]
+    offset = np.arange(num_rows)[:, np.newaxis] * num_bins
+    counts = np.bincount((indices + offset).ravel(),
+                         minlength=num_rows * num_bins)
+    return counts.reshape(num_rows, num_bins).astype(np.float64)
+
+
 def ts_probs(X, y=None, sample_weight=None, **kwargs):
     '''Fixed or unevenly spaced histogram binning for
     the time dimension of a 3-D cube DataArray in X
@@ -99,6 +152,7 @@ def ts_probs(X, y=None, sample_weight=None, **kwargs):
             bin_size: Size of the fixed bin or None to use np.histogram (irregular bins)
             num_bins: How many bins
             log_probs: Return probabilities associated with log counts? True / False
+            chunk_size: Number of pixels per chunk, or None for the whole cube at once
     Returns:
         X: ElmStore with DataArray called flat that has columns composed of:
             * log transformed counts (if kwargs["log_probs"]) or
@@ -111,46 +165,34 @@ def ts_probs(X, y=None, sample_weight=None, **kwargs):
     num_bins = kwargs['num_bins']
     bin_size = kwargs.get('bin_size', None)
     log_probs = kwargs.get('log_probs', None)
+    axis = kwargs.get('axis', 0)
+    bins = None
     if bin_size is not None:
         bins = np.linspace(-bin_size * num_bins // 2, bin_size * num_bins // 2, num_bins)
-    num_rows = np.prod(band_arr.shape[1:])
+    num_rows = _spatial_size(band_arr, axis)
     col_count =  num_bins
     new_arr = np.empty((num_rows, col_count),dtype=np.float64)
     logger.info("Histogramming...")
     small = 1e-8
-    inds = _ij_for_axis(kwargs['axis'], 0, 0)
-    shp = tuple(s for idx, s in enumerate(band_arr.values.shape)
-                if isinstance(inds[idx], int))
-    for row, (i, j) in enumerate(product(*(range(s) for s in shp))):
-        ind1, ind2, ind3 = _ij_for_axis(kwargs['axis'], i, j)
-        values_slc = band_arr.values[ind1, ind2, ind3]
-        if bin_size is not None:
-            indices = np.searchsorted(bins, values_slc, side='left')
-            binned = np.bincount(indices).astype(np.float64)
+    row = 0
+    for values in _iter_ts_chunks(band_arr, axis, kwargs.get('chunk_size')):
+        indices = _bin_indices(values, num_bins, bins=bins)
+        if bins is not None:
+            # values above the last fixed bin edge go in the last bin
+            np.clip(indices, 0, num_bins - 1, out=indices)
+            # bins above the largest occupied bin of a row are 0 (not log small)
+            empty_tail = np.arange(num_bins) > indices.max(axis=1)[:, np.newaxis]
+        binned = _count_rows(indices, num_bins)
+        if log_probs:
             # add small to avoid log zero
-            if log_probs:
-                was_zero = binned[binned == 0].size
-                binned[binned == 0] = small
-            else:
-                extra = 0.
-            binned /= binned.sum()
-            if log_probs:
-                binned = np.log10(binned)
-            new_arr[row, :binned.size] = binned
-            if binned.size < new_arr.shape[1]:
-                new_arr[row, binned.size:] = 0
-        else:
-            hist, edges = np.histogram(values_slc, num_bins)
-            # add one observation to avoid log zero
-            if log_probs:
-                was_zero = hist[hist == 0].size
-                hist[hist == 0] = small
-            else:
-                extra = 1.0
-            hist = hist.sum()
-            if log_probs:
-                hist = np.log10(hist)
-            new_arr[row, :] = hist
+            binned[binned == 0] = small
+        binned /= binned.sum(axis=1)[:, np.newaxis]
+        if log_probs:
+            binned = np.log10(binned)
+        if bins is not None:
+            binned[empty_tail] = 0
+        new_arr[row: row + binned.shape[0]] = binned
+        row += binned.shape[0]
 
     gc.collect()
     attrs = copy.deepcopy(X.attrs)
@@ -166,10 +208,11 @@ def ts_probs(X, y=None, sample_weight=None, **kwargs):
 
 class TSProbs(StepMixin):
     def __init__(self, axis=0, band=None, bin_size=None,
-                 num_bins=None, log_probs=True):
+                 num_bins=None, log_probs=True, chunk_size=None):
         __doc__ = ts_probs.__doc__
         self._kwargs = dict(axis=axis, band=band, bin_size=bin_size,
-                            num_bins=num_bins, log_probs=log_probs)
+                            num_bins=num_bins, log_probs=log_probs,
+                            chunk_size=chunk_size)
 
     def fit_transform(self, X, y=None, sample_weight=None, **kwargs):
         __doc__ = ts_probs.__doc__
@@ -190,9 +233,9 @@ class TSProbs(StepMixin):
 
 class TSDescribe(StepMixin):
 
-    def __init__(self, axis=0, band=None):
+    def __init__(self, axis=0, band=None, chunk_size=None):
         __doc__ = ts_describe.__doc__
-        self._kwargs = dict(axis=axis, band=band)
+        self._kwargs = dict(axis=axis, band=band, chunk_size=chunk_size)
 
     def fit_transform(self, X, y=None, sample_weight=None, **kwargs):
         __doc__ = ts_describe.__doc__
@@ -35,7 +35,7 @@ LARGE_TEST_SETTINGS = {'ensembles': {'saved_ensemble_size': 2,
                                        'mu': 12,
                                        'k': 4}}}
 
-DASK_CLIENTS = ['ALL', 'SERIAL', 'DISTRIBUTED', 'THREAD_POOL', ]
+DASK_CLIENTS = ['ALL', 'SERIAL', 'DISTRIBUTED', 'THREAD_POOL', 'PROCESS_POOL', 'LOCAL_CLUSTER', ]
 
 STATUS_COUNTER = {'ok': 0, 'fail': 0, 'xfail': 0}
 ETIMES = {}